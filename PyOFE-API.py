@@ -2,110 +2,80 @@
 # Standard libraries
 import os
 import shutil
+import sys
 import threading
-import zipfile
 import json
 import subprocess
 import platform
-import h5py
 # Third-party libraries
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import requests
-import re
-import math
 import subprocess
 import tempfile
-from collections import defaultdict
 from decimal import Decimal, ROUND_HALF_UP
 
+# Request, download and extraction code lives in pyofe_client so it can run without Tk
+import pyofe_client
+from pyofe_client import (
+    UNIVERSITY_URL, FUNCTIONS_JSON_PATH, DOWNLOAD_FOLDER, BATCH_WORKERS,
+    JOB_PENDING, JOB_RUNNING, JOB_RETRYING, JOB_DONE,
+    FitClient, FitIndex, FitQueue, ResultCache, build_fit_params, collect_fit_files,
+    FunctionCatalogue, format_bytes, format_function_catalogue, load_fit_results,
+    load_functions_and_urls_from_json,
+)
+# fit_results.dat tables and the custom plot data derived from them
+import pyofe_results
+from pyofe_hdf5 import HDF5Subset, probe_hdf5
+from pyofe_results import FIT_RESULTS_FILE, CUSTOM_DATA_FILE
 
 
-# Default URLs
-UNIVERSITY_URL = "http://192.92.147.107:8142/fit"
-
-FUNCTIONS_JSON_PATH = "functions.json"
-# Default functions
-MONOEXP = r"Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5])[-1.2<1.2]=Mi \+ (M0-Mi)*exp(-t/T11)"
-BIEXP = r"Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5],T12[0.0001<5],c[0.5<1])[-1.2<1.2]=Mi \+ c*(M0-Mi)*exp(-t/T11) \+(1-c)*(M0-Mi)*exp(-t/T12)"
-
-# Confirm that JSON file with functions is generated if missing
-if not os.path.exists(FUNCTIONS_JSON_PATH):
-    default_functions = {
-        "functions": {
-            "Monoexponential": MONOEXP,
-            "Biexponential": BIEXP
-        },
-        "urls": {
-            "University URL": UNIVERSITY_URL
-        }
-    }
-    with open(FUNCTIONS_JSON_PATH, "w") as json_file:
-        json.dump(default_functions, json_file, indent=4)
-# Function to load functions and URLs from JSON file
-def load_functions_and_urls_from_json():
-    with open(FUNCTIONS_JSON_PATH, "r") as json_file:
-        data = json.load(json_file)
-    return data["functions"], data["urls"]
-# Load functions and URLs from JSON file
-functions, urls = load_functions_and_urls_from_json()
-
-
-def query(url, file_path, params, download_folder):
-    try:
-        with open(file_path, "rb") as file:
-            files = {"file": file}
-
-            # Debug info in GUI before request
-            result_text.delete(1.0, tk.END)
-            result_text.insert(tk.END, "Sending request...\n\n")
-            result_text.insert(tk.END, f"URL: {url}\n")
-            result_text.insert(tk.END, f"File: {file_path}\n")
-            result_text.insert(tk.END, "Parameters:\n")
-            for k, v in params.items():
-                result_text.insert(tk.END, f"  {k}: {v}\n")
-
-            response = requests.post(url, files=files, data=params)
+def show_download_progress(received, total, rate, verb="Downloaded"):
+    # Rewrite only the progress line, which starts at the "progress" mark
+    line = f"{verb}: {format_bytes(received)}"
+    if total:
+        line += f" / {format_bytes(total)} ({100.0 * received / total:.0f}%)"
+    line += f" at {format_bytes(rate)}/s\n"
+    result_text.delete("progress", tk.END)
+    result_text.insert(tk.END, line)
 
-        # Show raw response for debugging
-        result_text.insert(tk.END, f"\nHTTP Status: {response.status_code}\n")
-        result_text.insert(tk.END, f"Content-Type: {response.headers.get('Content-Type', '')}\n")
 
-        if response.status_code != 200:
-            error_body = response.text.strip() if response.text else "No server response body."
-            raise Exception(
-                f"File upload failed.\n"
-                f"Status: {response.status_code}\n"
-                f"Server response:\n{error_body}"
-            )
+def show_upload_progress(sent, total, rate):
+    # Chunked uploads of large inputs (see FitClient.upload)
+    show_download_progress(sent, total, rate, "Uploaded")
 
-        content_type = response.headers.get("Content-Type", "")
-        if "application/zip" not in content_type and "application/octet-stream" not in content_type:
-            raise Exception(
-                f"The query to {url} did not return a ZIP file.\n"
-                f"Returned Content-Type: {content_type}\n"
-                f"Body:\n{response.text[:2000]}"
-            )
 
-        os.makedirs(download_folder, exist_ok=True)
-        zip_file_path = os.path.join(download_folder, "downloaded.zip")
+def hdf5_subset():
+    # Zones entry: "1-4,zone01*" uploads only those zones of an HDF5 input; empty uploads all of it
+    zones = zones_entry.get().strip()
+    return HDF5Subset(zones) if zones else None
 
-        with open(zip_file_path, "wb") as f:
-            f.write(response.content)
 
-        with zipfile.ZipFile(zip_file_path, "r") as zip_file:
-            zip_file.extractall(download_folder)
+def query(url, file_path, params, download_folder, spool=False, progress_callback=None, use_cache=True,
+          subset=None):
+    if progress_callback is None:
+        progress_callback = show_download_progress
 
-        os.remove(zip_file_path)
+    def log(message):
+        result_text.insert(tk.END, message)
+        # Keep the progress line anchored after the last logged message
+        result_text.mark_set("progress", "end-1c")
+        result_text.mark_gravity("progress", tk.LEFT)
 
-        show_fit_result()
+    try:
+        result_text.delete(1.0, tk.END)
+        log("")     # places the progress mark before the first upload progress line
+        client = FitClient(url, spool=spool, cache=result_cache, index=fit_index, subset=subset)
+        client.query(file_path, params, download_folder,
+                     progress_callback=progress_callback, log=log, use_cache=use_cache,
+                     upload_progress=show_upload_progress)
+        show_fit_result(download_folder)
 
     except Exception as e:
         result_text.delete(1.0, tk.END)
         result_text.insert(tk.END, f"Error:\n{e}\n")
         print(f"Error in query function: {e}")
 
-        
+
 def run_curl():
     def execute_curl():
         start_blinking()
@@ -114,30 +84,18 @@ def run_curl():
             symb_size = symb_size_entry.get().strip()
             file_path = file_entry.get().strip()
             function = function_entry.get("1.0", tk.END).strip()
-            logx = logx_var.get()
-            logy = logy_var.get()
-            autox = autox_var.get()
-            autoy = autoy_var.get()
             server_url = url_entry.get().strip()
-            download_folder = "downloaded"
-
-            # Validate file
-            if not file_path:
-                stop_blinking()
-                result_text.delete(1.0, tk.END)
-                result_text.insert(tk.END, "Error: Please select a file.\n")
-                return
 
-            allowed_extensions = ['.hdf5', '.5hdf', '.json', '.sav', '.zip', '.dat', '.sdf', '.txt']
-            file_extension = os.path.splitext(file_path)[1].lower()
-
-            if file_extension not in allowed_extensions:
+            try:
+                params, note = build_fit_params(
+                    file_path, function,
+                    logx_var.get(), logy_var.get(), autox_var.get(), autoy_var.get(),
+                    symb_size
+                )
+            except ValueError as e:
                 stop_blinking()
                 result_text.delete(1.0, tk.END)
-                result_text.insert(
-                    tk.END,
-                    "Error: Please select a valid file (.hdf5, .json, .sav, .zip, .dat, .sdf, .txt).\n"
-                )
+                result_text.insert(tk.END, f"Error: {e}\n")
                 return
 
             # Validate URL
@@ -147,50 +105,13 @@ def run_curl():
                 result_text.insert(tk.END, "Error: Server URL is required.\n")
                 return
 
-            # Prepare common request params
-            params = {
-                "stelar-hdf5": "yes" if is_hdf5_file(file_path) else "no",
-                "logx": logx,
-                "logy": logy,
-                "autox": autox,
-                "autoy": autoy,
-                "symbsize": symb_size,
-                "download": "zip"
-            }
-
-            # Function handling by file type
-            if file_extension == ".json":
+            if note:
                 result_text.delete(1.0, tk.END)
-                result_text.insert(
-                    tk.END,
-                    "JSON file detected: function will be read by the server from the JSON file itself.\n"
-                )
-
-            elif file_extension == ".sav":
-                result_text.delete(1.0, tk.END)
-                result_text.insert(
-                    tk.END,
-                    "SAV file detected: no separate function parameter sent.\n"
-                )
-
-            else:
-                if not function:
-                    stop_blinking()
-                    result_text.delete(1.0, tk.END)
-                    result_text.insert(
-                        tk.END,
-                        "Error: Function definition is required for this file type.\n"
-                    )
-                    return
-
-                function_for_server = " ".join(
-                    line.strip() for line in function.splitlines() if line.strip()
-                )
-
-                params["function"] = function_for_server
+                result_text.insert(tk.END, note)
 
             # Send request
-            query(server_url, file_path, params, download_folder)
+            query(server_url, file_path, params, DOWNLOAD_FOLDER, use_cache=cache_var.get() == "yes",
+                  subset=hdf5_subset())
 
         except Exception as e:
             result_text.delete(1.0, tk.END)
@@ -201,6 +122,95 @@ def run_curl():
     threading.Thread(target=execute_curl, daemon=True).start()
 
 
+batch_queue = None
+result_cache = None
+fit_index = None
+
+def show_batch_status():
+    if batch_queue is None:
+        return
+    counts = batch_queue.counts()
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+
+    lines = [f"Batch fit ({len(batch_queue.jobs)} files) - {summary}\n\n"]
+    for job in batch_queue.jobs:
+        line = f"[{job.status:>9}] {os.path.basename(job.file_path)}"
+        if job.attempts > 1:
+            line += f" (attempt {job.attempts})"
+        if job.status == JOB_DONE:
+            line += f" -> {job.download_folder}"
+        elif job.error:
+            line += f": {job.error.splitlines()[0]}"
+        lines.append(line + "\n")
+
+    result_text.delete(1.0, tk.END)
+    result_text.insert(tk.END, "".join(lines))
+
+def run_batch():
+    global batch_queue
+
+    if batch_queue is not None and any(
+        job.status in (JOB_PENDING, JOB_RUNNING, JOB_RETRYING) for job in batch_queue.jobs
+    ):
+        messagebox.showinfo("Batch Fit", "A batch is already running. Cancel it first.")
+        return
+
+    directory = filedialog.askdirectory(title="Select folder with files to fit")
+    if not directory:
+        return
+
+    server_url = url_entry.get().strip()
+    if not server_url:
+        result_text.delete(1.0, tk.END)
+        result_text.insert(tk.END, "Error: Server URL is required.\n")
+        return
+
+    try:
+        workers = max(1, int(workers_entry.get().strip()))
+    except ValueError:
+        workers = BATCH_WORKERS
+
+    try:
+        subset = hdf5_subset()
+    except ValueError as e:
+        result_text.delete(1.0, tk.END)
+        result_text.insert(tk.END, f"Error: {e}\n")
+        return
+
+    files = collect_fit_files(directory)
+    if not files:
+        result_text.delete(1.0, tk.END)
+        result_text.insert(tk.END, f"No fit input files found in {directory}.\n")
+        return
+
+    function = function_entry.get("1.0", tk.END).strip()
+    symb_size = symb_size_entry.get().strip()
+    flags = (logx_var.get(), logy_var.get(), autox_var.get(), autoy_var.get())
+
+    # Worker threads only schedule the redraw; Tk is touched from the main loop
+    batch_queue = FitQueue(FitClient(server_url, cache=result_cache, index=fit_index, subset=subset),
+                           max_workers=workers,
+                           on_update=lambda job: root.after(0, show_batch_status),
+                           use_cache=cache_var.get() == "yes")
+
+    skipped = []
+    for file_path in files:
+        try:
+            params, _ = build_fit_params(file_path, function, *flags, symb_size)
+        except ValueError as e:
+            skipped.append(f"{os.path.basename(file_path)}: {e}")
+            continue
+        batch_queue.submit(file_path, params)
+
+    show_batch_status()
+    if skipped:
+        result_text.insert(tk.END, "\nSkipped:\n" + "\n".join(skipped) + "\n")
+
+def cancel_batch():
+    if batch_queue is None:
+        return
+    batch_queue.cancel_all()
+    show_batch_status()
 
 
 def open_folder(download_folder):
@@ -231,8 +241,7 @@ def open_folder(download_folder):
         result_text.insert(tk.END, f"Error: Failed to open the folder: {e}\n")
 
 def open_downloaded_folder():
-    download_folder = "downloaded"
-    open_folder(download_folder)
+    open_folder(DOWNLOAD_FOLDER)
 
 def start_blinking():
     def blink():
@@ -257,7 +266,7 @@ def stop_blinking():
 blinking = False
 
 def show_pdf():
-    download_folder = "downloaded"
+    download_folder = DOWNLOAD_FOLDER
     pdf_file = None
 
     # Recursively search for All.pdf in the download folder and its subdirectories
@@ -322,7 +331,8 @@ def browse_file():
     file_path = filedialog.askopenfilename(
         filetypes=[
             ("All files", "*.*"),
-            ("HDF5 files", "*.hdf5"),
+            ("HDF5 files", "*.hdf5 *.h5 *.5hdf"),
+            ("NumPy zone files", "*.npz"),
             ("JSON files", "*.json"),
             ("SAV files", "*.sav"),
             ("ZIP files", "*.zip"),
@@ -350,57 +360,48 @@ def browse_file():
             else:
                 result_text.delete(1.0, tk.END)
                 result_text.insert(tk.END, "No 'Function' field found in the selected JSON file.\n")
+        else:
+            # Zones, dataset shapes and attributes of HDF5 inputs (cached, reused when the fit is sent)
+            try:
+                probe = probe_hdf5(file_path)
+            except OSError:
+                probe = None
+            if probe is not None and probe.is_hdf5:
+                result_text.delete(1.0, tk.END)
+                result_text.insert(tk.END, probe.describe() + "\n")
                 
 
-def clean_fit_results(fit_results):
-    # Replace '| ' with a tab to clean up the data for Excel pasting
-    clean_results = fit_results.replace(" | ", "\t")  # Replacing with tab
-    return clean_results
-
-def show_fit_result():
-    download_folder = "downloaded"
-    json_file = None
-
-    # Search for the first JSON file in the subfolders
-    for root, dirs, files in os.walk(download_folder):
-        for file in files:
-            if file.endswith(".json"):
-                json_file = os.path.join(root, file)
-                break
-        if json_file:
-            break
-
-    if json_file:
-        try:
-            with open(json_file, 'r') as f:
-                json_data = json.load(f)
-
-            fit_results = json_data.get('fit-results')
-            if fit_results:
-                cleaned_fit_results = clean_fit_results(fit_results)
+def show_fit_result(download_folder=DOWNLOAD_FOLDER):
+    try:
+        # Every result JSON in the download (one per zone / subfolder), parsed on a thread pool
+        results = load_fit_results(download_folder)
+    except Exception as e:
+        messagebox.showerror("Error", f"Error reading or parsing the JSON files: {e}")
+        return
 
-                rows = cleaned_fit_results.strip().split("\n")
-                header = rows[0].split("\t")
-                data_rows = [row.split("\t") for row in rows[1:]]
+    if not results.header:
+        if results.skipped:
+            details = "\n".join(f"{source}: {reason}" for source, reason in results.skipped)
+            messagebox.showinfo("Debug Info", f"No 'fit-results' table found.\n{details}")
+        else:
+            messagebox.showerror("Error", "No JSON file found in the downloaded folder or its subfolders.")
+        return
 
-                # ✅ FIX HERE
-                header_line = '\t'.join(header)
-                display_text = f"Headers:\n{header_line}\n\n"
-                for row in data_rows:
-                    display_text += '\t'.join(row) + "\n"
+    # Merged table, written once; the custom data panel reads it back from fit_results.dat
+    merged_text = results.text()
+    header_line, _, rows_text = merged_text.partition("\n")
+    display_text = f"Headers:\n{header_line}\n\n{rows_text}\n"
+    if results.skipped:
+        display_text += "\nSkipped:\n" + "".join(f"{source}: {reason}\n" for source, reason in results.skipped)
 
-                result_text.delete(1.0, tk.END)
-                result_text.insert(tk.END, display_text)
+    result_text.delete(1.0, tk.END)
+    result_text.insert(tk.END, display_text)
 
-                with open("fit_results.dat", "w") as f:
-                    f.write(cleaned_fit_results)
-            else:
-                all_keys = json_data.keys()
-                messagebox.showinfo("Debug Info", f"'fit-results' key not found. Available keys: {list(all_keys)}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error reading or parsing the JSON file: {e}")
-    else:
-        messagebox.showerror("Error", "No JSON file found in the downloaded folder or its subfolders.")
+    try:
+        with open(FIT_RESULTS_FILE, "w") as f:
+            f.write(merged_text)
+    except OSError as e:
+        messagebox.showerror("Error", f"Could not write {FIT_RESULTS_FILE}: {e}")
 
 
 
@@ -425,7 +426,7 @@ def insert_function(event):
         function_entry.insert(tk.END, function_value)
 
 def clean_folder():
-    folder_to_remove = "downloaded"  # Always delete the "downloaded" folder
+    folder_to_remove = DOWNLOAD_FOLDER  # Always delete the "downloaded" folder
 
     # Clear previous content in the result_text widget
     result_text.delete(1.0, tk.END)
@@ -452,22 +453,14 @@ def insert_function(event):
     with open(FUNCTIONS_JSON_PATH, "r") as json_file:
         functions_data = json.load(json_file)
 
-    # Get the full function definition for the selected function
-    if selected_function in functions_data["functions"]:
-        function_definition = functions_data["functions"][selected_function]
+    # Get the full function definition for the selected function, from
+    # functions.json first and then from the server's catalogue
+    function_definition = functions_data["functions"].get(selected_function) or server_functions.get(selected_function)
+    if function_definition:
         # Update the function definition entry box
         function_entry.delete("1.0", tk.END)
         function_entry.insert("1.0", function_definition)
 
-def is_hdf5_file(file_path):
-    try:
-        if file_path.endswith(('.hdf5')):
-            with h5py.File(file_path, 'r'):
-                return True
-        return False
-    except Exception:
-        return False
-
 # Update the URL entry field when an option is selected
 def set_url(event):
     # Get the selected URL key from the dropdown
@@ -482,41 +475,80 @@ def set_url(event):
         url_value = functions_data["urls"][selected_url]
         # Update the URL entry box
         url_entry.delete(0, tk.END)
-        url_entry.insert(tk.END, url_value)  
+        url_entry.insert(tk.END, url_value)
+        load_catalogue()
 #__________________________________________________________________________________________________________
-def list_functions():
-    try:
-        # URL for the /list endpoint
-        url = "http://192.92.147.107:8142/list"
-        url = url_entry.get()
-        url = url.replace("fit" , "list")
+# Functions of the server's /list catalogue, {name: definition}; cached on disk by
+# pyofe_client.FunctionCatalogue and refreshed on a thread, so the UI never waits on it
+server_functions = {}
 
 
-        # Headers to match the curl request
-        headers = {
-            "User-Agent": "curl/7.79.1",  # Example User-Agent from curl
-            "Accept": "*/*"  # Example Accept header from curl
-        }
+def function_names():
+    # functions.json names first, then the server's
+    with open(FUNCTIONS_JSON_PATH, "r") as json_file:
+        local = json.load(json_file)["functions"]
+    return list(local) + [name for name in server_functions if name not in local]
 
-        # Make the GET request
-        response = requests.get(url, headers=headers)
 
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Clear the result_text widget
-            result_text.delete(1.0, tk.END)
+def show_catalogue(url, entry, report=False):
+    # Runs on the Tk thread; ignores answers for a URL that is no longer selected
+    global server_functions
+    if url != url_entry.get().strip():
+        return
+    server_functions = entry["functions"]
+    function_combobox["values"] = function_names()
+    if report:
+        result_text.delete(1.0, tk.END)
+        if entry.get("stale"):
+            result_text.insert(tk.END, f"Server unreachable ({entry['error']}), showing the cached list.\n")
+        result_text.insert(tk.END, "Available Functions:\n\n")
+        result_text.insert(tk.END, format_function_catalogue(entry["functions"]))
 
-            # Insert the raw response into the result_text widget
-            result_text.insert(tk.END, "Available Functions:\n\n")
-            result_text.insert(tk.END, response.text)  # Display the raw response
-        else:
-            # Show an error message if the request failed
-            result_text.delete(1.0, tk.END)
-            result_text.insert(tk.END, f"Error: Failed to fetch functions. Status code: {response.status_code}\n")
-    except requests.exceptions.RequestException as e:
-        # Show an error message if there was an exception
+
+def show_catalogue_error(url, message):
+    if url == url_entry.get().strip():
         result_text.delete(1.0, tk.END)
-        result_text.insert(tk.END, f"Error: An error occurred while fetching functions: {e}\n")
+        result_text.insert(tk.END, f"Error: {message}\n")
+
+
+def load_catalogue(refresh=False, report=False):
+    # The cached catalogue is shown at once, then revalidated with the server in the background
+    url = url_entry.get().strip()
+    if not url:
+        return
+    client = FitClient(url)
+    cached = FunctionCatalogue(client.list_url).cached()
+    if cached is not None:
+        show_catalogue(url, cached)
+
+    def fetch():
+        try:
+            entry = client.catalogue(refresh=refresh)
+        except Exception as e:
+            if report:
+                root.after(0, show_catalogue_error, url, e)
+            return
+        root.after(0, show_catalogue, url, entry, report)
+
+    threading.Thread(target=fetch, daemon=True).start()
+
+
+def list_functions():
+    result_text.delete(1.0, tk.END)
+    result_text.insert(tk.END, "Fetching functions...\n")
+    load_catalogue(refresh=True, report=True)
+
+
+def autocomplete_function(event):
+    # Typing in the function box narrows the dropdown: prefix matches first, then other matches
+    if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+        return
+    typed = function_var.get().strip().lower()
+    names = function_names()
+    if typed:
+        names = ([name for name in names if name.lower().startswith(typed)] +
+                 [name for name in names if typed in name.lower() and not name.lower().startswith(typed)])
+    function_combobox["values"] = names
 
 # Function to add a new function to the JSON file
 def add_function():
@@ -559,7 +591,7 @@ def add_function():
             json.dump(functions_data, json_file, indent=4)
 
         # Update the dropdown menu with only the function names (keys)
-        function_combobox["values"] = list(functions_data["functions"].keys())
+        function_combobox["values"] = function_names()
 
         # Select the newly added function in the dropdown
         function_var.set(function_name)
@@ -619,96 +651,52 @@ def add_url():
 
 
 
-custom_data_file_path = "custom_plot_data.dat"
+custom_data_file_path = CUSTOM_DATA_FILE
 
 def create_custom_data_file(instructions):
     global custom_data_file_path
+    # Formulas are compiled once and evaluated over whole columns (pyofe_results)
     try:
-        formulas = [line.strip() for line in instructions.split('\n') if line.strip()]
-        if not formulas:
-            messagebox.showerror("Error", "No formulas provided.")
-            return
+        pyofe_results.create_custom_data(instructions.split('\n'), FIT_RESULTS_FILE,
+                                         custom_data_file_path)
+    except pyofe_results.FormulaError as e:
+        messagebox.showerror("Evaluation Error", str(e))
+        return
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to process file: {e}")
+        return
 
-        if not os.path.exists("fit_results.dat"):
-            messagebox.showerror("Error", "fit_results.dat not found.")
-            return
+    messagebox.showinfo("Success", f"Custom data file created:\n{custom_data_file_path}")
 
-        with open("fit_results.dat", "r") as f:
-            raw_data = f.read().strip()
 
-        if not raw_data:
-            messagebox.showerror("Error", "fit_results.dat is empty.")
-            return
+FORMULA_CHECK_DELAY_MS = 400            # pause in typing before the formulas are re-evaluated
+formula_check_job = None
 
-        # Preprocess formulas: replace $N with vN
-        processed_formulas = [
-            re.sub(r'\$(\d+)', r'v\1', formula) for formula in formulas
-        ]
+def schedule_formula_check(event=None):
+    # Re-evaluate once typing pauses; unchanged formulas and an unchanged
+    # fit_results.dat come from the pyofe_results caches
+    global formula_check_job
+    if formula_check_job is not None:
+        root.after_cancel(formula_check_job)
+    formula_check_job = root.after(FORMULA_CHECK_DELAY_MS, check_formulas)
 
-        evaluated_rows = []
-
-        for line in raw_data.splitlines():
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-
-            cols = [col.strip() for col in line.split(",")]
-
-            safe_dict = {
-                'sqrt': math.sqrt,
-                'log': math.log,
-                'log10': math.log10,
-                'exp': math.exp,
-                'sin': math.sin,
-                'cos': math.cos,
-                'tan': math.tan,
-                'pi': math.pi,
-                'e': math.e
-            }
-
-            for i, col in enumerate(cols, start=1):
-                try:
-                    safe_dict[f'v{i}'] = float(col)
-                except:
-                    safe_dict[f'v{i}'] = 0.0  # fallback for non-numeric
-
-            row_values = []
-            for formula in processed_formulas:
-                try:
-                    val = eval(formula, {"__builtins__": None}, safe_dict)
-                    row_values.append(val)
-                except Exception as e:
-                    messagebox.showerror("Evaluation Error", f"Error in '{formula}': {e}")
-                    return
-
-            evaluated_rows.append(row_values)
-
-        # ✅ Group rows by the first evaluated value (e.g., $5)
-        grouped = defaultdict(list)
-        for row in evaluated_rows:
-            key = row[0]
-            grouped[key].append(row)
-
-        # ✅ Average each group row-wise
-        averaged_rows = []
-        for group in grouped.values():
-            count = len(group)
-            num_cols = len(group[0])
-            avg_row = [
-                sum(row[i] for row in group) / count
-                for i in range(num_cols)
-            ]
-            averaged_rows.append(avg_row)
-
-        # ✅ Write output
-        output_lines = [" ".join(map(str, row)) for row in averaged_rows]
-        with open(custom_data_file_path, 'w') as out:
-            out.write("\n".join(output_lines))
-
-        messagebox.showinfo("Success", f"Custom data file created:\n{custom_data_file_path}")
 
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to process file: {e}")
+def check_formulas():
+    global formula_check_job
+    formula_check_job = None
+    formulas = process_text.get("1.0", tk.END).split("\n")
+    try:
+        rows = pyofe_results.custom_data(formulas, FIT_RESULTS_FILE)
+    except pyofe_results.FormulaError as e:
+        formula_status.config(text=str(e), fg="red")
+        return
+    except ValueError as e:
+        formula_status.config(text=str(e), fg="gray")
+        return
+    formula_status.config(text=f"{len(rows)} points", fg="green")
 
 
 
@@ -742,254 +730,303 @@ def plot_gnuplot():
 
 #---------------------------#----------------------------------#---------------------------#-----------------------------#
 
-# Load JSON once before creating GUI
-with open(FUNCTIONS_JSON_PATH, "r") as json_file:
-    functions_data = json.load(json_file)
-
-functions = functions_data["functions"]
-urls = functions_data["urls"]
-
-
-# Create the main application window
-root = tk.Tk()
-root.title("Graphical user interface of the PyOFE–OneFit framework")
-root.geometry("1100x580")
-
-# Styling
-style = ttk.Style()
-style.configure("TLabel", font=("Arial", 10))
-style.configure("TEntry", font=("Arial", 10))
-style.configure("TCombobox", font=("Arial", 10))
-
-# Allow root's column 0 to expand
-root.columnconfigure(0, weight=1)
-
-# ----------- File selection - full width layout -----------
-file_frame = tk.Frame(root)
-file_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(5,0))
-
-# Configure frame columns
-file_frame.columnconfigure(0, weight=0)
-file_frame.columnconfigure(1, weight=1)  # Entry expands
-file_frame.columnconfigure(2, weight=0)
-
-tk.Label(file_frame, text="Select File:", font=("Arial", 11)).grid(row=0, column=0, padx=(0, 5), sticky="w")
-file_entry = ttk.Entry(file_frame)
-file_entry.grid(row=0, column=1, padx=2, sticky="ew")
-browse_button = tk.Button(file_frame, text="Browse", fg="red", bg="white", font=("Arial", 8), command=browse_file)
-browse_button.grid(row=0, column=2, padx=(5, 0), sticky="e")
-#--------------------------------------------------------------------------------------------------------------
-
-# --- Server URL 3rd_Frame with Add URL button in one line ---
-server_url_frame = tk.Frame(root)
-server_url_frame.grid(row=3, column=0, columnspan=4, sticky="ew", pady=(5,0))
-
-# Configure columns for layout
-server_url_frame.columnconfigure(1, weight=0)  # Combobox small
-server_url_frame.columnconfigure(3, weight=1)  # Entry expands but limited width
-server_url_frame.columnconfigure(4, weight=0)  # Button fixed size
-
-# Select URL Label + Combobox (small width)
-tk.Label(server_url_frame, text="Select URL:", font=("Arial", 11)).grid(row=0, column=0, padx=2, pady=5, sticky="e")
-url_var = tk.StringVar()
-url_combobox = ttk.Combobox(server_url_frame, textvariable=url_var, 
-                            values=list(functions_data["urls"].keys()), state="readonly", width=20)
-url_combobox.grid(row=0, column=1, padx=2, pady=5, sticky="w")
-url_combobox.bind("<<ComboboxSelected>>", set_url)
-
-# OneFit-Engine URL Label + Entry (smaller width)
-tk.Label(server_url_frame, text="OneFit-Engine URL:", font=("Arial", 11)).grid(row=0, column=2, padx=10, pady=5, sticky="e")
-url_entry = ttk.Entry(server_url_frame, width=40)  # Reduced width
-url_entry.grid(row=0, column=3, padx=2, pady=5, sticky="we")
-url_entry.insert(0, urls[list(urls.keys())[0]])
-
-# Add URL Button (placed at end of the line)
-add_url_button = ttk.Button(server_url_frame, text="Add URL", command=add_url, style="TButton")
-add_url_button.grid(row=0, column=4, padx=(10, 2), pady=5, sticky="w")
-
-#--------------------------------------------------------------------------------------------------------------
-
-
-# --- Combined Function + Options Frame (Two Rows) ---
-combined_frame = tk.Frame(root)
-combined_frame.grid(row=4, column=0, columnspan=4, sticky="ew", pady=(5,0))
-combined_frame.columnconfigure(0, weight=1)
-
-# === First Line (Full width layout) ===
-top_line_frame = tk.Frame(combined_frame)
-top_line_frame.grid(row=0, column=0, sticky="ew")
-top_line_frame.columnconfigure(0, weight=1)
-top_line_frame.columnconfigure(1, weight=0)
+def build_gui():
+    global root, file_entry, url_var, url_combobox, url_entry
+    global function_var, function_combobox, function_entry
+    global logx_var, logy_var, autox_var, autoy_var, symb_size_entry, workers_entry, zones_entry
+    global result_text, run_button, process_text, gnuplot_input, formula_status
+    global cache_var, result_cache, fit_index
+
+    # Fit results already computed for the same input and options are reused from here
+    result_cache = ResultCache()
+    # Every finished fit is recorded here (pyofe_client.py history --param T11)
+    fit_index = FitIndex()
+
+    # Load JSON once before creating GUI
+    functions, urls = load_functions_and_urls_from_json()
+    functions_data = {"functions": functions, "urls": urls}
+
+    # Create the main application window
+    root = tk.Tk()
+    root.title("Graphical user interface of the PyOFE–OneFit framework")
+    root.geometry("1100x660")
+
+    # Styling
+    style = ttk.Style()
+    style.configure("TLabel", font=("Arial", 10))
+    style.configure("TEntry", font=("Arial", 10))
+    style.configure("TCombobox", font=("Arial", 10))
+
+    # Allow root's column 0 to expand
+    root.columnconfigure(0, weight=1)
+
+    # ----------- File selection - full width layout -----------
+    file_frame = tk.Frame(root)
+    file_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(5,0))
+
+    # Configure frame columns
+    file_frame.columnconfigure(0, weight=0)
+    file_frame.columnconfigure(1, weight=1)  # Entry expands
+    file_frame.columnconfigure(2, weight=0)
+
+    tk.Label(file_frame, text="Select File:", font=("Arial", 11)).grid(row=0, column=0, padx=(0, 5), sticky="w")
+    file_entry = ttk.Entry(file_frame)
+    file_entry.grid(row=0, column=1, padx=2, sticky="ew")
+    browse_button = tk.Button(file_frame, text="Browse", fg="red", bg="white", font=("Arial", 8), command=browse_file)
+    browse_button.grid(row=0, column=2, padx=(5, 0), sticky="e")
+    #--------------------------------------------------------------------------------------------------------------
+
+    # --- Server URL 3rd_Frame with Add URL button in one line ---
+    server_url_frame = tk.Frame(root)
+    server_url_frame.grid(row=3, column=0, columnspan=4, sticky="ew", pady=(5,0))
+
+    # Configure columns for layout
+    server_url_frame.columnconfigure(1, weight=0)  # Combobox small
+    server_url_frame.columnconfigure(3, weight=1)  # Entry expands but limited width
+    server_url_frame.columnconfigure(4, weight=0)  # Button fixed size
+
+    # Select URL Label + Combobox (small width)
+    tk.Label(server_url_frame, text="Select URL:", font=("Arial", 11)).grid(row=0, column=0, padx=2, pady=5, sticky="e")
+    url_var = tk.StringVar()
+    url_combobox = ttk.Combobox(server_url_frame, textvariable=url_var, 
+                                values=list(functions_data["urls"].keys()), state="readonly", width=20)
+    url_combobox.grid(row=0, column=1, padx=2, pady=5, sticky="w")
+    url_combobox.bind("<<ComboboxSelected>>", set_url)
+
+    # OneFit-Engine URL Label + Entry (smaller width)
+    tk.Label(server_url_frame, text="OneFit-Engine URL:", font=("Arial", 11)).grid(row=0, column=2, padx=10, pady=5, sticky="e")
+    url_entry = ttk.Entry(server_url_frame, width=40)  # Reduced width
+    url_entry.grid(row=0, column=3, padx=2, pady=5, sticky="we")
+    url_entry.insert(0, urls[list(urls.keys())[0]])
+    url_entry.bind("<Return>", lambda event: load_catalogue())
+
+    # Add URL Button (placed at end of the line)
+    add_url_button = ttk.Button(server_url_frame, text="Add URL", command=add_url, style="TButton")
+    add_url_button.grid(row=0, column=4, padx=(10, 2), pady=5, sticky="w")
+
+    #--------------------------------------------------------------------------------------------------------------
+
+
+    # --- Combined Function + Options Frame (Two Rows) ---
+    combined_frame = tk.Frame(root)
+    combined_frame.grid(row=4, column=0, columnspan=4, sticky="ew", pady=(5,0))
+    combined_frame.columnconfigure(0, weight=1)
+
+    # === First Line (Full width layout) ===
+    top_line_frame = tk.Frame(combined_frame)
+    top_line_frame.grid(row=0, column=0, sticky="ew")
+    top_line_frame.columnconfigure(0, weight=1)
+    top_line_frame.columnconfigure(1, weight=0)
+
+    # Left and middle options grouped
+    left_mid_frame = tk.Frame(top_line_frame)
+    left_mid_frame.grid(row=0, column=0, sticky="w")
+
+    tk.Label(left_mid_frame, text="Select Function:", font=("Arial", 11)).pack(side="left", padx=5)
+
+    function_var = tk.StringVar()
+    # Editable so names can be typed: the dropdown narrows to matches, Return inserts the definition
+    function_combobox = ttk.Combobox(left_mid_frame, textvariable=function_var,
+                                     values=list(functions_data["functions"].keys()), width=25)
+    function_combobox.pack(side="left", padx=5)
+    function_combobox.bind("<<ComboboxSelected>>", insert_function)
+    function_combobox.bind("<KeyRelease>", autocomplete_function)
+    function_combobox.bind("<Return>", insert_function)
+
+    # Options
+    def add_option(label_text, var):
+        tk.Label(left_mid_frame, text=label_text, font=("Arial", 11)).pack(side="left", padx=(10, 2))
+        ttk.Combobox(left_mid_frame, textvariable=var, values=["yes", "no"],
+                     state="readonly", width=5).pack(side="left", padx=2)
+
+    logx_var = tk.StringVar(value="yes")
+    logy_var = tk.StringVar(value="yes")
+    autox_var = tk.StringVar(value="yes")
+    autoy_var = tk.StringVar(value="yes")
+
+    add_option("Logx:", logx_var)
+    add_option("Logy:", logy_var)
+    add_option("Autox:", autox_var)
+    add_option("Autoy:", autoy_var)
+
+    # "no" bypasses the result cache and always asks the server again
+    cache_var = tk.StringVar(value="yes")
+    add_option("Cache:", cache_var)
+
+    # SymbSize
+    tk.Label(left_mid_frame, text="SymbSize:", font=("Arial", 11)).pack(side="left", padx=(10, 2))
+    symb_size_entry = ttk.Entry(left_mid_frame, width=5)
+    symb_size_entry.pack(side="left", padx=2)
+    symb_size_entry.insert(0, "1.0")
+
+    # Concurrent uploads used by Batch Fit
+    tk.Label(left_mid_frame, text="Workers:", font=("Arial", 11)).pack(side="left", padx=(10, 2))
+    workers_entry = ttk.Entry(left_mid_frame, width=3)
+    workers_entry.pack(side="left", padx=2)
+    workers_entry.insert(0, str(BATCH_WORKERS))
+
+    # HDF5 zones to upload (positions / patterns, see pyofe_hdf5.py); empty sends the whole file
+    tk.Label(left_mid_frame, text="Zones:", font=("Arial", 11)).pack(side="left", padx=(10, 2))
+    zones_entry = ttk.Entry(left_mid_frame, width=10)
+    zones_entry.pack(side="left", padx=2)
+
+    # === Second Line: Function Entry (Label + Entry in one frame, Buttons in another frame) ===
+
+    # Frame 1: Label + Entry Box
+    function_entry_frame = tk.Frame(combined_frame)
+    function_entry_frame.grid(row=1, column=0, sticky="w", padx=5, pady=2)
+
+    tk.Label(function_entry_frame, text="Function:", font=("Arial", 11)).grid(row=0, column=0, padx=5, pady=2, sticky="nw")
+
+    function_entry = tk.Text(function_entry_frame, height=3, width=128, wrap=tk.WORD, font=("Arial", 10))
+    function_entry.grid(row=0, column=1, padx=5, pady=2, sticky="w")
+
+    # Frame 2: Buttons stacked vertically
+    function_button_frame = tk.Frame(combined_frame)
+    function_button_frame.grid(row=1, column=1, sticky="nw", padx=(0, 10))  # Align right side of entry box
+
+    add_function_button = ttk.Button(function_button_frame, text="Add Function", command=add_function)
+    add_function_button.pack(side="top", pady=(0, 2))
+
+    list_functions_button = ttk.Button(function_button_frame, text="List Functions", command=list_functions)
+    list_functions_button.pack(side="top", pady=(0, 2))
 
-# Left and middle options grouped
-left_mid_frame = tk.Frame(top_line_frame)
-left_mid_frame.grid(row=0, column=0, sticky="w")
 
-tk.Label(left_mid_frame, text="Select Function:", font=("Arial", 11)).pack(side="left", padx=5)
+    # === Result Message Area + Buttons in One Line ===
+    buttons_message_frame = tk.Frame(root)
+    buttons_message_frame.grid(row=5, column=0, columnspan=4, sticky="ew", padx=10, pady=10)
+    buttons_message_frame.columnconfigure(0, weight=1)  # Text expands
+    buttons_message_frame.columnconfigure(1, weight=0)
 
-function_var = tk.StringVar()
-function_combobox = ttk.Combobox(left_mid_frame, textvariable=function_var,
-                                 values=list(functions_data["functions"].keys()),
-                                 state="readonly", width=25)
-function_combobox.pack(side="left", padx=5)
-function_combobox.bind("<<ComboboxSelected>>", insert_function)
 
-# Options
-def add_option(label_text, var):
-    tk.Label(left_mid_frame, text=label_text, font=("Arial", 11)).pack(side="left", padx=(10, 2))
-    ttk.Combobox(left_mid_frame, textvariable=var, values=["yes", "no"],
-                 state="readonly", width=5).pack(side="left", padx=2)
+    # ====== Message Text Area (Left) ======
+    result_frame = tk.Frame(buttons_message_frame)
+    result_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 10))
+    result_frame.grid_rowconfigure(0, weight=1)
+    result_frame.grid_columnconfigure(0, weight=1)
 
-logx_var = tk.StringVar(value="yes")
-logy_var = tk.StringVar(value="yes")
-autox_var = tk.StringVar(value="yes")
-autoy_var = tk.StringVar(value="yes")
+    result_text = tk.Text(result_frame, height=9, wrap=tk.NONE, font=("Arial", 10))
+    result_text.grid(row=0, column=0, sticky="nsew")
+
+    v_scrollbar = tk.Scrollbar(result_frame, orient=tk.VERTICAL, command=result_text.yview, width=15)
+    v_scrollbar.grid(row=0, column=1, sticky="ns")
 
-add_option("Logx:", logx_var)
-add_option("Logy:", logy_var)
-add_option("Autox:", autox_var)
-add_option("Autoy:", autoy_var)
-
-# SymbSize
-tk.Label(left_mid_frame, text="SymbSize:", font=("Arial", 11)).pack(side="left", padx=(10, 2))
-symb_size_entry = ttk.Entry(left_mid_frame, width=5)
-symb_size_entry.pack(side="left", padx=2)
-symb_size_entry.insert(0, "1.0")
-
-# === Second Line: Function Entry (Label + Entry in one frame, Buttons in another frame) ===
-
-# Frame 1: Label + Entry Box
-function_entry_frame = tk.Frame(combined_frame)
-function_entry_frame.grid(row=1, column=0, sticky="w", padx=5, pady=2)
-
-tk.Label(function_entry_frame, text="Function:", font=("Arial", 11)).grid(row=0, column=0, padx=5, pady=2, sticky="nw")
+    h_scrollbar = tk.Scrollbar(result_frame, orient=tk.HORIZONTAL, command=result_text.xview, width=15)
+    h_scrollbar.grid(row=1, column=0, sticky="ew")
+
+    result_text.config(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
 
-function_entry = tk.Text(function_entry_frame, height=3, width=128, wrap=tk.WORD, font=("Arial", 10))
-function_entry.grid(row=0, column=1, padx=5, pady=2, sticky="w")
-
-# Frame 2: Buttons stacked vertically
-function_button_frame = tk.Frame(combined_frame)
-function_button_frame.grid(row=1, column=1, sticky="nw", padx=(0, 10))  # Align right side of entry box
-
-add_function_button = ttk.Button(function_button_frame, text="Add Function", command=add_function)
-add_function_button.pack(side="top", pady=(0, 2))
-
-list_functions_button = ttk.Button(function_button_frame, text="List Functions", command=list_functions)
-list_functions_button.pack(side="top", pady=(0, 2))
+    # ====== Buttons (Right side, stacked) ======
+    buttons_frame = tk.Frame(buttons_message_frame)
+    buttons_frame.grid(row=0, column=1, sticky="n")
 
+    button_style = {
+        'font': ("Arial", 9),
+        'width': 10,
+        'height': 1,
+        'fg': "black",
+    }
 
-# === Result Message Area + Buttons in One Line ===
-buttons_message_frame = tk.Frame(root)
-buttons_message_frame.grid(row=5, column=0, columnspan=4, sticky="ew", padx=10, pady=10)
-buttons_message_frame.columnconfigure(0, weight=1)  # Text expands
-buttons_message_frame.columnconfigure(1, weight=0)
-
-
-# ====== Message Text Area (Left) ======
-result_frame = tk.Frame(buttons_message_frame)
-result_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 10))
-result_frame.grid_rowconfigure(0, weight=1)
-result_frame.grid_columnconfigure(0, weight=1)
-
-result_text = tk.Text(result_frame, height=9, wrap=tk.NONE, font=("Arial", 10))
-result_text.grid(row=0, column=0, sticky="nsew")
-
-v_scrollbar = tk.Scrollbar(result_frame, orient=tk.VERTICAL, command=result_text.yview, width=15)
-v_scrollbar.grid(row=0, column=1, sticky="ns")
-
-h_scrollbar = tk.Scrollbar(result_frame, orient=tk.HORIZONTAL, command=result_text.xview, width=15)
-h_scrollbar.grid(row=1, column=0, sticky="ew")
-
-result_text.config(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
-
-# ====== Buttons (Right side, stacked) ======
-buttons_frame = tk.Frame(buttons_message_frame)
-buttons_frame.grid(row=0, column=1, sticky="n")
+    run_button = tk.Button(buttons_frame, text="Fit", command=run_curl, bg="white", **button_style)
+    run_button.pack(pady=5)
 
-button_style = {
-    'font': ("Arial", 9),
-    'width': 10,
-    'height': 1,
-    'fg': "black",
-}
+    show_pdf_button = tk.Button(buttons_frame, text="Show PDF", command=show_pdf, bg="white", **button_style)
+    show_pdf_button.pack(pady=5)
 
-run_button = tk.Button(buttons_frame, text="Fit", command=run_curl, bg="white", **button_style)
-run_button.pack(pady=5)
+    open_folder_button = tk.Button(buttons_frame, text="Open Folder", command=open_downloaded_folder, bg="white", **button_style)
+    open_folder_button.pack(pady=5)
 
-show_pdf_button = tk.Button(buttons_frame, text="Show PDF", command=show_pdf, bg="white", **button_style)
-show_pdf_button.pack(pady=5)
+    clean_button = tk.Button(buttons_frame, text="Clean", command=clean_folder, bg="white", **button_style)
+    clean_button.pack(pady=5)
 
-open_folder_button = tk.Button(buttons_frame, text="Open Folder", command=open_downloaded_folder, bg="white", **button_style)
-open_folder_button.pack(pady=5)
+    batch_button = tk.Button(buttons_frame, text="Batch Fit", command=run_batch, bg="white", **button_style)
+    batch_button.pack(pady=5)
 
-clean_button = tk.Button(buttons_frame, text="Clean", command=clean_folder, bg="white", **button_style)
-clean_button.pack(pady=5)
+    cancel_batch_button = tk.Button(buttons_frame, text="Cancel Batch", command=cancel_batch, bg="white", **button_style)
+    cancel_batch_button.pack(pady=5)
 
 
 
-# === Combined Frame for Create Gnuplot Data + Gnuplot Plotting ===
-gnuplot_combined_frame = tk.Frame(root)
-gnuplot_combined_frame.grid(row=9, column=0, columnspan=4, sticky="we", padx=10, pady=5)
-gnuplot_combined_frame.columnconfigure(0, weight=1)  # Left 1/4
-gnuplot_combined_frame.columnconfigure(1, weight=3)  # Right 3/4
+    # === Combined Frame for Create Gnuplot Data + Gnuplot Plotting ===
+    gnuplot_combined_frame = tk.Frame(root)
+    gnuplot_combined_frame.grid(row=9, column=0, columnspan=4, sticky="we", padx=10, pady=5)
+    gnuplot_combined_frame.columnconfigure(0, weight=1)  # Left 1/4
+    gnuplot_combined_frame.columnconfigure(1, weight=3)  # Right 3/4
 
-# === Create Gnuplot Data Section (Left 1/4) ===
-process_frame = tk.Frame(gnuplot_combined_frame, padx=5, pady=5, bd=1, relief="groove")
-process_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 5))
-process_frame.columnconfigure(0, weight=1)
+    # === Create Gnuplot Data Section (Left 1/4) ===
+    process_frame = tk.Frame(gnuplot_combined_frame, padx=5, pady=5, bd=1, relief="groove")
+    process_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 5))
+    process_frame.columnconfigure(0, weight=1)
 
-title_button = tk.Button(
-    process_frame, text="FILTER RESULTS",
-    font=("Arial", 9, "bold"),
-    fg="black", bg="white",
-    relief="flat", bd=0,
-    activebackground="white", activeforeground="blue",
-    cursor="hand2",
-    command=lambda: create_custom_data_file(process_text.get("1.0", tk.END))
-)
-title_button.grid(row=0, column=0, pady=(0, 2), sticky="n")
+    title_button = tk.Button(
+        process_frame, text="FILTER RESULTS",
+        font=("Arial", 9, "bold"),
+        fg="black", bg="white",
+        relief="flat", bd=0,
+        activebackground="white", activeforeground="blue",
+        cursor="hand2",
+        command=lambda: create_custom_data_file(process_text.get("1.0", tk.END))
+    )
+    title_button.grid(row=0, column=0, pady=(0, 2), sticky="n")
 
-tk.Label(process_frame, text="Enter column formulas (use $1, $2,...):", font=("Arial", 9)).grid(
-    row=1, column=0, sticky="w", padx=5, pady=(2, 0)
-)
+    tk.Label(process_frame, text="Enter column formulas (use $1, $2,...):", font=("Arial", 9)).grid(
+        row=1, column=0, sticky="w", padx=5, pady=(2, 0)
+    )
 
-process_text = tk.Text(process_frame, height=4, width=30, font=("Arial", 9))
-process_text.insert(tk.END, "$5\n$10\n$11*sqrt($3)\n1/$10\n$11*sqrt($3/($10*$10))")
-process_text.grid(row=2, column=0, padx=5, pady=5, sticky="we")
-
-# === Gnuplot Plotting Section (Right 3/4) ===
-plot_frame = tk.Frame(gnuplot_combined_frame, padx=5, pady=5, bd=1, relief="groove")
-plot_frame.grid(row=0, column=1, sticky="nsew", padx=(5, 0))
-plot_frame.columnconfigure(0, weight=1)
-
-plot_title_button = tk.Button(
-    plot_frame, text="GNUPLOT PLOTTING",
-    font=("Arial", 9, "bold"),
-    fg="black", bg="white",
-    relief="flat", bd=0,
-    activebackground="white", activeforeground="blue",
-    cursor="hand2",
-    command=plot_gnuplot
-)
-plot_title_button.grid(row=0, column=0, pady=(0, 2), sticky="n")
+    process_text = tk.Text(process_frame, height=4, width=30, font=("Arial", 9))
+    process_text.insert(tk.END, "$5\n$10\n$11*sqrt($3)\n1/$10\n$11*sqrt($3/($10*$10))")
+    process_text.grid(row=2, column=0, padx=5, pady=5, sticky="we")
+    process_text.bind("<KeyRelease>", schedule_formula_check)
+
+    # Live check of the formulas against the current fit_results.dat
+    formula_status = tk.Label(process_frame, text="", font=("Arial", 8), anchor="w",
+                              justify="left", wraplength=240)
+    formula_status.grid(row=3, column=0, sticky="we", padx=5)
+    schedule_formula_check()
+
+    # === Gnuplot Plotting Section (Right 3/4) ===
+    plot_frame = tk.Frame(gnuplot_combined_frame, padx=5, pady=5, bd=1, relief="groove")
+    plot_frame.grid(row=0, column=1, sticky="nsew", padx=(5, 0))
+    plot_frame.columnconfigure(0, weight=1)
+
+    plot_title_button = tk.Button(
+        plot_frame, text="GNUPLOT PLOTTING",
+        font=("Arial", 9, "bold"),
+        fg="black", bg="white",
+        relief="flat", bd=0,
+        activebackground="white", activeforeground="blue",
+        cursor="hand2",
+        command=plot_gnuplot
+    )
+    plot_title_button.grid(row=0, column=0, pady=(0, 2), sticky="n")
 
-tk.Label(plot_frame, text="Enter Gnuplot instructions (use $data for filename):", font=("Arial", 9)).grid(
-    row=1, column=0, sticky="w", padx=5, pady=(0, 5)
-)
+    tk.Label(plot_frame, text="Enter Gnuplot instructions (use $data for filename):", font=("Arial", 9)).grid(
+        row=1, column=0, sticky="w", padx=5, pady=(0, 5)
+    )
 
-gnuplot_input = tk.Text(plot_frame, height=8, width=60, font=("Courier", 10))
-gnuplot_input.insert(tk.END,
+    gnuplot_input = tk.Text(plot_frame, height=8, width=60, font=("Courier", 10))
+    gnuplot_input.insert(tk.END,
 """set logscale xy
 set xrange [1e3:1e9]
 set yrange [0.1:10]
 plot '$data' using 1:2:3 with yerrorlines pt 2 title 'T1', \\
      '$data' using 1:4:5 with yerrorlines pt 6 title 'R1'
 """)
-gnuplot_input.grid(row=2, column=0, sticky="we", padx=5, pady=5)
+    gnuplot_input.grid(row=2, column=0, sticky="we", padx=5, pady=5)
+
 
+def main():
+    # Any arguments run the headless client: PyOFE-API.py fit file.hdf5 --function ... --url ...
+    if len(sys.argv) > 1:
+        sys.exit(pyofe_client.main(sys.argv[1:]))
 
+    build_gui()
+    # Fill the function dropdown from the server's catalogue (cached copy first)
+    load_catalogue()
 
+    # Start the Tkinter event loop
+    root.mainloop()
 
-# Start the Tkinter event loop
-root.mainloop()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Virtualised line viewer
+=======================
+Output panes for the SDF / FFC-IST tools. The text lives in a LineStore (a
+spooled temporary file plus NumPy arrays of line offsets and tags), not in a
+Tk text buffer; LineView renders only the lines that fit in the window and
+re-renders as the user scrolls. Tags are worked out per visible line by a
+classifier function, so colouring costs nothing for lines never shown.
+Lines are not wrapped (a wrapped line would take an unknown number of rows);
+long lines scroll horizontally instead. Select-all (Ctrl+A) followed by copy
+copies the whole store, not just the rendered lines.
+
+    view = LineView(parent, classify=lambda line: "data" if line.startswith("# DATA") else "")
+    view.insert(all_output_text)        # one call, any number of lines
+    view.insert("Bad range\n", "warning")
+"""
+
+import tempfile
+import tkinter as tk
+import tkinter.font as tkfont
+
+import numpy as np
+
+
+SPOOL_SIZE = 8 * 1024 * 1024    # output kept in memory up to this size, then in a temp file
+RENDER_MARGIN = 2               # extra lines rendered below the window
+
+
+class LineStore:
+    """Append-only store of text lines.
+
+    Line i occupies bytes offsets[i]:offsets[i + 1] (UTF-8, '\\n' included) of
+    the backing file. tags[i] is an index into tag_names; 0 means "no explicit
+    tag", i.e. the viewer's classifier decides. Text that does not end in a
+    newline is held as an open last line until the next append completes it.
+    """
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self._offsets = np.zeros(1024, dtype=np.int64)
+        self._tags = np.zeros(1023, dtype=np.uint8)
+        self._count = 0
+        self._tail = ""             # open last line
+        self._tail_tag = 0
+        self.tag_names = [""]
+
+    def __len__(self):
+        return self._count + (1 if self._tail else 0)
+
+    def close(self):
+        self._file.close()
+
+    def _tag_id(self, tag):
+        if not tag:
+            return 0
+        try:
+            return self.tag_names.index(tag)
+        except ValueError:
+            self.tag_names.append(tag)
+            return len(self.tag_names) - 1
+
+    def _reserve(self, extra):
+        needed = self._count + extra + 1
+        if needed > len(self._offsets):
+            size = max(needed, 2 * len(self._offsets))
+            self._offsets = np.resize(self._offsets, size)
+            self._tags = np.resize(self._tags, size - 1)
+
+    def append(self, text, tag=""):
+        if not text:
+            return
+        tag_id = self._tag_id(tag)
+        if self._tail:
+            # The open line keeps the tag it was started with
+            head, newline, text = text.partition("\n")
+            self._tail += head
+            self._tail_tag = self._tail_tag or tag_id
+            if not newline:
+                return
+            self._write(self._tail + "\n", self._tail_tag)
+            self._tail, self._tail_tag = "", 0
+
+        complete, newline, self._tail = text.rpartition("\n")
+        self._tail_tag = tag_id if self._tail else 0
+        if newline:
+            self._write(complete + "\n", tag_id)
+
+    def _write(self, text, tag_id):
+        data = text.encode("utf-8")
+        ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1
+        self._reserve(len(ends))
+        base = self._offsets[self._count]
+        self._offsets[self._count + 1:self._count + 1 + len(ends)] = base + ends
+        self._tags[self._count:self._count + len(ends)] = tag_id
+        self._file.seek(base)
+        self._file.write(data)
+        self._count += len(ends)
+
+    def lines(self, start, stop):
+        """[(line, tag), ...] for lines start..stop-1, without newlines."""
+        start = max(0, start)
+        stop = min(stop, len(self))
+        if stop <= start:
+            return []
+        full_stop = min(stop, self._count)
+        result = []
+        if start < full_stop:
+            begin, end = self._offsets[start], self._offsets[full_stop]
+            self._file.seek(begin)
+            chunk = self._file.read(end - begin).decode("utf-8")
+            names = self.tag_names
+            tags = self._tags[start:full_stop]
+            result = [(line, names[t]) for line, t in zip(chunk.split("\n"), tags)]
+        if stop > self._count:
+            result.append((self._tail, self.tag_names[self._tail_tag]))
+        return result
+
+    def text(self):
+        """All stored text as one string."""
+        self._file.seek(0)
+        return self._file.read(int(self._offsets[self._count])).decode("utf-8") + self._tail
+
+
+class LineView(tk.Frame):
+    """Scrollable, read-only text pane that renders only the visible lines.
+
+    classify(line) returns the tag for a line inserted without one (or "" for
+    none); tag_config() forwards to the underlying Text widget. Extra keyword
+    arguments style the Text widget, except wrap: lines never wrap and scroll
+    horizontally (scrollbar, Shift+wheel). Ctrl+A selects everything, and
+    copying that selection copies every line in the store (see copy_all).
+    """
+
+    def __init__(self, parent, classify=None, frame_bg=None, scrollbar_kw=None, **text_kw):
+        super().__init__(parent, **({"bg": frame_bg} if frame_bg else {}))
+        self.classify = classify or (lambda line: "")
+        self._store = LineStore()
+        self._top = 0
+        self._rows = 1
+        self._render_pending = False
+        self._redraw = False
+        self._all_selected = False
+        scrollbar_kw = scrollbar_kw or {}
+
+        text_kw["wrap"] = tk.NONE
+        self._txt = tk.Text(self, state="disabled", **text_kw)
+        self._yscr = tk.Scrollbar(self, orient="vertical", command=self._on_scrollbar, **scrollbar_kw)
+        self._xscr = tk.Scrollbar(self, orient="horizontal", command=self._txt.xview, **scrollbar_kw)
+        self._txt.configure(xscrollcommand=self._xscr.set)
+        self._linespace = tkfont.Font(font=self._txt.cget("font")).metrics("linespace") or 1
+
+        self._yscr.pack(side="right", fill="y")
+        self._xscr.pack(side="bottom", fill="x")
+        self._txt.pack(side="left", fill="both", expand=True)
+
+        self._txt.bind("<Configure>", self._on_resize)
+        self._txt.bind("<MouseWheel>", self._on_wheel)
+        self._txt.bind("<Button-4>", lambda e: self.scroll(-3))
+        self._txt.bind("<Button-5>", lambda e: self.scroll(3))
+        for key, lines in (("<Up>", -1), ("<Down>", 1)):
+            self._txt.bind(key, lambda e, n=lines: self.scroll(n))
+        self._txt.bind("<Prior>", lambda e: self.scroll(-self._rows))
+        self._txt.bind("<Next>", lambda e: self.scroll(self._rows))
+        self._txt.bind("<Control-Home>", lambda e: self.scroll_to(0))
+        self._txt.bind("<Control-End>", lambda e: self.scroll_to(len(self._store)))
+        self._txt.bind("<Shift-MouseWheel>", self._on_shift_wheel)
+        self._txt.bind("<Shift-Button-4>", lambda e: self.scroll_x(-3))
+        self._txt.bind("<Shift-Button-5>", lambda e: self.scroll_x(3))
+        # The Text widget only holds the rendered lines, so select-all / copy go through the store
+        for sequence in ("<Control-a>", "<Control-A>", "<Control-slash>"):
+            self._txt.bind(sequence, self._select_all)
+        self._txt.bind("<<Copy>>", self._on_copy)
+        self._txt.bind("<Button-1>", self._clear_select_all, add="+")
+
+    # ── content ──
+    def line_count(self):
+        return len(self._store)
+
+    def widget(self):
+        return self._txt
+
+    def tag_config(self, tag, **kw):
+        self._txt.tag_config(tag, **kw)
+
+    def insert(self, text, tag=""):
+        """Append text (any number of lines) at the end."""
+        before = len(self._store)
+        self._store.append(text, tag)
+        # Only redraw if the new lines can be seen; the scrollbar always changes
+        self._schedule_render(redraw=before < self._top + self._rows + RENDER_MARGIN)
+
+    def clear(self):
+        self._store.close()
+        self._store = LineStore()
+        self._top = 0
+        self._all_selected = False
+        self._schedule_render()
+
+    def get_all(self):
+        """Every line inserted so far, rendered or not."""
+        return self._store.text()
+
+    def copy_all(self):
+        """Put every line on the clipboard."""
+        self.clipboard_clear()
+        self.clipboard_append(self._store.text())
+
+    def _select_all(self, event=None):
+        self._all_selected = True
+        self._txt.tag_add("sel", "1.0", tk.END)
+        return "break"
+
+    def _clear_select_all(self, event=None):
+        self._all_selected = False
+
+    def _on_copy(self, event=None):
+        if self._all_selected:
+            self.copy_all()
+            return "break"
+        return None
+
+    # ── scrolling ──
+    def scroll(self, lines):
+        self.scroll_to(self._top + lines)
+        return "break"
+
+    def scroll_to(self, line):
+        top = max(0, min(int(line), len(self._store) - self._rows))
+        if top != self._top:
+            self._top = top
+            self._render()
+        return "break"
+
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self.scroll_to(float(args[0]) * len(self._store))
+        elif action == "scroll":
+            amount, unit = int(args[0]), args[1]
+            self.scroll(amount * (self._rows if unit == "pages" else 1))
+
+    def _on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def scroll_x(self, units):
+        self._txt.xview_scroll(units, "units")
+        return "break"
+
+    def _on_shift_wheel(self, event):
+        return self.scroll_x(-3 if event.delta > 0 else 3)
+
+    def _on_resize(self, event):
+        rows = max(1, event.height // self._linespace)
+        if rows != self._rows:
+            self._rows = rows
+            self._render()
+
+    # ── rendering ──
+    def _schedule_render(self, redraw=True):
+        # Many inserts in a row (e.g. one per zone) cost a single redraw
+        self._redraw = self._redraw or redraw
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render_idle)
+
+    def _render_idle(self):
+        self._render_pending = False
+        if self._redraw:
+            self._render()
+        else:
+            self._update_scrollbar()
+        self._redraw = False
+
+    def _update_scrollbar(self):
+        total = len(self._store)
+        if total <= self._rows:
+            self._yscr.set(0.0, 1.0)
+        else:
+            self._yscr.set(self._top / total, min(1.0, (self._top + self._rows) / total))
+
+    def _render(self):
+        lines = self._store.lines(self._top, self._top + self._rows + RENDER_MARGIN)
+        args = []
+        for line, tag in lines:
+            args += [line + "\n", tag or self.classify(line) or ()]
+        xview = self._txt.xview()[0]
+        self._txt.configure(state="normal")
+        self._txt.delete("1.0", tk.END)
+        if args:
+            self._txt.insert("1.0", *args)
+        if self._all_selected:
+            self._txt.tag_add("sel", "1.0", tk.END)
+        self._txt.configure(state="disabled")
+        self._txt.xview_moveto(xview)
+        self._update_scrollbar()
@@ -0,0 +1,1264 @@
+#!/usr/bin/env python3
+"""
+NMR processing core
+===================
+SDF parsing, block averaging and output formatting shared by
+sdffilterbyrange.py and the NMR Lab Suite, plus the Lab Suite's FFC-IST
+export conversion. No Tk in here, so the same code runs behind the GUIs
+and from scripts.
+
+Each SDF zone is parsed once into a NumPy array of its column-3 values;
+block means and row ranges are then array reductions over an
+(NBLK, BS) view instead of per-line string splitting.
+
+SDFReader streams zones from disk one at a time and iter_processed_zones()
+block-averages each one as soon as it has been read, so multi-gigabyte
+acquisitions are processed with memory bounded by a single zone. Results
+are kept as arrays (ZoneResult / SDFResult); normalisation works on those
+arrays and text is only produced for display or saving.
+
+Whole files can be spread over a process pool in batch mode; results
+always come back in input order. Zones within a file are processed serially.
+
+Instead of text, converted zones can be written as binary zone files
+(.hdf5, memory-mappable, or .npz): per zone the arrays tau, magnetization
+and weight plus the header values as attributes. The fit client uploads
+them directly.
+
+Batch conversion from the command line:
+
+    python nmr_processing.py convert campaign/ --range 0:349 --normalize m0 -o converted/
+    python nmr_processing.py ffc exports/ --merge series.txt -o converted/
+    python nmr_processing.py convert campaign/ --format hdf5 -o converted/
+"""
+
+import argparse
+import fnmatch
+import json
+import math
+import os
+import re
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+try:
+    import h5py
+except ImportError:  # optional: only needed for .hdf5 output
+    h5py = None
+
+
+TAU_PATTERN = re.compile(r"TAU\s*=\s*\[(log|lin):([\d\.]+)\*T1MAX:([\d\.]+)\*T1MAX:(\d+)\]")
+READ_BUFFER_SIZE = 1 << 20              # bytes read from disk at a time when streaming
+PROCESS_WORKERS = os.cpu_count() or 1   # default size of the process pool
+FFC_COLUMNS = (0, 1, 2, 3, 5)           # temperature, frequency (kHz), time (us), value; column 5 must exist
+FFC_ROW = "{:>12.6g}  {:>12.6g}  " + f"{1:>12}"
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"  # the separators str.splitlines() uses
+ENDTAU_PATTERN = re.compile("endtau", re.IGNORECASE)
+PARAMETERS_PATTERN = re.compile("Parameters")
+ZONE_FILE_FORMAT = "nmr-zones"          # root attribute of binary zone files
+ZONE_FILE_VERSION = 1
+ZONE_DATASETS = ("tau", "magnetization", "weight")
+BINARY_SUFFIXES = (".hdf5", ".npz")
+OUTPUT_FORMATS = ("txt", "hdf5", "npz")
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  SDF PARSING
+# ═══════════════════════════════════════════════════════════════════
+
+class SDFZone:
+    """One ZONE of an SDF file.
+
+    values     : 1-D float array with column 3 of every DATA row, in file order
+    params     : zone parameters (T1MAX already converted to seconds, BR stored as 'dum')
+    tau_index  : 1-based index into the file's TAU formulas, 0 if none applies
+    """
+
+    def __init__(self, name, params, values, tau_index):
+        self.name = name
+        self.params = params
+        self.values = values
+        self.tau_index = tau_index
+
+    def blocks(self, nblk, bs):
+        """Return (blocks, valid): the values laid out as an (nblk, bs) array and a
+        boolean mask of the cells actually present in the file. Missing trailing
+        rows are zero-filled; rows beyond nblk * bs are ignored."""
+        size = nblk * bs
+        n = min(len(self.values), size)
+        blocks = np.zeros(size, dtype=float)
+        blocks[:n] = self.values[:n]
+        valid = np.zeros(size, dtype=bool)
+        valid[:n] = True
+        return blocks.reshape(nblk, bs), valid.reshape(nblk, bs)
+
+
+class _SummaryParams:
+    # NBLK / BS come from the PARAMETER SUMMARY and apply to every zone
+
+    @property
+    def nblk(self):
+        self._check_summary()
+        return int(self.global_params["NBLK"])
+
+    @property
+    def bs(self):
+        self._check_summary()
+        return int(float(self.global_params["BS"]))
+
+    @property
+    def has_summary(self):
+        return "NBLK" in self.global_params and "BS" in self.global_params
+
+    def _check_summary(self):
+        if not self.has_summary:
+            raise ValueError("NBLK or BS parameters not found in any PARAMETER SUMMARY")
+
+
+class SDFFile(_SummaryParams):
+    """Parsed SDF file: its zones plus the PARAMETER SUMMARY values they share."""
+
+    def __init__(self, zones, global_params, tau_formulas):
+        self.zones = zones
+        self.global_params = global_params
+        self.tau_formulas = tau_formulas
+
+
+def _column3_array(data_lines):
+    # Fast path: NumPy's C text reader pulls column 3 out of every row at once.
+    # Files with short or non-numeric rows fall back to the row-by-row rules
+    # (rows whose third field is missing or not a number are dropped).
+    if not data_lines:
+        return np.empty(0, dtype=float)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)    # all-blank section
+            return np.loadtxt(data_lines, usecols=2, comments=None, ndmin=1, dtype=float)
+    except ValueError:
+        values = []
+        for line in data_lines:
+            parts = line.split(None, 3)
+            if len(parts) >= 3:
+                try:
+                    values.append(float(parts[2]))
+                except ValueError:
+                    continue
+        return np.array(values, dtype=float)
+
+
+class SDFReader(_SummaryParams):
+    """Streams the zones of an SDF file one at a time.
+
+    source is a file path or any iterable of lines. Iterating yields SDFZone
+    objects as soon as each zone is closed, so only the zone being read is held
+    in memory. global_params and tau_formulas fill in as the PARAMETER SUMMARY
+    lines go past.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.global_params = {}
+        self.tau_formulas = []
+        self.size = None            # file size in bytes, once opened
+        self.bytes_read = 0         # approximate, updated as each zone is yielded
+
+    def __iter__(self):
+        if isinstance(self.source, (str, bytes, os.PathLike)):
+            with open(self.source, "r", buffering=READ_BUFFER_SIZE) as file:
+                self.size = os.fstat(file.fileno()).st_size
+                for zone in self._zones(file):
+                    self.bytes_read = file.buffer.tell()
+                    yield zone
+                self.bytes_read = self.size
+        else:
+            yield from self._zones(self.source)
+
+    @property
+    def fraction_read(self):
+        """Share of the file read so far (0..1), or None for non-file sources."""
+        if not self.size:
+            return None
+        return min(1.0, self.bytes_read / self.size)
+
+    def _zones(self, lines):
+        """The ZONE / PARAMETER SUMMARY state machine."""
+        global_params = self.global_params
+        tau_formulas = self.tau_formulas
+        current_zone = None
+        data_lines = []
+        zone_params = {}
+        current_tau_index = 0
+        in_parameter_summary = False
+        in_data_section = False
+
+        def close_zone():
+            values = _column3_array(data_lines)
+            if current_zone and len(values):
+                return SDFZone(current_zone, zone_params.copy(), values, current_tau_index)
+            return None
+
+        for line in lines:
+            line = line.strip()
+
+            # Plain data rows skip the rest of the state machine; they are converted
+            # in bulk when the zone closes
+            if in_data_section and not (
+                "=" in line or "PARAMETER SUMMARY" in line or line.startswith("ZONE") or line == "DATA"
+            ):
+                data_lines.append(line)
+                continue
+
+            if "PARAMETER SUMMARY" in line:
+                zone = close_zone()
+                if zone is not None:
+                    yield zone
+                current_zone = None
+                zone_params = {}
+                data_lines = []
+                in_parameter_summary = True
+                in_data_section = False
+                continue
+            elif line.startswith("ZONE"):
+                if not in_parameter_summary:
+                    zone = close_zone()
+                    if zone is not None:
+                        yield zone
+                in_parameter_summary = False
+                in_data_section = False
+                current_zone = line
+                zone_params = {}
+                data_lines = []
+                continue
+
+            # Extract parameters
+            if "=" in line:
+                parts = [p.strip() for p in line.split("=", 1)]
+                if len(parts) == 2:
+                    param_name, param_value = parts
+                    if in_parameter_summary:
+                        if param_name in ("NBLK", "BS"):
+                            global_params[param_name] = param_value
+                        elif param_name == "TAU":
+                            tau_formulas.append(line)
+                    elif current_zone:
+                        if param_name == "T1MAX":
+                            try:
+                                zone_params[param_name] = str(float(param_value) / 1000000)
+                            except ValueError:
+                                zone_params[param_name] = param_value
+                        elif param_name == "BR":
+                            zone_params["dum"] = param_value
+                        else:
+                            zone_params[param_name] = param_value
+
+            if line == "DATA" and current_zone:
+                in_data_section = True
+                if tau_formulas and current_tau_index < len(tau_formulas):
+                    current_tau_index += 1
+                continue
+
+            if in_data_section and current_zone:
+                data_lines.append(line)
+
+        zone = close_zone()
+        if zone is not None:
+            yield zone
+
+
+def parse_sdf_lines(lines):
+    """Parse a whole SDF from an iterable of lines into an SDFFile."""
+    reader = SDFReader(lines)
+    zones = list(reader)
+    return SDFFile(zones, reader.global_params, reader.tau_formulas)
+
+
+def parse_sdf(file_path):
+    reader = SDFReader(file_path)
+    zones = list(reader)
+    return SDFFile(zones, reader.global_params, reader.tau_formulas)
+
+
+def parse_row_range(range_str):
+    """'start:end' -> (start, end); empty -> None. Raises ValueError if malformed."""
+    range_str = range_str.strip()
+    if not range_str:
+        return None
+    start, end = map(int, range_str.split(":"))
+    if start < 0 or end < start:
+        raise ValueError(f"Invalid row range: '{range_str}'")
+    return (start, end)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  BLOCK AVERAGING AND TAU
+# ═══════════════════════════════════════════════════════════════════
+
+def block_means(zone, nblk, bs, row_range=None):
+    """Mean of each block's column-3 values, optionally restricted to rows
+    start..end (inclusive) inside every block. Empty blocks give 0.0."""
+    blocks, valid = zone.blocks(nblk, bs)
+    if row_range:
+        range_start, range_end = row_range
+        blocks = blocks[:, range_start:range_end + 1]
+        valid = valid[:, range_start:range_end + 1]
+
+    counts = valid.sum(axis=1)
+    sums = np.where(valid, blocks, 0.0).sum(axis=1)
+    means = np.zeros(nblk, dtype=float)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+
+def generate_tau_values(scale_type, start, stop, num_points):
+    if scale_type == "log":
+        return np.logspace(np.log10(start), np.log10(stop), num=num_points)
+    elif scale_type == "lin":
+        return np.linspace(start, stop, num=num_points)
+    else:
+        raise ValueError(f"Unknown scale type: {scale_type}")
+
+
+def zone_tau_formula(zone, tau_formulas):
+    if 0 < zone.tau_index <= len(tau_formulas):
+        return tau_formulas[zone.tau_index - 1]
+    return None
+
+
+def zone_t1max(zone):
+    return float(zone.params.get("T1MAX", 1.0))
+
+
+def zone_tau_values(zone, tau_formulas):
+    """Tau axis in seconds from the zone's TAU formula, or [] if it has none."""
+    tau_formula = zone_tau_formula(zone, tau_formulas)
+    if tau_formula is None:
+        return []
+    match = TAU_PATTERN.match(tau_formula)
+    if not match:
+        return []
+    t1max = zone_t1max(zone)
+    scale_type = match.group(1)
+    mult1 = float(match.group(2))
+    mult2 = float(match.group(3))
+    n_points = int(match.group(4))
+    tau_values_micro = generate_tau_values(scale_type, mult1 * t1max * 1e6, mult2 * t1max * 1e6, n_points)
+    return (tau_values_micro / 1e6).tolist()
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  RESULTS
+# ═══════════════════════════════════════════════════════════════════
+
+class ZoneResult:
+    """One processed zone: tau axis and block means as arrays plus the header
+    values of its output. tau is NaN for blocks without a tau value ('N/A').
+    Text is only produced by lines() / text(), for display or saving."""
+
+    def __init__(self, zone_idx, name, params, t1max, tau_formula, tau, means):
+        self.zone_idx = zone_idx
+        self.name = name
+        self.params = params
+        self.t1max = t1max
+        self.tau_formula = tau_formula
+        self.tau = tau
+        self.means = means
+
+    def with_means(self, means):
+        return ZoneResult(self.zone_idx, self.name, self.params, self.t1max,
+                          self.tau_formula, self.tau, means)
+
+    def normalized(self, scheme):
+        return self.with_means(normalize_means(self.tau, self.means, scheme))
+
+    def lines(self):
+        """Output lines, each ending in '\\n'. Line 0 is the '# DATA' header and
+        line 1 the TAG line, which the GUIs colour."""
+        params = self.params
+        zone_content = []
+
+        if "dum" in params:
+            try:
+                dum_value = round(float(params["dum"]) * 1e6)
+                zone_content.append(f"# DATA dum = {dum_value} \n")
+            except ValueError:
+                zone_content.append(f"# DATA dum = {params['dum']} \n")
+        else:
+            zone_content.append("# DATA\n")
+
+        zone_content.append(f"#  TAG = Zone{self.zone_idx + 1}\n")
+        zone_content.append(f"# T1MAX = {self.t1max}\n")
+        if self.tau_formula is not None:
+            zone_content.append(f"# {self.tau_formula}\n")
+
+        na = "N/A".ljust(15)
+        for tau, mean in zip(self.tau.tolist(), self.means.tolist()):
+            tau_str = na if tau != tau else f"{tau:<15.6f}"     # NaN -> N/A
+            zone_content.append(f"{tau_str} {mean:<15.6f} 1\n")
+        return zone_content
+
+    def text(self):
+        return "".join(self.lines())
+
+
+class SDFResult:
+    """All processed zones of a file. Zones are separated by a blank line."""
+
+    def __init__(self, zones, nblk, bs):
+        self.zones = zones
+        self.nblk = nblk
+        self.bs = bs
+
+    def normalized(self, scheme):
+        """Normalise every zone at once on the stacked (zones, NBLK) arrays."""
+        if not self.zones:
+            return self
+        tau = np.vstack([zone.tau for zone in self.zones])
+        means = normalize_means(tau, np.vstack([zone.means for zone in self.zones]), scheme)
+        return SDFResult([zone.with_means(row) for zone, row in zip(self.zones, means)],
+                         self.nblk, self.bs)
+
+    def text(self):
+        return "\n".join(zone.text() for zone in self.zones)
+
+
+def _ready_zones(reader):
+    # Zones in file order, held back until NBLK / BS have been read
+    waiting = []
+    for zone in reader:
+        waiting.append(zone)
+        if reader.has_summary:
+            yield from waiting
+            waiting = []
+    yield from waiting
+
+
+def _process_zone(sdf, zone_idx, zone, row_range):
+    means = block_means(zone, sdf.nblk, sdf.bs, row_range)
+    tau = np.full(len(means), np.nan)
+    tau_values = zone_tau_values(zone, sdf.tau_formulas)[:len(means)]
+    tau[:len(tau_values)] = tau_values
+    return ZoneResult(zone_idx, zone.name, zone.params, zone_t1max(zone),
+                      zone_tau_formula(zone, sdf.tau_formulas), tau, means)
+
+
+def iter_processed_zones(reader, row_range=None):
+    """Yield a ZoneResult for every zone of an SDFReader as it is read.
+
+    Zones that arrive before NBLK / BS are known wait until the PARAMETER
+    SUMMARY has been read.
+    """
+    for zone_idx, zone in enumerate(_ready_zones(reader)):
+        yield _process_zone(reader, zone_idx, zone, row_range)
+
+
+def process_sdf(sdf, row_range=None):
+    """Block-average every zone of a parsed SDFFile into an SDFResult."""
+    zones = [_process_zone(sdf, zone_idx, zone, row_range)
+             for zone_idx, zone in enumerate(sdf.zones)]
+    return SDFResult(zones, sdf.nblk, sdf.bs)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  NORMALISATION
+# ═══════════════════════════════════════════════════════════════════
+
+NORMALIZE_SCHEMES = {
+    "minmax": "Min-max",
+    "first":  "By first point",
+    "m0":     "By M0",
+}
+M0_POINTS = 3                   # longest-tau points averaged as the M0 estimate
+
+
+def normalize_means(tau, means, scheme="minmax"):
+    """Normalise block means along the last axis (one zone per row).
+
+    Only points with a tau value take part; 'N/A' points (tau NaN) are
+    returned unchanged.
+        minmax : (m - min) / (max - min)
+        first  : m / m at the first point
+        m0     : m / M0, M0 being the mean of the M0_POINTS longest-tau points
+    A zero or undefined scale leaves the values unscaled.
+    """
+    tau = np.asarray(tau, dtype=float)
+    means = np.asarray(means, dtype=float)
+    valid = ~np.isnan(tau)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if scheme == "minmax":
+            offset = np.where(valid, means, np.inf).min(axis=-1, keepdims=True)
+            top = np.where(valid, means, -np.inf).max(axis=-1, keepdims=True)
+            scale = top - offset
+        elif scheme == "first":
+            first = np.argmax(valid, axis=-1)[..., np.newaxis]
+            offset = 0.0
+            scale = np.take_along_axis(means, first, axis=-1)
+        elif scheme == "m0":
+            longest = np.argsort(np.where(valid, tau, -np.inf), axis=-1)[..., -M0_POINTS:]
+            used = np.take_along_axis(valid, longest, axis=-1)
+            total = np.where(used, np.take_along_axis(means, longest, axis=-1), 0.0).sum(axis=-1, keepdims=True)
+            offset = 0.0
+            scale = total / used.sum(axis=-1, keepdims=True)
+        else:
+            raise ValueError(f"Unknown normalisation scheme: {scheme}")
+
+        scale = np.where(np.isfinite(scale) & (scale != 0), scale, 1.0)
+        offset = np.where(np.isfinite(offset), offset, 0.0)
+        return np.where(valid, (means - offset) / scale, means)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FFC-IST DATA
+# ═══════════════════════════════════════════════════════════════════
+
+def format_data_dum_sci_hz(freq_khz: float) -> str:
+    hz = freq_khz * 1000.0
+    if hz <= 0:
+        return "0e3"
+    exp  = int(math.floor(math.log10(hz)))
+    mant = hz / (10 ** exp)
+    while exp > 6:
+        mant *= 10.0;  exp -= 1
+    while exp < 3:
+        mant /= 10.0;  exp += 1
+    return f"{mant:.4g}e{exp}"
+
+
+def format_tag_label(freq_khz: float) -> str:
+    if freq_khz >= 1000.0:
+        return f"{freq_khz / 1000:.4g}MHz"
+    return f"{freq_khz:.4g}KHz"
+
+
+def _fmt_g(x: float) -> str:
+    return f"{x:.6g}"
+
+
+class FFCBlock:
+    """Rows of one frequency, in file order: times in seconds and values.
+
+    value_text is None when every value parsed as a number; otherwise it holds
+    the raw text for the values that did not (None for those that did).
+    """
+
+    def __init__(self, freq_khz, time_s, values, value_text=None):
+        self.freq_khz = freq_khz
+        self.time_s = time_s
+        self.values = values
+        self.value_text = value_text
+
+    def __len__(self):
+        return len(self.time_s)
+
+
+class FFCData:
+    """FFC-IST export: sample name, temperature, Parameters block and one FFCBlock per frequency, ascending."""
+
+    def __init__(self, sample_name, temperature, blocks, params=None):
+        self.sample_name = sample_name
+        self.temperature = temperature
+        self.blocks = blocks
+        self.params = params or {}
+
+
+def read_text(file_path, progress=None, chunk_size=READ_BUFFER_SIZE):
+    """Contents of a UTF-8 text file, read in chunks; progress(bytes_read, total)
+    is called after every chunk."""
+    total = os.path.getsize(file_path)
+    chunks = []
+    done = 0
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+    return b"".join(chunks).decode("utf-8")
+
+
+def _find_line(text, pattern):
+    """Offset of the first line whose stripped text starts with pattern, or None."""
+    for m in pattern.finditer(text):
+        i = m.start()
+        while i > 0 and text[i - 1].isspace() and text[i - 1] not in LINE_BREAKS:
+            i -= 1
+        if i == 0 or text[i - 1] in LINE_BREAKS:
+            return i
+    return None
+
+
+def _ffc_columns(data_lines):
+    """(temperature, freq, time_us, value) arrays, or None if any row breaks the fast path.
+
+    Every non-blank line must be a numeric row with at least six fields;
+    anything else (headers, comments, short rows, text values) goes through
+    _ffc_rows() instead, which applies the per-row rules.
+    """
+    rows = [line for line in data_lines if not line.isspace()]
+    dtype = [("temp", "f8"), ("freq", "f8"), ("time", "f8"), ("value", "f8"), ("extra", "U1")]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")     # "input contained no data"
+            table = np.loadtxt(rows, delimiter=",", usecols=FFC_COLUMNS, dtype=dtype,
+                               comments=None, ndmin=1)
+    except ValueError:
+        return None
+    return table["temp"], table["freq"], table["time"], table["value"]
+
+
+def _ffc_rows(data_lines):
+    """Row-by-row reading: first temperature and {freq_khz: [parts, ...]}."""
+    first_temp = None
+    freq_map = {}
+    for s in data_lines:
+        s = s.strip()
+        if not s or s.lower().startswith("endtau"):
+            continue
+        parts = [p.strip() for p in s.split(",")]
+        if first_temp is None:
+            try:
+                first_temp = float(parts[0])
+            except ValueError:
+                pass
+        if len(parts) >= 6:
+            try:
+                freq_khz = float(parts[1])
+            except ValueError:
+                continue
+            freq_map.setdefault(freq_khz, []).append(parts)
+    return first_temp, freq_map
+
+
+def _block_from_rows(freq_khz, rows):
+    times, values, texts = [], [], []
+    for parts in rows:
+        try:
+            time_us = float(parts[2])
+        except ValueError:
+            continue
+        times.append(time_us * 1e-6)
+        try:
+            values.append(float(parts[3]))
+            texts.append(None)
+        except ValueError:
+            values.append(math.nan)
+            texts.append(parts[3])
+    has_text = any(t is not None for t in texts)
+    return FFCBlock(freq_khz, np.array(times, dtype=float), np.array(values, dtype=float),
+                    texts if has_text else None)
+
+
+def parse_ffc_text(text, file_stem=""):
+    """Split an FFC-IST export into its data rows and Parameters block.
+
+    The data section (everything before the endtau line, or before
+    Parameters if there is none) is parsed once into typed columns and
+    grouped by frequency with a stable sort, so rows keep their file order
+    within each frequency.
+    """
+    endtau_at = _find_line(text, ENDTAU_PATTERN)
+    param_at = _find_line(text, PARAMETERS_PATTERN)
+    data_end = endtau_at if endtau_at is not None else param_at
+    data_lines = text[:data_end].splitlines()
+
+    params = {}
+    if param_at is not None:
+        for ln in text[param_at:].splitlines():
+            ln = ln.strip()
+            if "=" in ln and not ln.startswith("#"):
+                k, v = ln.split("=", 1)
+                params[k.strip()] = v.strip().strip('"')
+
+    sample_name = params.get("sampleName", file_stem if file_stem else "Unknown")
+
+    columns = _ffc_columns(data_lines)
+    if columns is not None:
+        temps, freqs, times_us, values = columns
+        first_temp = float(temps[0]) if len(temps) else None
+        order = np.argsort(freqs, kind="stable")
+        unique, starts = np.unique(freqs[order], return_index=True)
+        blocks = [FFCBlock(float(freq), times_us[rows] * 1e-6, values[rows])
+                  for freq, rows in zip(unique, np.split(order, starts[1:]))]
+    else:
+        first_temp, freq_map = _ffc_rows(data_lines)
+        blocks = [_block_from_rows(freq, freq_map[freq]) for freq in sorted(freq_map)]
+
+    temperature = (
+        "Unknown" if first_temp is None
+        else (str(int(first_temp))
+              if float(first_temp).is_integer()
+              else str(first_temp)))
+
+    return FFCData(sample_name, temperature, blocks, params)
+
+
+def load_ffc(file_path, progress=None):
+    """Read and parse one FFC-IST export; the file stem is the fallback sample name."""
+    file_stem = os.path.splitext(os.path.basename(file_path))[0]
+    return parse_ffc_text(read_text(file_path, progress), file_stem)
+
+
+def format_ffc(data):
+    """Output text for an FFCData: one '# DATA' block per frequency, ascending."""
+    out_lines = []
+    for block in data.blocks:
+        out_lines.append(f"# DATA dum={format_data_dum_sci_hz(block.freq_khz)}")
+        out_lines.append(
+            f"# TAG = {data.sample_name}"
+            f"_Temp = {data.temperature}C_{format_tag_label(block.freq_khz)}_1")
+
+        if block.value_text is None:
+            out_lines.extend(map(FFC_ROW.format, block.time_s.tolist(), block.values.tolist()))
+        else:
+            for time_sec, val, raw in zip(block.time_s.tolist(), block.values.tolist(), block.value_text):
+                val_str = _fmt_g(val) if raw is None else raw
+                out_lines.append(f"{_fmt_g(time_sec):>12}  {val_str:>12}  {1:>12}")
+
+        out_lines.append("")
+
+    return "\n".join(out_lines) + "\n"
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  BINARY OUTPUT
+# ═══════════════════════════════════════════════════════════════════
+
+def is_binary_output(path):
+    return os.path.splitext(path)[1].lower() in BINARY_SUFFIXES
+
+
+def sdf_records(zones):
+    """(attrs, tau, magnetization) per processed SDF zone."""
+    records = []
+    for zone in zones:
+        attrs = {
+            "name": zone.name,
+            "zone": zone.zone_idx + 1,
+            "dum": str(zone.params.get("dum", "")),
+            "TAG": f"Zone{zone.zone_idx + 1}",
+            "T1MAX": zone.t1max,
+            "TAU": zone.tau_formula or "",
+        }
+        records.append((attrs, zone.tau, zone.means))
+    return records
+
+
+def ffc_records(datas):
+    """(attrs, tau, magnetization) per frequency of one or more FFCData.
+
+    Values that were not numbers in the export are stored as NaN.
+    """
+    records = []
+    for data in datas:
+        for block in data.blocks:
+            attrs = {
+                "dum": format_data_dum_sci_hz(block.freq_khz),
+                "TAG": f"{data.sample_name}_Temp = {data.temperature}C_{format_tag_label(block.freq_khz)}_1",
+                "freq_khz": block.freq_khz,
+                "sample": data.sample_name,
+                "temperature": data.temperature,
+            }
+            records.append((attrs, block.time_s, block.values))
+    return records
+
+
+def write_zone_file(path, kind, records, **file_attrs):
+    """Write records to path as HDF5 (.hdf5) or NPZ (.npz).
+
+    Every zone becomes a group zone0001, zone0002, ... holding float64
+    datasets tau, magnetization and weight, with the record's attrs. HDF5
+    datasets are stored contiguous and uncompressed so read_zone_file() can
+    memory-map them. kind ("sdf" or "ffc") and file_attrs are stored on the
+    root.
+    """
+    file_attrs = {"format": ZONE_FILE_FORMAT, "version": ZONE_FILE_VERSION, "kind": kind, **file_attrs}
+    zones = []
+    for i, (attrs, tau, magnetization) in enumerate(records, 1):
+        tau = np.asarray(tau, dtype=np.float64)
+        magnetization = np.asarray(magnetization, dtype=np.float64)
+        zones.append((f"zone{i:04d}", attrs, {"tau": tau, "magnetization": magnetization,
+                                              "weight": np.ones_like(tau)}))
+
+    if path.lower().endswith(".npz"):
+        arrays = {f"{name}/{key}": array for name, _, datasets in zones for key, array in datasets.items()}
+        meta = {"file": file_attrs, "zones": {name: attrs for name, attrs, _ in zones}}
+        arrays["__attrs__"] = np.array(json.dumps(meta))
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+        return
+
+    if h5py is None:
+        raise RuntimeError("HDF5 output requires h5py: pip install h5py")
+    with h5py.File(path, "w") as f:
+        f.attrs.update(file_attrs)
+        for name, attrs, datasets in zones:
+            group = f.create_group(name)
+            group.attrs.update(attrs)
+            for key, array in datasets.items():
+                group.create_dataset(key, data=array)
+
+
+def read_zone_file(path, mmap=True):
+    """(file_attrs, [(name, attrs, {tau, magnetization, weight}), ...]) from a
+    write_zone_file() output. With mmap, HDF5 datasets are read-only memory
+    maps of the file instead of copies; NPZ members are loaded."""
+    if path.lower().endswith(".npz"):
+        with np.load(path) as npz:
+            meta = json.loads(str(npz["__attrs__"]))
+            zones = [(name, attrs, {key: npz[f"{name}/{key}"] for key in ZONE_DATASETS})
+                     for name, attrs in meta["zones"].items()]
+        return meta["file"], zones
+
+    if h5py is None:
+        raise RuntimeError("Reading HDF5 requires h5py: pip install h5py")
+    zones = []
+    with h5py.File(path, "r") as f:
+        file_attrs = dict(f.attrs)
+        for name in sorted(f):
+            group = f[name]
+            datasets = {}
+            for key in ZONE_DATASETS:
+                dataset = group[key]
+                offset = dataset.id.get_offset() if mmap else None
+                if offset is None:      # empty, chunked or mmap off
+                    datasets[key] = dataset[()]
+                else:
+                    datasets[key] = np.memmap(path, mode="r", dtype=dataset.dtype,
+                                              shape=dataset.shape, offset=offset)
+            zones.append((name, dict(group.attrs), datasets))
+    return file_attrs, zones
+
+
+def is_zone_file(path):
+    """True for .hdf5 / .npz files written by write_zone_file()."""
+    if not is_binary_output(path):
+        return False
+    try:
+        if path.lower().endswith(".npz"):
+            with np.load(path) as npz:
+                return json.loads(str(npz["__attrs__"]))["file"].get("format") == ZONE_FILE_FORMAT
+        if h5py is None:
+            return False
+        with h5py.File(path, "r") as f:
+            return f.attrs.get("format") == ZONE_FILE_FORMAT
+    except Exception:
+        return False
+
+
+def zone_file_text(path):
+    """The text output (as written by the converters) for a zone file."""
+    file_attrs, zones = read_zone_file(path)
+    if file_attrs.get("kind") == "ffc":
+        out_lines = []
+        for _, attrs, datasets in zones:
+            out_lines.append(f"# DATA dum={attrs['dum']}")
+            out_lines.append(f"# TAG = {attrs['TAG']}")
+            out_lines.extend(map(FFC_ROW.format, datasets["tau"].tolist(),
+                                 datasets["magnetization"].tolist()))
+            out_lines.append("")
+        return "\n".join(out_lines) + "\n"
+
+    results = []
+    for name, attrs, datasets in zones:
+        params = {"dum": attrs["dum"]} if attrs["dum"] else {}
+        results.append(ZoneResult(int(attrs["zone"]) - 1, attrs["name"], params, float(attrs["T1MAX"]),
+                                  attrs["TAU"] or None, np.asarray(datasets["tau"]),
+                                  np.asarray(datasets["magnetization"])))
+    return SDFResult(results, file_attrs.get("nblk"), file_attrs.get("bs")).text()
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  WHOLE FILES
+# ═══════════════════════════════════════════════════════════════════
+
+def process_sdf_file(file_path, row_range=None, output_path=None, normalize=None):
+    """Process one SDF file from start to finish.
+
+    Returns a summary dict: file, zones, nblk, bs, seconds, plus either
+    'output' (the path written, zone by zone as it is processed) or
+    'content' (the processed text) when no output_path is given. An .hdf5
+    or .npz output_path gets a binary zone file (write_zone_file()) instead
+    of text. normalize is one of NORMALIZE_SCHEMES, applied to every zone.
+    A partly written output is removed if the file fails.
+    """
+    start = time.perf_counter()
+    reader = SDFReader(file_path)
+    binary = output_path and is_binary_output(output_path)
+    processed = []
+    n_zones = 0
+    out = open(output_path, "w") if output_path and not binary else None
+    try:
+        for zone in iter_processed_zones(reader, row_range):
+            if normalize:
+                zone = zone.normalized(normalize)
+            if binary:
+                processed.append(zone)
+                continue
+            text = ("\n" if n_zones else "") + zone.text()
+            if out:
+                out.write(text)
+            else:
+                processed.append(text)
+            n_zones += 1
+        nblk, bs = reader.nblk, reader.bs
+        if binary:
+            n_zones = len(processed)
+            write_zone_file(output_path, "sdf", sdf_records(processed), nblk=nblk, bs=bs,
+                            source=os.path.basename(file_path))
+    except BaseException:
+        if out:
+            out.close()
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    if out:
+        out.close()
+
+    result = {"file": file_path, "zones": n_zones, "nblk": nblk, "bs": bs}
+    if output_path:
+        result["output"] = output_path
+    else:
+        result["content"] = "".join(processed)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _file_job(process, file_path, *args):
+    # Batch worker: failures are reported in the result so one bad file does
+    # not stop the rest
+    start = time.perf_counter()
+    try:
+        return process(file_path, *args)
+    except Exception as e:
+        return {"file": file_path, "error": str(e) or type(e).__name__,
+                "seconds": time.perf_counter() - start}
+
+
+def _map_files(process, workers, file_paths, *args):
+    # process(file_path, *per_file_args) for every file, one per worker
+    # process, in input order; args are iterables zipped with file_paths
+    if workers <= 1 or len(file_paths) <= 1:
+        yield from map(_file_job, repeat(process), file_paths, *args)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+        yield from executor.map(_file_job, repeat(process), file_paths, *args)
+
+
+def process_sdf_files(file_paths, row_range=None, output_paths=None, normalize=None,
+                      workers=PROCESS_WORKERS):
+    """Process many SDF files, one per worker process, yielding their
+    process_sdf_file() summaries in input order. A file that fails yields
+    {'file': ..., 'error': ..., 'seconds': ...} instead."""
+    file_paths = list(file_paths)
+    if output_paths is None:
+        output_paths = [None] * len(file_paths)
+    yield from _map_files(process_sdf_file, workers, file_paths, repeat(row_range),
+                          output_paths, repeat(normalize))
+
+
+def process_ffc_file(file_path, output_path=None):
+    """Convert one FFC-IST export.
+
+    Returns a summary dict: file, sample, temperature, frequencies, rows,
+    seconds, plus either 'output' (the path written; text, or a binary zone
+    file for .hdf5 / .npz) or 'data' (the parsed FFCData, e.g. for
+    merge_ffc()) when no output_path is given.
+    """
+    start = time.perf_counter()
+    data = load_ffc(file_path)
+    result = {"file": file_path, "sample": data.sample_name, "temperature": data.temperature,
+              "frequencies": len(data.blocks), "rows": sum(len(block) for block in data.blocks)}
+    if output_path:
+        write_ffc_output(output_path, [data], source=os.path.basename(file_path))
+        result["output"] = output_path
+    else:
+        result["data"] = data
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def write_sdf_output(path, result, source=""):
+    """Write an SDFResult as text (result.text()) or, for .hdf5 / .npz, a zone file."""
+    if is_binary_output(path):
+        write_zone_file(path, "sdf", sdf_records(result.zones), nblk=result.nblk, bs=result.bs,
+                        source=source)
+        return
+    with open(path, "w") as f:
+        f.write(result.text())
+
+
+def write_ffc_output(path, datas, source=""):
+    """Write FFCData as text (format_ffc(), one after another) or, for .hdf5 / .npz, a zone file."""
+    if is_binary_output(path):
+        write_zone_file(path, "ffc", ffc_records(datas), source=source)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        for data in datas:
+            f.write(format_ffc(data))
+
+
+def process_ffc_files(file_paths, output_paths=None, workers=PROCESS_WORKERS):
+    """process_ffc_file() over many exports, one per worker process, in input
+    order. A file that fails yields {'file': ..., 'error': ..., 'seconds': ...}."""
+    file_paths = list(file_paths)
+    if output_paths is None:
+        output_paths = [None] * len(file_paths)
+    yield from _map_files(process_ffc_file, workers, file_paths, output_paths)
+
+
+def _temperature_key(temperature):
+    # Numeric temperatures in numeric order, then "Unknown" and anything else
+    try:
+        return (0, float(temperature), temperature)
+    except ValueError:
+        return (1, 0.0, temperature)
+
+
+def merge_ffc(datas):
+    """Merge FFCData from many exports into one FFCData per (sample, temperature).
+
+    Groups come back sorted by sample name, then temperature. Within a group,
+    rows of the same frequency are concatenated in input order. Exports
+    without any data rows are left out.
+    """
+    groups = {}
+    for data in datas:
+        if not data.blocks:
+            continue            # nothing to merge from exports without data rows
+        groups.setdefault((data.sample_name, data.temperature), []).extend(data.blocks)
+
+    merged = []
+    for (sample_name, temperature), blocks in sorted(
+            groups.items(), key=lambda item: (item[0][0], _temperature_key(item[0][1]))):
+        freqs = np.array([block.freq_khz for block in blocks], dtype=float)
+        order = np.argsort(freqs, kind="stable")
+        unique, starts = np.unique(freqs[order], return_index=True)
+        merged_blocks = []
+        for freq, members in zip(unique, np.split(order, starts[1:])):
+            parts = [blocks[i] for i in members]
+            value_text = None
+            if any(part.value_text is not None for part in parts):
+                value_text = []
+                for part in parts:
+                    value_text.extend(part.value_text or [None] * len(part))
+            merged_blocks.append(FFCBlock(
+                float(freq),
+                np.concatenate([part.time_s for part in parts]),
+                np.concatenate([part.values for part in parts]),
+                value_text))
+        merged.append(FFCData(sample_name, temperature, merged_blocks))
+    return merged
+
+
+def collect_files(paths, pattern):
+    """Expand files and directory trees into a sorted list of (path, relative_path);
+    files inside directories must match the glob pattern (case-insensitive)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if fnmatch.fnmatch(name.lower(), pattern.lower()):
+                        full = os.path.join(dirpath, name)
+                        found.append((full, os.path.relpath(full, path)))
+        else:
+            found.append((path, os.path.basename(path)))
+    return found
+
+
+def collect_sdf_files(paths):
+    """Expand files and directory trees into a sorted list of (sdf_path, relative_path)."""
+    return collect_files(paths, "*.sdf")
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  COMMAND LINE
+# ═══════════════════════════════════════════════════════════════════
+
+def _output_paths(sources, output_dir, output_format):
+    # Mirror each input's relative path under output_dir as .txt / .hdf5 / .npz.
+    # Inputs that would share an output (run.sdf in two input folders) are
+    # rejected before anything is written, as the workers would race for it.
+    output_paths = []
+    writers = {}
+    for file_path, relative in sources:
+        output_path = os.path.join(output_dir, os.path.splitext(relative)[0] + "." + output_format)
+        if os.path.abspath(output_path) == os.path.abspath(file_path):
+            raise ValueError(f"output would overwrite its input: {file_path}")
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in writers:
+            raise ValueError(f"{writers[key]} and {file_path} would both be written to {output_path}")
+        writers[key] = file_path
+        output_paths.append(output_path)
+    for output_path in output_paths:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    return output_paths
+
+
+def _report(args, done, total, result, describe):
+    if not args.quiet:
+        status = f"FAILED: {result['error']}" if "error" in result else describe(result)
+        print(f"[{done}/{total}] {result['file']}: {status} ({result['seconds']:.2f}s)",
+              file=sys.stderr)
+
+
+def _write_manifest(args, settings, entries, seconds, extra=None):
+    failed = sum(1 for entry in entries if "error" in entry)
+    manifest = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        **settings,
+        "workers": args.workers,
+        "files": len(entries),
+        "failed": failed,
+        "seconds": round(seconds, 4),
+        **(extra or {}),
+        "results": entries,
+    }
+    manifest_path = args.manifest or os.path.join(args.output, "manifest.json")
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    if not args.quiet:
+        print(f"Converted {len(entries) - failed}/{len(entries)} files in {manifest['seconds']:.2f}s; "
+              f"manifest: {manifest_path}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_convert(args):
+    """`nmr_processing.py convert`: convert every SDF under the inputs to .txt."""
+    try:
+        row_range = parse_row_range(args.range)
+    except ValueError:
+        print(f"Error: invalid row range '{args.range}' (expected start:end)", file=sys.stderr)
+        return 2
+
+    sources = collect_sdf_files(args.inputs)
+    if not sources:
+        print("Error: no .sdf files found", file=sys.stderr)
+        return 2
+    file_paths = [file_path for file_path, _ in sources]
+    try:
+        output_paths = _output_paths(sources, args.output, args.format)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    entries = []
+    for done, result in enumerate(process_sdf_files(file_paths, row_range, output_paths,
+                                                    args.normalize, args.workers), 1):
+        result.pop("content", None)
+        result["seconds"] = round(result["seconds"], 4)
+        entries.append(result)
+        _report(args, done, len(file_paths), result,
+                lambda r: f"{r['zones']} zones, NBLK={r['nblk']} BS={r['bs']}")
+
+    settings = {"row_range": args.range or None, "normalize": args.normalize, "format": args.format}
+    return _write_manifest(args, settings, entries, time.perf_counter() - start)
+
+
+def cmd_ffc(args):
+    """`nmr_processing.py ffc`: convert FFC-IST exports, one output per input or
+    merged by sample, temperature and frequency."""
+    output_root = os.path.abspath(args.output)
+    # Earlier outputs inside an input folder are not inputs
+    sources = [(file_path, relative) for file_path, relative in collect_files(args.inputs, args.pattern)
+               if os.path.commonpath([output_root, os.path.abspath(file_path)]) != output_root]
+    if not sources:
+        print(f"Error: no {args.pattern} files found", file=sys.stderr)
+        return 2
+    file_paths = [file_path for file_path, _ in sources]
+    if args.merge:
+        output_paths = None
+    else:
+        try:
+            output_paths = _output_paths(sources, args.output, args.format)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+
+    start = time.perf_counter()
+    entries, datas = [], []
+    for done, result in enumerate(process_ffc_files(file_paths, output_paths, args.workers), 1):
+        if "data" in result:
+            datas.append(result.pop("data"))
+        result["seconds"] = round(result["seconds"], 4)
+        entries.append(result)
+        _report(args, done, len(file_paths), result,
+                lambda r: f"{r['sample']} at {r['temperature']} C, {r['frequencies']} frequencies")
+
+    merged_info = {}
+    if args.merge:
+        merged = merge_ffc(datas)
+        merge_path = os.path.join(args.output, args.merge)
+        if not os.path.splitext(merge_path)[1]:
+            merge_path += "." + args.format
+        os.makedirs(os.path.dirname(merge_path) or ".", exist_ok=True)
+        write_ffc_output(merge_path, merged)
+        merged_info["merged"] = merge_path
+        merged_info["groups"] = [
+            {"sample": data.sample_name, "temperature": data.temperature,
+             "frequencies": len(data.blocks), "rows": sum(len(block) for block in data.blocks)}
+            for data in merged]
+        if not args.quiet:
+            print(f"Merged {len(datas)} files into {len(merged)} sample/temperature groups: {merge_path}",
+                  file=sys.stderr)
+    settings = {"pattern": args.pattern, "merge": args.merge, "format": args.format}
+    return _write_manifest(args, settings, entries, time.perf_counter() - start, merged_info)
+
+
+def _add_batch_arguments(parser):
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="txt",
+                        help="output format; hdf5 / npz store each zone as tau, magnetization "
+                             "and weight arrays (default: txt)")
+    parser.add_argument("--workers", type=int, default=PROCESS_WORKERS,
+                        help=f"worker processes (default: {PROCESS_WORKERS})")
+    parser.add_argument("--manifest", help="manifest path (default: <output>/manifest.json)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="nmr_processing",
+                                     description="Headless SDF and FFC-IST processing")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="convert SDF files or whole directory trees to .txt")
+    convert.add_argument("inputs", nargs="+", help=".sdf files or directories searched recursively")
+    convert.add_argument("--output", "-o", default="converted",
+                         help="output folder; directory structure is mirrored (default: converted)")
+    convert.add_argument("--range", default="", help="row range inside every block, e.g. 0:349")
+    convert.add_argument("--normalize", nargs="?", const="minmax", choices=sorted(NORMALIZE_SCHEMES),
+                         help="normalise every zone (default scheme: minmax)")
+    _add_batch_arguments(convert)
+    convert.set_defaults(run=cmd_convert)
+
+    ffc = sub.add_parser("ffc", help="convert FFC-IST exports, per file or merged")
+    ffc.add_argument("inputs", nargs="+", help="export files or directories searched recursively")
+    ffc.add_argument("--output", "-o", default="converted",
+                     help="output folder; directory structure is mirrored (default: converted)")
+    ffc.add_argument("--pattern", default="*.txt",
+                     help="file name pattern inside directories (default: *.txt)")
+    ffc.add_argument("--merge", nargs="?", const="merged",
+                     help="write one file under the output folder, grouped by sample, "
+                          "temperature and frequency (default name: merged.<format>)")
+    _add_batch_arguments(ffc)
+    ffc.set_defaults(run=cmd_ffc)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
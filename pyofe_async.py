@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+PyOFE asyncio fit client
+========================
+Submits many fits concurrently from a single event loop instead of one thread
+per job. The request is the same as FitClient.query() (multipart "file" plus
+form params); at most max_concurrency uploads are in flight at once and every
+result ZIP is streamed to disk before extraction.
+
+    async with AsyncFitClient(url, max_concurrency=200) as client:
+        async for job in client.fit_many(files, function=MONOEXP):
+            print(job.status, job.download_folder)
+
+From the command line: python pyofe_client.py fit campaign/ --function ... --async
+
+Requires aiohttp (pip install aiohttp). pyofe_stub_server.py provides a local
+/fit endpoint to try it against.
+"""
+# Standard libraries
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zipfile
+from contextlib import asynccontextmanager
+# Third-party libraries
+try:
+    import aiohttp
+except ImportError:  # optional: only needed for the asyncio client
+    aiohttp = None
+
+from pyofe_client import (
+    UNIVERSITY_URL, DOWNLOAD_FOLDER, DOWNLOAD_CHUNK_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT,
+    BATCH_RETRIES, BATCH_RETRY_DELAY,
+    JOB_RUNNING, JOB_RETRYING, JOB_DONE, JOB_FAILED, JOB_CANCELLED,
+    UPLOAD_CHUNK_SIZE, CompressedBody, FitClient, FitJob, InputRejected, build_fit_params,
+    multipart_parts, open_upload, result_folder_for, subset_for_upload,
+)
+
+
+ASYNC_CONCURRENCY = 64                  # uploads in flight at the same time
+
+
+async def _stream_body(body):
+    # A CompressedBody read block by block off the event loop
+    while True:
+        block = await asyncio.to_thread(body.read, DOWNLOAD_CHUNK_SIZE)
+        if not block:
+            break
+        yield block
+
+
+async def _save_stream(content, path):
+    # Network chunks gathered into DOWNLOAD_CHUNK_SIZE writes; opening, writing and
+    # closing the file all happen in the thread pool, never on the event loop
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        buffer = bytearray()
+        async for chunk in content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) >= DOWNLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(f.write, buffer)
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(f.write, buffer)
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+@asynccontextmanager
+async def _open_upload_thread(file_path, source):
+    # open_upload() entered and left in the thread pool: it opens the input and, for
+    # binary zone files, renders their whole zone text before anything is sent
+    upload = open_upload(file_path, source=source)
+    filename, file = await asyncio.to_thread(upload.__enter__)
+    try:
+        yield filename, file
+    except BaseException:
+        if not await asyncio.to_thread(upload.__exit__, *sys.exc_info()):
+            raise
+    else:
+        await asyncio.to_thread(upload.__exit__, None, None, None)
+
+
+def _extract_zip(archive, download_folder):
+    with zipfile.ZipFile(archive, "r") as zip_file:
+        zip_file.extractall(download_folder)
+
+
+class AsyncFitClient:
+    """asyncio counterpart of FitClient for campaign-sized batches.
+
+    Use it as an async context manager so the aiohttp session and its
+    connection pool are closed afterwards. Disk-bound work (hashing for the
+    cache, opening and rendering inputs, ZIP extraction, clearing the folder
+    of a failed attempt) runs in the default thread pool so it never stalls
+    the event loop, and so do chunked uploads (FitClient.upload, see
+    upload_mode), after which /fit only names the finished upload. Text
+    inputs are compressed as for FitClient (see compression).
+    """
+
+    def __init__(self, url=UNIVERSITY_URL, max_concurrency=ASYNC_CONCURRENCY,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), cache=None,
+                 max_retries=BATCH_RETRIES, retry_delay=BATCH_RETRY_DELAY, index=None,
+                 upload_mode="auto", chunk_size=UPLOAD_CHUNK_SIZE, compression="auto", subset=None):
+        if aiohttp is None:
+            raise RuntimeError("AsyncFitClient requires aiohttp: pip install aiohttp")
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.index = index
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._uploader = FitClient(url, timeout=timeout, upload_mode=upload_mode, chunk_size=chunk_size,
+                                   compression=compression, subset=subset)
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connect_timeout, read_timeout = self.timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout,
+                                          sock_read=read_timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    def _finish(self, zip_file_path, download_folder, cache_key, meta):
+        _extract_zip(zip_file_path, download_folder)
+        if cache_key:
+            with open(zip_file_path, "rb") as f:
+                self.cache.put(cache_key, f, meta)
+        os.remove(zip_file_path)
+
+    def _record(self, file_path, params, download_folder, started, from_cache):
+        # Like FitClient.record: a fit that succeeded is not failed by its index entry
+        try:
+            self.index.record(file_path, self._uploader.key_params(params), self.url, download_folder,
+                              started, from_cache)
+        except (sqlite3.Error, OSError, ValueError):
+            pass
+
+    async def query(self, file_path, params, download_folder, use_cache=True):
+        """Upload one file and extract the returned ZIP. Returns True on a cache hit."""
+        started = time.time()
+        cache_key = None
+        if self.cache is not None:
+            cache_key = await asyncio.to_thread(self.cache.key, file_path, self._uploader.key_params(params),
+                                                self.url)
+            cached = await asyncio.to_thread(self.cache.get, cache_key) if use_cache else None
+            if cached is not None:
+                with cached:
+                    await asyncio.to_thread(_extract_zip, cached, download_folder)
+                if self.index is not None:
+                    await asyncio.to_thread(self._record, file_path, params, download_folder, started, True)
+                return True
+
+        os.makedirs(download_folder, exist_ok=True)
+        zip_file_path = os.path.join(download_folder, "downloaded.zip")
+
+        async with self._semaphore:
+            # Cutting an HDF5 input down to its selected zones is disk work too
+            subset_path = await asyncio.to_thread(subset_for_upload, file_path, self._uploader.subset)
+            try:
+                async with _open_upload_thread(file_path, subset_path) as (filename, file):
+                    upload_id = await asyncio.to_thread(self._uploader.upload, file_path, filename, file)
+                    encoding = None
+                    if upload_id is None:
+                        encoding = await asyncio.to_thread(self._uploader.upload_encoding, filename)
+                    headers = None
+                    if encoding:
+                        content_type, parts = multipart_parts(params, "file", filename, file)
+                        data = _stream_body(CompressedBody(parts, encoding))
+                        headers = {"Content-Type": content_type, "Content-Encoding": encoding}
+                    else:
+                        data = aiohttp.FormData()
+                        for k, v in params.items():
+                            data.add_field(k, str(v))
+                        if upload_id is None:
+                            # aiohttp reads file parts in its executor while sending
+                            data.add_field("file", file, filename=filename)
+                        else:
+                            # A content type keeps the form multipart without a file part
+                            data.add_field("upload", upload_id, content_type="text/plain")
+
+                    async with self._session.post(self.url, data=data, headers=headers) as response:
+                        if response.status != 200:
+                            error_body = (await response.text()).strip() or "No server response body."
+                            raise Exception(
+                                f"File upload failed.\n"
+                                f"Status: {response.status}\n"
+                                f"Server response:\n{error_body}"
+                            )
+
+                        content_type = response.headers.get("Content-Type", "")
+                        if "application/zip" not in content_type and "application/octet-stream" not in content_type:
+                            raise Exception(
+                                f"The query to {self.url} did not return a ZIP file.\n"
+                                f"Returned Content-Type: {content_type}\n"
+                                f"Body:\n{(await response.text())[:2000]}"
+                            )
+
+                        await _save_stream(response.content, zip_file_path)
+            finally:
+                if subset_path:
+                    os.remove(subset_path)
+
+        # Extraction happens after the slot is released so the next upload can start
+        meta = {
+            "file": os.path.abspath(file_path),
+            "url": self.url,
+            "params": params,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        await asyncio.to_thread(self._finish, zip_file_path, download_folder, cache_key, meta)
+        if self.index is not None:
+            await asyncio.to_thread(self._record, file_path, params, download_folder, started, False)
+        return False
+
+    async def run(self, job, use_cache=True):
+        """Run one FitJob with the same retry/backoff rules as FitQueue."""
+        start = time.monotonic()
+        delay = self.retry_delay
+        try:
+            while True:
+                job.attempts += 1
+                job.status = JOB_RUNNING
+                try:
+                    # Like FitQueue: nothing of a failed attempt is mixed into the next one
+                    await asyncio.to_thread(shutil.rmtree, job.download_folder, ignore_errors=True)
+                    await self.query(job.file_path, job.params, job.download_folder, use_cache)
+                    job.status, job.error = JOB_DONE, None
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except InputRejected as e:
+                    # The same input would be rejected again
+                    job.status, job.error = JOB_FAILED, str(e)
+                    break
+                except Exception as e:
+                    job.error = str(e) or type(e).__name__
+                    if job.attempts > self.max_retries:
+                        job.status = JOB_FAILED
+                        break
+                    job.status = JOB_RETRYING
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        except asyncio.CancelledError:
+            job.status = JOB_CANCELLED
+            raise
+        finally:
+            job.elapsed = time.monotonic() - start
+        return job
+
+    async def as_completed(self, jobs, use_cache=True):
+        """Run jobs concurrently and yield each one as soon as it finishes.
+
+        Leaving the loop early cancels the jobs that have not finished yet.
+        """
+        tasks = [asyncio.ensure_future(self.run(job, use_cache)) for job in jobs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def fit_many(self, file_paths, function="", logx="yes", logy="yes", autox="yes",
+                       autoy="yes", symb_size="1.0", base_folder=DOWNLOAD_FOLDER, use_cache=True):
+        """Fit every file into its own folder under base_folder, yielding FitJobs as they finish.
+
+        Inputs rejected by build_fit_params() are yielded first as failed jobs.
+        """
+        jobs, taken = [], set()
+        for file_path in file_paths:
+            folder = result_folder_for(base_folder, file_path, taken)
+            taken.add(folder)
+            job = FitJob(file_path, None, folder)
+            try:
+                job.params, _ = build_fit_params(file_path, function, logx, logy, autox, autoy, symb_size)
+            except ValueError as e:
+                job.status, job.error = JOB_FAILED, str(e)
+                yield job
+                continue
+            jobs.append(job)
+
+        async for job in self.as_completed(jobs, use_cache):
+            yield job
+
+
+def cmd_fit(args, files, function, cache, index=None, subset=None):
+    """`pyofe_client.py fit --async`: run the batch on the event loop and print a summary."""
+    if aiohttp is None:
+        print("Error: --async requires aiohttp (pip install aiohttp)", file=sys.stderr)
+        return 1
+    flags = (args.logx, args.logy, args.autox, args.autoy)
+
+    async def run_all():
+        finished = []
+        async with AsyncFitClient(args.url, max_concurrency=max(1, args.workers),
+                                  timeout=(CONNECT_TIMEOUT, args.timeout), cache=cache,
+                                  max_retries=args.retries, index=index, upload_mode=args.upload,
+                                  chunk_size=max(1, int(args.chunk_size * 1024 ** 2)),
+                                  compression=args.compress, subset=subset) as client:
+            async for job in client.fit_many(files, function, *flags, symb_size=args.symbsize,
+                                             base_folder=args.output, use_cache=not args.no_cache):
+                if not args.quiet:
+                    detail = f": {job.error.splitlines()[0]}" if job.error else ""
+                    print(f"[{job.status:>9}] {job.file_path}{detail}", file=sys.stderr)
+                finished.append(job)
+        return finished
+
+    jobs = asyncio.run(run_all())
+
+    for job in jobs:
+        print(f"{job.status}\t{job.elapsed:.1f}s\t{job.file_path}\t{job.download_folder}")
+    if not args.quiet and cache is not None:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+    return 1 if any(job.status != JOB_DONE for job in jobs) else 0
@@ -0,0 +1,1837 @@
+#!/usr/bin/env python3
+"""
+PyOFE fit client
+================
+Request, download and extraction logic for the OneFit server, shared by the
+PyOFE-API GUI and the command line. Importing this module never touches Tk,
+so it can be used on headless compute nodes and from pipelines:
+
+    from pyofe_client import FitClient
+    FitClient("http://host:8142/fit").fit("data.hdf5", function=MONOEXP)
+
+Command line:
+
+    python pyofe_client.py fit data.hdf5 --function "Mz(t,...)=..." --url http://host:8142/fit
+    python pyofe_client.py fit campaign/ --function Monoexponential --workers 8
+    python pyofe_client.py list --url http://host:8142/fit
+    python pyofe_client.py history --param T11 --file data.hdf5
+    python pyofe_client.py fit stelar.hdf5 --zones 1-4 --temperature 20:40 --function Monoexponential
+"""
+# Standard libraries
+import argparse
+import atexit
+import hashlib
+import io
+import json
+import os
+import posixpath
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+import urllib.parse
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+# Third-party libraries
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import zstandard
+except ImportError:  # optional: only needed for zstd upload compression
+    zstandard = None
+# Local modules
+import nmr_processing
+import pyofe_hdf5
+
+
+# Default URLs
+UNIVERSITY_URL = "http://192.92.147.107:8142/fit"
+
+FUNCTIONS_JSON_PATH = "functions.json"
+
+# Streaming download settings
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024       # bytes read from the socket per write
+SPOOL_MAX_SIZE = 64 * 1024 * 1024       # spooled ZIPs larger than this roll over to disk
+PROGRESS_INTERVAL = 0.25                # seconds between progress updates
+
+# Resumable uploads: POST <server>/upload, then PUT <server>/upload/<id> chunk by chunk
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024     # bytes per PUT, each sent with its own SHA-256
+CHUNKED_UPLOAD_MIN_SIZE = 256 * 1024 ** 2  # auto mode uploads files at least this large in chunks
+UPLOAD_RETRIES = 5                      # failed chunks in a row before the upload gives up
+UPLOAD_RETRY_DELAY = 2.0                # seconds, doubled after every failed chunk
+UPLOAD_MODES = ("auto", "chunked", "single")
+
+# Upload compression (Content-Encoding); the server lists what it decodes in the
+# Accept-Encoding header of its /list response
+COMPRESSION_MODES = ("auto", "zstd", "gzip", "none")
+COMPRESSIBLE_EXTENSIONS = ['.sdf', '.dat', '.txt', '.json']
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+DOWNLOAD_FOLDER = "downloaded"
+ALLOWED_EXTENSIONS = ['.hdf5', '.h5', '.5hdf', '.json', '.sav', '.zip', '.dat', '.sdf', '.txt', '.npz']
+
+# HTTP session defaults, shared by /fit, /list and any other endpoint
+POOL_SIZE = 16                          # keep-alive connections kept per host
+CONNECT_TIMEOUT = 10.0                  # seconds
+READ_TIMEOUT = 900.0                    # seconds; large fits can keep the server busy for minutes
+HTTP_RETRIES = 3                        # on 5xx responses and dropped/reset connections
+HTTP_BACKOFF = 0.5                      # seconds, urllib3 doubles it on every retry
+POST_RETRY_STATUSES = (502, 503, 504)   # the fit was not run, so the POST may be sent again
+
+# Result cache defaults
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".pyofe", "cache")
+CACHE_MAX_BYTES = 2 * 1024 ** 3         # least recently used results are evicted above this
+CACHE_STATS_FILE = "stats.json"         # hit / miss / store / eviction totals, kept in the cache folder
+CACHE_COUNTERS = ("hits", "misses", "stores", "evictions")
+CACHE_STATS_BATCH = 50                  # counts kept in memory before the stats file is rewritten
+
+# Fit run index
+INDEX_PATH = os.path.join(os.path.expanduser("~"), ".pyofe", "fit_index.sqlite")
+INDEX_TIMEOUT = 30.0                    # seconds to wait for another writer's lock
+
+# Function catalogue (/list), cached per server
+CATALOGUE_FOLDER = os.path.join(os.path.expanduser("~"), ".pyofe", "functions")
+CATALOGUE_TTL = 3600.0                  # seconds a cached catalogue is used without asking the server
+
+# Batch fitting defaults
+BATCH_WORKERS = 4
+BATCH_RETRIES = 2
+BATCH_RETRY_DELAY = 5.0                 # seconds, doubled after every failed attempt
+
+# Result tables
+RESULT_PARSE_WORKERS = 8                # threads reading the result JSONs of one download
+SOURCE_COLUMN = "Source"                # merged-table column naming each row's JSON
+
+# Default functions
+MONOEXP = r"Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5])[-1.2<1.2]=Mi \+ (M0-Mi)*exp(-t/T11)"
+BIEXP = r"Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5],T12[0.0001<5],c[0.5<1])[-1.2<1.2]=Mi \+ c*(M0-Mi)*exp(-t/T11) \+(1-c)*(M0-Mi)*exp(-t/T12)"
+
+
+def ensure_functions_json():
+    # Confirm that JSON file with functions is generated if missing
+    if not os.path.exists(FUNCTIONS_JSON_PATH):
+        default_functions = {
+            "functions": {
+                "Monoexponential": MONOEXP,
+                "Biexponential": BIEXP
+            },
+            "urls": {
+                "University URL": UNIVERSITY_URL
+            }
+        }
+        with open(FUNCTIONS_JSON_PATH, "w") as json_file:
+            json.dump(default_functions, json_file, indent=4)
+
+
+# Function to load functions and URLs from JSON file
+def load_functions_and_urls_from_json():
+    ensure_functions_json()
+    with open(FUNCTIONS_JSON_PATH, "r") as json_file:
+        data = json.load(json_file)
+    return data["functions"], data["urls"]
+
+
+class PostSafeRetry(Retry):
+    """Retry that never sends a POST twice to a server that may have run it.
+
+    POST is left out of allowed_methods, so read errors and timeouts are not
+    retried for it (a /fit can keep the server busy for minutes), and of the
+    status codes it is only resent on POST_RETRY_STATUSES. Connection errors
+    are retried for every method, since nothing reached the server.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST":
+            return status_code in POST_RETRY_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def create_session(pool_size=POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    """Build a requests.Session with a keep-alive connection pool and retry/backoff.
+
+    Retries cover connection errors for every request, and resets while
+    reading and 500/502/503/504 responses for the idempotent GET / HEAD / PUT
+    (see PostSafeRetry for POST); re-running a fit that failed is left to
+    FitQueue. After the last retry the final response is returned as-is so
+    callers still see the server's error body.
+    """
+    retry = PostSafeRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "PUT"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+_shared_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the process-wide session, creating it with the defaults on first use."""
+    global _shared_session
+    with _session_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def configure_session(pool_size=POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    """Replace the shared session, e.g. to grow the pool for a wide batch."""
+    global _shared_session
+    with _session_lock:
+        if _shared_session is not None:
+            _shared_session.close()
+        _shared_session = create_session(pool_size, retries, backoff)
+        return _shared_session
+
+
+def format_bytes(num_bytes):
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def download_stream(response, destination, chunk_size=DOWNLOAD_CHUNK_SIZE, progress_callback=None):
+    """Copy a streamed response body into a writable file object chunk by chunk.
+
+    progress_callback(received_bytes, total_bytes, bytes_per_second) is called at most
+    every PROGRESS_INTERVAL seconds and once more when the download finishes.
+    total_bytes is 0 when the server does not send a Content-Length.
+    """
+    total = int(response.headers.get("Content-Length") or 0)
+    received = 0
+    start = time.monotonic()
+    last_report = start
+
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if not chunk:
+            continue
+        destination.write(chunk)
+        received += len(chunk)
+
+        now = time.monotonic()
+        if progress_callback and now - last_report >= PROGRESS_INTERVAL:
+            progress_callback(received, total, received / max(now - start, 1e-9))
+            last_report = now
+
+    if progress_callback:
+        progress_callback(received, total, received / max(time.monotonic() - start, 1e-9))
+    return received
+
+
+def client_encodings():
+    """Content codings this client can compress with, most preferred first."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def _compressor(encoding):
+    # Object with compress(bytes) and flush() for one stream
+    if encoding == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires zstandard: pip install zstandard")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported content coding: {encoding}")
+
+
+def compress_bytes(data, encoding):
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+class CompressedBody:
+    """Request body that compresses its parts while it is being sent.
+
+    parts are bytes and binary file objects, sent in order; read() only
+    compresses as much as it needs for the next block, so memory stays at
+    about one block whatever the file size. requests streams it with
+    chunked transfer encoding, and urllib3 rewinds it with seek(0) before it
+    retries a request, which starts the compression again.
+    """
+
+    def __init__(self, parts, encoding, block_size=DOWNLOAD_CHUNK_SIZE):
+        self.parts = parts
+        self.encoding = encoding
+        self.block_size = block_size
+        self._starts = [part.tell() if hasattr(part, "read") else 0 for part in parts]
+        self.seek(0)
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.block_size), b"")
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("a compressed body can only be rewound to the start")
+        for part, start in zip(self.parts, self._starts):
+            if hasattr(part, "read"):
+                part.seek(start)
+        self._compressor = _compressor(self.encoding)
+        self._next_part = 0
+        self._buffer = b""
+        self._position = 0
+        self._done = False
+        return 0
+
+    def _fill(self):
+        # Compress the next piece of input into the buffer
+        if self._next_part == len(self.parts):
+            self._buffer += self._compressor.flush()
+            self._done = True
+            return
+        part = self.parts[self._next_part]
+        data = part.read(self.block_size) if hasattr(part, "read") else part
+        if not data or not hasattr(part, "read"):
+            self._next_part += 1
+        if data:
+            self._buffer += self._compressor.compress(data)
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        block, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._position += len(block)
+        return block
+
+
+def multipart_parts(fields, file_field, filename, file):
+    """(Content-Type, parts) of a multipart/form-data body with fields and one file."""
+    boundary = os.urandom(16).hex()
+    head = b""
+    for name, value in fields.items():
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f'{value}\r\n').encode("utf-8")
+    quoted = filename.replace('"', "%22")
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{quoted}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return f"multipart/form-data; boundary={boundary}", [head, file, tail]
+
+
+def _response_offset(response):
+    # Offset the server holds for an upload, from the Upload-Offset header or the JSON body
+    offset = response.headers.get("Upload-Offset")
+    if offset is None:
+        offset = response.json()["offset"]
+    return int(offset)
+
+
+def upload_resumable(session, upload_url, filename, file, digest=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                     timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), progress_callback=None, log=None,
+                     retries=UPLOAD_RETRIES, retry_delay=UPLOAD_RETRY_DELAY, encoding=None):
+    """Send an open binary file to upload_url in checksummed chunks; return the upload id.
+
+    POST upload_url opens an upload for (filename, size, SHA-256), or reopens
+    the one the server already holds for them, and answers with its id and
+    the offset it has, so an upload interrupted in an earlier run continues
+    where it stopped. Every chunk is PUT to upload_url/<id> with
+    Upload-Offset and Upload-Checksum headers; the server rejects a chunk
+    whose checksum does not match (460) and answers 409 with its own offset
+    when the offsets disagree. Dropped connections and rejected chunks are
+    retried from the server's offset, up to `retries` failures in a row.
+    With an encoding ("gzip" / "zstd") every chunk is compressed on its own
+    and sent with Content-Encoding; offsets and checksums stay those of the
+    uncompressed file.
+
+    progress_callback(sent_bytes, total_bytes, bytes_per_second) is called as
+    for downloads. Returns None when the server does not open an upload:
+    any reply other than 200 / 201 with an upload id (no /upload endpoint, or
+    a proxy or server refusing it), so the caller can send the file with /fit.
+    """
+    if log is None:
+        log = lambda message: None
+    size = file.seek(0, os.SEEK_END)
+    if digest is None:
+        hasher = hashlib.sha256()
+        file.seek(0)
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+    response = session.post(upload_url, json={"filename": filename, "size": size, "sha256": digest,
+                                              "chunk_size": chunk_size}, timeout=timeout)
+    try:
+        upload_id = response.json()["id"] if response.status_code in (200, 201) else None
+    except (ValueError, KeyError, TypeError):
+        upload_id = None
+    if upload_id is None:
+        log(f"No chunked upload at {upload_url} (HTTP {response.status_code})\n")
+        return None
+    chunk_url = f"{upload_url}/{upload_id}"
+    offset = start_offset = _response_offset(response)
+    if offset:
+        log(f"Resuming upload {upload_id} at {format_bytes(offset)} of {format_bytes(size)}\n")
+
+    failures, delay = 0, retry_delay
+    start = last_report = time.monotonic()
+    while offset < size:
+        chunk_offset = offset
+        file.seek(offset)
+        chunk = file.read(chunk_size)
+        headers = {
+            "Content-Type": "application/offset+octet-stream",
+            "Upload-Offset": str(offset),
+            "Upload-Checksum": "sha256 " + hashlib.sha256(chunk).hexdigest(),
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            chunk = compress_bytes(chunk, encoding)
+        try:
+            response = session.put(chunk_url, data=chunk, headers=headers, timeout=timeout)
+            if response.status_code in (200, 204):
+                offset, failures, delay = _response_offset(response), 0, retry_delay
+                now = time.monotonic()
+                if progress_callback and (now - last_report >= PROGRESS_INTERVAL or offset >= size):
+                    progress_callback(offset, size, (offset - start_offset) / max(now - start, 1e-9))
+                    last_report = now
+                continue
+            if response.status_code == 409:
+                problem = "offset mismatch"
+                offset = _response_offset(response)
+            elif response.status_code == 460:
+                problem = "checksum mismatch"
+            elif response.status_code >= 500:
+                problem = f"HTTP {response.status_code}"
+            else:
+                raise Exception(f"Chunk upload failed at {format_bytes(chunk_offset)}.\n"
+                                f"Status: {response.status_code}\n"
+                                f"Server response:\n{response.text.strip()}")
+        except requests.RequestException as e:
+            problem = f"{type(e).__name__}: {e}"
+            try:
+                offset = _response_offset(session.get(chunk_url, timeout=timeout))
+            except (requests.RequestException, ValueError, KeyError):
+                pass        # keep the old offset; the next PUT finds out
+
+        failures += 1
+        if failures > retries:
+            raise Exception(f"Upload of {filename} stopped at {format_bytes(offset)} of "
+                            f"{format_bytes(size)} after {retries} retries ({problem}).\n"
+                            f"Run the fit again to resume from there.")
+        log(f"Chunk at {format_bytes(chunk_offset)} failed ({problem}), "
+            f"retrying from {format_bytes(offset)} in {delay:g} s\n")
+        time.sleep(delay)
+        delay *= 2
+    if progress_callback and failures:
+        # The last chunk was stored but its answer was lost; the upload is still complete
+        progress_callback(offset, size, (offset - start_offset) / max(time.monotonic() - start, 1e-9))
+    return upload_id
+
+
+def is_hdf5_file(file_path):
+    # Signature bytes only, whatever the suffix (.hdf5 / .h5 / .5hdf); cached per (path, mtime, size)
+    return pyofe_hdf5.is_hdf5_file(file_path)
+
+
+def is_zone_file(file_path):
+    """nmr_processing.is_zone_file(), answered from the cached HDF5 probe for HDF5 files."""
+    if nmr_processing.is_binary_output(file_path) and is_hdf5_file(file_path):
+        attrs = pyofe_hdf5.probe_hdf5(file_path).attrs or {}
+        return attrs.get("format") == nmr_processing.ZONE_FILE_FORMAT
+    return nmr_processing.is_zone_file(file_path)
+
+
+class InputRejected(ValueError):
+    """The input cannot be sent as it is; FitQueue fails the job without retrying."""
+
+
+def subset_for_upload(file_path, subset):
+    """Temporary HDF5 file holding the zones of file_path that subset keeps, or None
+    when there is nothing to cut (no subset, or not an HDF5 input). The caller removes it.
+    Raises InputRejected when the subset matches nothing in file_path."""
+    if not subset or not is_hdf5_file(file_path):
+        return None
+    fd, subset_path = tempfile.mkstemp(prefix="pyofe-subset-", suffix=os.path.splitext(file_path)[1])
+    os.close(fd)
+    try:
+        pyofe_hdf5.subset_hdf5(file_path, subset_path, subset)
+    except BaseException as e:
+        if os.path.exists(subset_path):
+            os.remove(subset_path)
+        if isinstance(e, ValueError):
+            raise InputRejected(str(e)) from e
+        raise
+    return subset_path
+
+
+@contextmanager
+def open_upload(file_path, subset=None, source=None):
+    """(filename, file object) to upload for file_path.
+
+    Binary zone files written by nmr_processing (.hdf5 / .npz) are sent as
+    the zone text the converters write, rendered from their arrays, since
+    the server reads that format; everything else is sent as it is. With a
+    pyofe_hdf5.HDF5Subset, an HDF5 input is first cut down to the selected
+    zones in a temporary file and that is sent instead, under the original
+    name. source is such a copy prepared already (see subset_for_upload).
+    """
+    subset_path = subset_for_upload(file_path, subset) if source is None else None
+    read_path = source or subset_path or file_path
+    try:
+        if is_zone_file(read_path):
+            name = os.path.splitext(os.path.basename(file_path))[0] + ".txt"
+            with io.BytesIO(nmr_processing.zone_file_text(read_path).encode("utf-8")) as file:
+                yield name, file
+        else:
+            with open(read_path, "rb") as file:
+                yield os.path.basename(file_path), file
+    finally:
+        if subset_path:
+            os.remove(subset_path)
+
+
+def build_fit_params(file_path, function, logx, logy, autox, autoy, symb_size):
+    """Validate a fit input and build the form parameters sent to /fit.
+
+    Returns (params, note) where note is an informational message for file types
+    that carry their own function. Raises ValueError for invalid input.
+    """
+    if not file_path:
+        raise ValueError("Please select a file.")
+
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise ValueError("Please select a valid file (.hdf5, .h5, .5hdf, .json, .sav, .zip, .dat, .sdf, .txt, .npz).")
+
+    # Zone files from nmr_processing are uploaded as zone text (see open_upload)
+    stelar_hdf5 = is_hdf5_file(file_path) and not is_zone_file(file_path)
+    params = {
+        "stelar-hdf5": "yes" if stelar_hdf5 else "no",
+        "logx": logx,
+        "logy": logy,
+        "autox": autox,
+        "autoy": autoy,
+        "symbsize": symb_size,
+        "download": "zip"
+    }
+    note = ""
+
+    # Function handling by file type
+    if file_extension == ".json":
+        note = "JSON file detected: function will be read by the server from the JSON file itself.\n"
+    elif file_extension == ".sav":
+        note = "SAV file detected: no separate function parameter sent.\n"
+    else:
+        if not function:
+            raise ValueError("Function definition is required for this file type.")
+        params["function"] = " ".join(
+            line.strip() for line in function.splitlines() if line.strip()
+        )
+
+    return params, note
+
+
+def clean_fit_results(fit_results):
+    # Replace '| ' with a tab to clean up the data for Excel pasting
+    clean_results = fit_results.replace(" | ", "\t")  # Replacing with tab
+    return clean_results
+
+
+def find_result_json(download_folder):
+    # Search for the first JSON file in the subfolders
+    for root, dirs, files in os.walk(download_folder):
+        for file in files:
+            if file.endswith(".json"):
+                return os.path.join(root, file)
+    return None
+
+
+def find_result_jsons(download_folder):
+    """Every JSON file under download_folder, in sorted (stable) order."""
+    found = []
+    for root, dirs, files in os.walk(download_folder):
+        dirs.sort()
+        found.extend(os.path.join(root, file) for file in sorted(files) if file.endswith(".json"))
+    return found
+
+
+def parse_fit_results(fit_results):
+    """(header, rows) of a 'fit-results' table ("Zone | Field | T11 | M0" lines), cells stripped."""
+    lines = [line for line in fit_results.strip().splitlines() if line.strip()]
+    if not lines:
+        return [], []
+    table = [[cell.strip() for cell in line.split("|")] for line in lines]
+    return table[0], table[1:]
+
+
+class FitResults:
+    """The 'fit-results' tables of every result JSON in a download, merged column-wise.
+
+    header lists the column names in the order they were first seen and
+    columns[name] holds one text cell per row ("" where a JSON's table has no
+    such column). sources[i] is the JSON row i came from, relative to the
+    download folder; JSON files without a table are listed in skipped as
+    (source, reason).
+    """
+
+    def __init__(self):
+        self.header = []
+        self.columns = {}
+        self.sources = []
+        self.skipped = []
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, source, header, rows):
+        for name in header:
+            if name not in self.columns:
+                self.header.append(name)
+                self.columns[name] = [""] * len(self.sources)
+        for name in self.header:
+            if name in header:
+                position = header.index(name)
+                self.columns[name].extend(row[position] if position < len(row) else "" for row in rows)
+            else:
+                self.columns[name].extend([""] * len(rows))
+        self.sources.extend([source] * len(rows))
+
+    def values(self, name):
+        """Column name as a float array, NaN where a cell is not a number."""
+        out = np.full(len(self), np.nan)
+        for i, text in enumerate(self.columns[name]):
+            try:
+                out[i] = float(text)
+            except ValueError:
+                pass
+        return out
+
+    def text(self, source_column=None):
+        """Tab-separated table for fit_results.dat.
+
+        The Source column is appended (so $1..$N keep their meaning) when the
+        rows come from more than one JSON, or when source_column is True.
+        """
+        if source_column is None:
+            source_column = len(set(self.sources)) > 1
+        header = self.header + [SOURCE_COLUMN] if source_column else self.header
+        columns = [self.columns[name] for name in self.header]
+        if source_column:
+            columns.append(self.sources)
+        lines = ["\t".join(header)]
+        lines.extend("\t".join(row) for row in zip(*columns))
+        return "\n".join(lines)
+
+
+def _read_result_json(json_file):
+    # (header, rows, None), or (None, None, reason) for a JSON without a table
+    try:
+        with open(json_file, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return None, None, f"unreadable: {e}"
+    if not isinstance(data, dict):
+        return None, None, "not a JSON object"
+    fit_results = data.get("fit-results")
+    if not fit_results:
+        return None, None, f"'fit-results' key not found. Available keys: {list(data.keys())}"
+    header, rows = parse_fit_results(fit_results)
+    return header, rows, None
+
+
+def load_fit_results(download_folder, workers=RESULT_PARSE_WORKERS):
+    """FitResults of every result JSON under download_folder.
+
+    The JSON files are read and parsed on up to `workers` threads; the tables
+    are merged in the order of find_result_jsons() whatever order they finish in.
+    """
+    json_files = find_result_jsons(download_folder)
+    if workers > 1 and len(json_files) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(json_files))) as pool:
+            parsed = list(pool.map(_read_result_json, json_files))
+    else:
+        parsed = [_read_result_json(json_file) for json_file in json_files]
+
+    results = FitResults()
+    for json_file, (header, rows, reason) in zip(json_files, parsed):
+        source = os.path.relpath(json_file, download_folder).replace(os.sep, "/")
+        if reason:
+            results.skipped.append((source, reason))
+        else:
+            results.add(source, header, rows)
+    return results
+
+
+def read_fit_results(download_folder):
+    """Return the merged, tab-separated 'fit-results' table of a download, or None if there is none."""
+    results = load_fit_results(download_folder)
+    return results.text() if results.header else None
+
+
+@contextmanager
+def closing_commit(db):
+    # sqlite3's own context manager commits but never closes the connection
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+def file_digest(file_path):
+    """SHA-256 of a file's bytes, memoised per (path, mtime, size) for repeated batches."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _digest_lock:
+        if memo_key in _digest_memo:
+            return _digest_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    with _digest_lock:
+        _digest_memo[memo_key] = digest.hexdigest()
+    return _digest_memo[memo_key]
+
+
+class ResultCache:
+    """On-disk store of fit result ZIPs addressed by input content and parameters.
+
+    The key is a hash of the input file bytes, the server URL and the params dict
+    with sorted keys, so renaming or moving an input still hits. Each entry is the
+    ZIP returned by the server; a hit is extracted locally instead of re-uploading.
+    Entries are evicted least recently used first once the cache grows past
+    max_bytes (an entry's mtime is refreshed on every hit); a result larger
+    than max_bytes is not stored. The attributes hits, misses, stores and
+    evictions count this instance's lookups; their totals across runs since
+    the cache was last cleared are kept in CACHE_STATS_FILE (see totals),
+    which is rewritten every CACHE_STATS_BATCH counts and on flush / exit.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._unsaved = dict.fromkeys(CACHE_COUNTERS, 0)
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        atexit.register(self.flush)
+
+    def key(self, file_path, params, url=""):
+        canonical = json.dumps(
+            {"url": url, "params": {str(k): str(v) for k, v in params.items()}},
+            sort_keys=True, separators=(",", ":")
+        )
+        digest = hashlib.sha256(file_digest(file_path).encode("ascii"))
+        digest.update(canonical.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".zip")
+
+    def get(self, key):
+        """Return the cached ZIP opened for reading, or None on a miss. The caller closes it."""
+        path = self._entry_path(key)
+        with self._lock:
+            # Refreshed under the lock so evict() cannot remove the entry in between;
+            # an entry removed by another process is a miss
+            try:
+                archive = open(path, "rb")
+            except FileNotFoundError:
+                self._count("misses")
+                return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                archive.close()
+                self._count("misses")
+                return None
+            self._count("hits")
+        return archive
+
+    def put(self, key, source, meta=None):
+        """Store the ZIP read from the file object source under key.
+        Returns False, storing nothing, when the ZIP alone is larger than max_bytes."""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write next to the final name and rename, so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(source, out, DOWNLOAD_CHUNK_SIZE)
+            if os.path.getsize(tmp_path) > self.max_bytes:
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if meta is not None:
+            with open(path[:-len(".zip")] + ".json", "w") as f:
+                json.dump(meta, f, indent=4)
+
+        with self._lock:
+            self._count("stores")
+        self.evict(keep=key)
+        return True
+
+    def _entries(self):
+        entries = []
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".zip"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes.
+        The entry under keep (usually the one just stored) is never removed."""
+        keep_path = self._entry_path(keep) if keep else None
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep_path:
+                    continue
+                for stale in (path, path[:-len(".zip")] + ".json"):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                total -= size
+                self._count("evictions")
+
+    @property
+    def _stats_path(self):
+        return os.path.join(self.folder, CACHE_STATS_FILE)
+
+    def totals(self):
+        """{counter: count} over every run since the cache was created or last cleared."""
+        saved = self._saved_totals()
+        return {name: saved[name] + self._unsaved[name] for name in CACHE_COUNTERS}
+
+    def _saved_totals(self):
+        try:
+            with open(self._stats_path, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        return {name: int(saved.get(name, 0)) for name in CACHE_COUNTERS}
+
+    def _count(self, name):
+        # Called with self._lock held; the totals file is only rewritten once per batch
+        setattr(self, name, getattr(self, name) + 1)
+        self._unsaved[name] += 1
+        if sum(self._unsaved.values()) >= CACHE_STATS_BATCH:
+            self._flush()
+
+    def _flush(self):
+        # Called with self._lock held. The totals file is rewritten whole and renamed
+        # into place; two processes flushing at the same instant may lose one batch.
+        if not any(self._unsaved.values()):
+            return
+        totals = self._saved_totals()
+        for name, count in self._unsaved.items():
+            totals[name] += count
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(totals, f)
+            os.replace(tmp_path, self._stats_path)
+        except OSError:
+            return      # statistics never fail a fit; the counts are kept for the next flush
+        self._unsaved = dict.fromkeys(CACHE_COUNTERS, 0)
+
+    def flush(self):
+        """Add the counts not yet saved to CACHE_STATS_FILE (also done at exit)."""
+        with self._lock:
+            self._flush()
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        totals = self.totals()
+        total_lookups = totals["hits"] + totals["misses"]
+        return {
+            "folder": self.folder,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "totals": {**totals, "hit_rate": totals["hits"] / total_lookups if total_lookups else 0.0},
+        }
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            os.makedirs(self.folder, exist_ok=True)
+            self._unsaved = dict.fromkeys(CACHE_COUNTERS, 0)
+
+
+class FitIndex:
+    """SQLite index of every fit run, kept next to the result cache.
+
+    runs has one row per completed fit: input path and SHA-256, function,
+    server URL, the form params, result folder, the result JSONs (a JSON
+    list), whether it came from the cache, and start / finish times. results
+    holds the merged 'fit-results' table of each run, one row per cell: the
+    JSON it came from, row number, column name, the value as REAL (NULL when
+    it is not a number) and the original text. Parameters can be queried across runs
+    with parameter() without touching the download folders again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            file_hash TEXT NOT NULL,
+            function TEXT,
+            url TEXT,
+            params TEXT,
+            folder TEXT,
+            sources TEXT,
+            from_cache INTEGER NOT NULL DEFAULT 0,
+            started TEXT,
+            finished TEXT
+        );
+        CREATE TABLE IF NOT EXISTS results (
+            run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+            source TEXT,
+            row INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value REAL,
+            text TEXT
+        );
+        CREATE INDEX IF NOT EXISTS runs_file_hash ON runs(file_hash);
+        CREATE INDEX IF NOT EXISTS results_run ON results(run_id, row);
+        CREATE INDEX IF NOT EXISTS results_name ON results(name, run_id);
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")     # readers do not block the batch writers
+            db.executescript(self.SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=INDEX_TIMEOUT)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys=ON")
+        return closing_commit(db)
+
+    def record(self, file_path, params, url, download_folder, started=None, from_cache=False):
+        """Index the fit whose results were extracted to download_folder. Returns the run id."""
+        results = load_fit_results(download_folder)
+
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)) if started else now
+        cells = []
+        for name in results.header:
+            values = results.values(name)
+            for row, (source, text) in enumerate(zip(results.sources, results.columns[name]), 1):
+                if text:
+                    value = None if np.isnan(values[row - 1]) else float(values[row - 1])
+                    cells.append((source, row, name, value, text))
+
+        with self._connect() as db:
+            run_id = db.execute(
+                "INSERT INTO runs (file, file_hash, function, url, params, folder, sources,"
+                " from_cache, started, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(file_path), file_digest(file_path), params.get("function"), url,
+                 json.dumps(params, sort_keys=True), os.path.abspath(download_folder),
+                 json.dumps(sorted(set(results.sources))),
+                 int(from_cache), started, now)
+            ).lastrowid
+            db.executemany("INSERT INTO results (run_id, source, row, name, value, text)"
+                           " VALUES (?, ?, ?, ?, ?, ?)",
+                           [(run_id, *cell) for cell in cells])
+        return run_id
+
+    def runs(self, file=None, function=None, limit=None):
+        """Indexed runs, newest first, as dicts; file matches a path or a SHA-256."""
+        where, args = self._filters(file, function)
+        sql = f"SELECT * FROM runs{where} ORDER BY id DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._connect() as db:
+            return [dict(row) for row in db.execute(sql, args)]
+
+    def table(self, run_id):
+        """FitResults of one run, rebuilt from its indexed cells."""
+        with self._connect() as db:
+            cells = db.execute("SELECT source, row, name, text FROM results WHERE run_id = ?"
+                               " ORDER BY row, rowid", (run_id,)).fetchall()
+        tables = {}
+        for cell in cells:
+            header, rows = tables.setdefault(cell["source"], ([], {}))
+            if cell["name"] not in header:
+                header.append(cell["name"])
+            rows.setdefault(cell["row"], {})[cell["name"]] = cell["text"]
+        results = FitResults()
+        for source, (header, rows) in tables.items():
+            results.add(source, header, [[row.get(name, "") for name in header] for row in rows.values()])
+        return results
+
+    def parameter(self, name, file=None, function=None):
+        """[(run_id, finished, file, source, row, value), ...] of one fit-results column across runs,
+        oldest first."""
+        where, args = self._filters(file, function)
+        where = (where + " AND" if where else " WHERE") + " results.name = ?"
+        sql = ("SELECT runs.id, runs.finished, runs.file, results.source, results.row, results.value"
+               f" FROM results JOIN runs ON runs.id = results.run_id{where}"
+               " ORDER BY runs.id, results.row")
+        with self._connect() as db:
+            return [tuple(row) for row in db.execute(sql, args + [name])]
+
+    @staticmethod
+    def _filters(file, function):
+        clauses, args = [], []
+        if file:
+            clauses.append("(runs.file = ? OR runs.file_hash = ?)")
+            args += [os.path.abspath(file), file]
+        if function:
+            clauses.append("runs.function = ?")
+            args.append(function)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+
+def parse_function_catalogue(text):
+    """{name: definition} from the /list text, in the server's order.
+
+    The server prints each name on its own line and the definition on the
+    indented line(s) below it; "name: definition" lines and a JSON object
+    shaped like functions.json are read as well.
+    """
+    if text.lstrip().startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            data = data.get("functions", data)
+            if isinstance(data, dict):
+                return {str(name): str(definition) for name, definition in data.items()}
+
+    functions = {}
+    name = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[:1].isspace():
+            if name is not None:
+                functions[name] = " ".join(filter(None, (functions[name], line.strip())))
+            continue
+        head, sep, definition = line.partition(":")
+        if sep and "(" not in head:
+            name = head.strip()
+            functions[name] = definition.strip()
+        else:
+            name = line.strip()
+            functions[name] = ""
+    return functions
+
+
+class FunctionCatalogue:
+    """The /list function catalogue of one server, cached on disk.
+
+    A cached copy younger than ttl is used without a request. An older one is
+    revalidated with If-None-Match / If-Modified-Since, so an unchanged
+    catalogue costs a 304 and no body. When the server cannot be reached the
+    cached copy is returned with "stale" set, so names still resolve offline.
+    Entries are dicts: url, fetched (epoch seconds), etag, last_modified,
+    accept_encoding (the response header, see FitClient.accepted_encodings),
+    text (as served) and functions ({name: definition}).
+    """
+
+    def __init__(self, list_url, session=None, folder=CATALOGUE_FOLDER, ttl=CATALOGUE_TTL,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.list_url = list_url
+        self.session = session if session is not None else get_session()
+        self.folder = folder
+        self.ttl = ttl
+        self.timeout = timeout
+
+    @property
+    def path(self):
+        name = hashlib.sha256(self.list_url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.folder, name + ".json")
+
+    def cached(self):
+        """The cached entry, or None. Never touches the network."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and "functions" in entry else None
+
+    def _store(self, entry):
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def load(self, refresh=False, offline=False):
+        """The catalogue entry, from the cache while it is fresh.
+
+        refresh revalidates even a fresh copy; offline never asks the server.
+        Raises Exception when there is no cached copy to fall back on.
+        """
+        entry = self.cached()
+        if entry is not None and (offline or (not refresh and time.time() - entry["fetched"] < self.ttl)):
+            return entry
+        if offline:
+            raise Exception(f"No cached function catalogue for {self.list_url}")
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = self.session.get(self.list_url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if entry is None:
+                raise Exception(f"Failed to fetch functions: {e}")
+            return {**entry, "stale": True, "error": str(e)}
+
+        if response.status_code == 304 and entry is not None:
+            entry["fetched"] = time.time()
+            entry["accept_encoding"] = response.headers.get("Accept-Encoding", entry.get("accept_encoding", ""))
+        elif response.status_code == 200:
+            entry = {
+                "url": self.list_url,
+                "fetched": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "accept_encoding": response.headers.get("Accept-Encoding", ""),
+                "text": response.text,
+                "functions": parse_function_catalogue(response.text),
+            }
+        elif entry is not None:
+            return {**entry, "stale": True, "error": f"status code {response.status_code}"}
+        else:
+            raise Exception(f"Failed to fetch functions. Status code: {response.status_code}")
+        try:
+            self._store(entry)
+        except OSError:
+            pass        # an unwritable cache folder only costs the next start a request
+        return entry
+
+
+def endpoint_url(url, name):
+    """url with its last path segment replaced by name: http://host/api/fit -> http://host/api/list."""
+    parts = urllib.parse.urlsplit(url)
+    path = posixpath.join(posixpath.dirname(parts.path), name)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+
+
+_encodings_memo = {}
+_encodings_lock = threading.Lock()
+
+
+class FitClient:
+    """Talks to one OneFit server: uploads inputs to /fit and reads /list.
+
+    Nothing here writes to a widget; request details go to the optional log
+    callback and download progress to progress_callback (see download_stream).
+    All requests go through session, the shared pooled session by default, so
+    consecutive and concurrent calls reuse open connections. With a ResultCache,
+    repeated fits of the same input and params are served from disk.
+    """
+
+    def __init__(self, url=UNIVERSITY_URL, spool=False, session=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), cache=None, index=None,
+                 upload_mode="auto", chunk_size=UPLOAD_CHUNK_SIZE, compression="auto", subset=None):
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError(f"upload_mode must be one of {', '.join(UPLOAD_MODES)}")
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"compression must be one of {', '.join(COMPRESSION_MODES)}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression requires zstandard: pip install zstandard")
+        self.url = url
+        self.spool = spool
+        self.session = session if session is not None else get_session()
+        self.timeout = timeout
+        self.cache = cache
+        self.index = index
+        self.upload_mode = upload_mode
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.subset = subset
+
+    @property
+    def list_url(self):
+        return endpoint_url(self.url, "list")
+
+    @property
+    def upload_url(self):
+        return endpoint_url(self.url, "upload")
+
+    def accepted_encodings(self):
+        """Content codings the server decodes in requests, from the Accept-Encoding
+        header of its /list response; taken from the cached function catalogue
+        (see catalogue), so it costs no request of its own, and looked up once
+        per server."""
+        with _encodings_lock:
+            if self.list_url in _encodings_memo:
+                return _encodings_memo[self.list_url]
+        try:
+            entry = self.catalogue()
+            if "accept_encoding" not in entry:
+                entry = self.catalogue(refresh=True)    # cached before the header was recorded
+        except Exception:
+            return frozenset()      # not remembered: the next upload asks again
+        header = entry.get("accept_encoding") or ""
+        accepted = frozenset(token.split(";")[0].strip().lower() for token in header.split(",") if token.strip())
+        if not entry.get("stale"):  # a copy kept while the server was unreachable is asked again
+            with _encodings_lock:
+                _encodings_memo[self.list_url] = accepted
+        return accepted
+
+    def upload_encoding(self, filename):
+        """Content coding to compress the upload of filename with, or None.
+
+        Only text inputs (COMPRESSIBLE_EXTENSIONS) are compressed. "auto" picks
+        the client's preferred coding among those the server accepts; "gzip"
+        or "zstd" is used without asking the server.
+        """
+        if self.compression == "none" or os.path.splitext(filename)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return None
+        if self.compression != "auto":
+            return self.compression
+        accepted = self.accepted_encodings()
+        return next((encoding for encoding in client_encodings() if encoding in accepted), None)
+
+    def key_params(self, params):
+        """params as they identify a fit for the cache and the index: with the HDF5 subset, if any."""
+        return {**params, "subset": self.subset.describe()} if self.subset else params
+
+    def upload(self, file_path, filename, file, progress_callback=None, log=None):
+        """Id of a resumable upload of file for /fit, or None to send it in the request.
+
+        "auto" uploads files of CHUNKED_UPLOAD_MIN_SIZE or more in chunks when the
+        server supports it; "chunked" always does and fails if the server cannot.
+        """
+        if self.upload_mode == "single":
+            return None
+        size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        if self.upload_mode == "auto" and size < CHUNKED_UPLOAD_MIN_SIZE:
+            return None
+        # The file itself (not rendered zone text) has a memoised digest already
+        digest = file_digest(file_path) if getattr(file, "name", None) == file_path else None
+        upload_id = upload_resumable(self.session, self.upload_url, filename, file, digest,
+                                     self.chunk_size, self.timeout, progress_callback, log,
+                                     encoding=self.upload_encoding(filename))
+        if upload_id is None and self.upload_mode == "chunked":
+            raise Exception(f"The server at {self.upload_url} does not accept chunked uploads.")
+        file.seek(0)
+        return upload_id
+
+    def query(self, file_path, params, download_folder, progress_callback=None, log=None,
+              use_cache=True, upload_progress=None):
+        """Upload file_path with params and extract the returned ZIP into download_folder.
+
+        Large inputs go through upload() first (see upload_mode) and /fit then only
+        names the finished upload; upload_progress reports its progress. With a
+        subset, only the selected zones of an HDF5 input are sent (see open_upload).
+
+        The response is streamed in DOWNLOAD_CHUNK_SIZE pieces so memory stays bounded.
+        With spool=True the ZIP is kept in a SpooledTemporaryFile (in memory up to
+        SPOOL_MAX_SIZE, then on disk) and extracted from there instead of being written
+        to downloaded.zip first. use_cache=False skips the cache lookup but still
+        stores the fresh result. Returns True when the result came from the cache.
+        Raises an Exception describing the failure if the server does not return a ZIP.
+        """
+        if log is None:
+            log = lambda message: None
+        started = time.time()
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(file_path, self.key_params(params), self.url)
+            cached = self.cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                log(f"Cache hit: {file_path}\nKey: {cache_key}\n")
+                with cached:
+                    os.makedirs(download_folder, exist_ok=True)
+                    with zipfile.ZipFile(cached, "r") as zip_file:
+                        zip_file.extractall(download_folder)
+                self.record(file_path, params, download_folder, started, True, log)
+                return True
+
+        response = None
+        try:
+            with open_upload(file_path, self.subset) as (filename, file):
+                upload_id = self.upload(file_path, filename, file, upload_progress, log)
+                encoding = self.upload_encoding(filename) if upload_id is None else None
+                if upload_id is not None:
+                    # Already on the server; a filename-less part keeps the body multipart
+                    files = {"upload": (None, upload_id)}
+                else:
+                    files = {"file": (filename, file)}
+
+                log("Sending request...\n\n")
+                log(f"URL: {self.url}\n")
+                log(f"File: {file_path}\n")
+                if upload_id is not None:
+                    log(f"Upload: {upload_id}\n")
+                if encoding:
+                    log(f"Content-Encoding: {encoding}\n")
+                log("Parameters:\n")
+                for k, v in params.items():
+                    log(f"  {k}: {v}\n")
+
+                if encoding:
+                    # Compressed while it is sent, never held in memory as a whole
+                    content_type, parts = multipart_parts(params, "file", filename, file)
+                    response = self.session.post(
+                        self.url, data=CompressedBody(parts, encoding), stream=True, timeout=self.timeout,
+                        headers={"Content-Type": content_type, "Content-Encoding": encoding})
+                else:
+                    response = self.session.post(self.url, files=files, data=params,
+                                                 stream=True, timeout=self.timeout)
+
+            # Show raw response for debugging
+            log(f"\nHTTP Status: {response.status_code}\n")
+            log(f"Content-Type: {response.headers.get('Content-Type', '')}\n")
+
+            if response.status_code != 200:
+                error_body = response.text.strip() if response.text else "No server response body."
+                raise Exception(
+                    f"File upload failed.\n"
+                    f"Status: {response.status_code}\n"
+                    f"Server response:\n{error_body}"
+                )
+
+            content_type = response.headers.get("Content-Type", "")
+            if "application/zip" not in content_type and "application/octet-stream" not in content_type:
+                raise Exception(
+                    f"The query to {self.url} did not return a ZIP file.\n"
+                    f"Returned Content-Type: {content_type}\n"
+                    f"Body:\n{response.text[:2000]}"
+                )
+
+            os.makedirs(download_folder, exist_ok=True)
+            meta = {
+                "file": os.path.abspath(file_path),
+                "url": self.url,
+                "params": params,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+
+            if self.spool:
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spooled:
+                    download_stream(response, spooled, progress_callback=progress_callback)
+                    spooled.seek(0)
+                    with zipfile.ZipFile(spooled, "r") as zip_file:
+                        zip_file.extractall(download_folder)
+                    if cache_key:
+                        spooled.seek(0)
+                        self.cache.put(cache_key, spooled, meta)
+            else:
+                zip_file_path = os.path.join(download_folder, "downloaded.zip")
+
+                with open(zip_file_path, "wb") as f:
+                    download_stream(response, f, progress_callback=progress_callback)
+
+                with zipfile.ZipFile(zip_file_path, "r") as zip_file:
+                    zip_file.extractall(download_folder)
+
+                if cache_key:
+                    with open(zip_file_path, "rb") as f:
+                        self.cache.put(cache_key, f, meta)
+
+                os.remove(zip_file_path)
+            self.record(file_path, params, download_folder, started, False, log)
+            return False
+        finally:
+            if response is not None:
+                response.close()
+
+    def record(self, file_path, params, download_folder, started=None, from_cache=False, log=None):
+        """Add a finished fit to the FitIndex, if there is one. Indexing problems are
+        logged, never raised: the fit itself has succeeded."""
+        if self.index is None:
+            return None
+        try:
+            return self.index.record(file_path, self.key_params(params), self.url, download_folder,
+                                     started, from_cache)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            if log:
+                log(f"Could not index the fit: {e}\n")
+            return None
+
+    def fit(self, file_path, function="", logx="yes", logy="yes", autox="yes", autoy="yes",
+            symb_size="1.0", download_folder=DOWNLOAD_FOLDER, progress_callback=None, log=None,
+            use_cache=True, upload_progress=None):
+        """Validate, upload and extract one fit. Returns the result folder."""
+        params, note = build_fit_params(file_path, function, logx, logy, autox, autoy, symb_size)
+        if note and log:
+            log(note)
+        self.query(file_path, params, download_folder, progress_callback=progress_callback, log=log,
+                   use_cache=use_cache, upload_progress=upload_progress)
+        return download_folder
+
+    def catalogue(self, refresh=False, offline=False):
+        """The server's function catalogue entry, cached (see FunctionCatalogue.load)."""
+        return FunctionCatalogue(self.list_url, self.session, timeout=self.timeout).load(refresh, offline)
+
+    def list_functions(self, refresh=False, offline=False):
+        """Return the function catalogue served by /list as {name: definition}."""
+        return self.catalogue(refresh, offline)["functions"]
+
+
+# Batch job states
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_RETRYING = "retrying"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def result_folder_for(base_folder, file_path, taken):
+    # One folder per input; same-named inputs from different directories get a suffix
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    folder = os.path.join(base_folder, stem)
+    index = 2
+    while folder in taken:
+        folder = os.path.join(base_folder, f"{stem}_{index}")
+        index += 1
+    return folder
+
+
+class FitJob:
+    """One file in a batch: its parameters, result folder and current state."""
+
+    def __init__(self, file_path, params, download_folder):
+        self.file_path = file_path
+        self.params = params
+        self.download_folder = download_folder
+        self.status = JOB_PENDING
+        self.attempts = 0
+        self.error = None
+        self.elapsed = 0.0
+        self.future = None
+        self.cancel_event = threading.Event()
+
+    def __repr__(self):
+        return f"FitJob({os.path.basename(self.file_path)!r}, {self.status})"
+
+
+class FitQueue:
+    """Bounded pool of concurrent /fit uploads.
+
+    Each job runs FitClient.query() into its own folder under base_folder. Failed
+    jobs are retried up to max_retries times with exponential backoff, and any
+    job can be cancelled while pending, between attempts (the backoff wait is
+    interrupted), during a chunked upload (at the next chunk) or mid-download;
+    an input sent in a single request is only stopped once its response starts.
+    on_update(job) is called from the worker threads every time a job changes state.
+    """
+
+    def __init__(self, client, base_folder=DOWNLOAD_FOLDER, max_workers=BATCH_WORKERS,
+                 max_retries=BATCH_RETRIES, retry_delay=BATCH_RETRY_DELAY, on_update=None,
+                 use_cache=True):
+        self.client = client
+        self.use_cache = use_cache
+        self.base_folder = base_folder
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_update = on_update
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fit")
+
+    def submit(self, file_path, params):
+        with self._lock:
+            taken = {job.download_folder for job in self.jobs}
+            job = FitJob(file_path, params, result_folder_for(self.base_folder, file_path, taken))
+            self.jobs.append(job)
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def _set_status(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        if self.on_update:
+            self.on_update(job)
+
+    def _run(self, job):
+        def check_cancelled(done, total, rate):
+            # Progress callback of both the chunked upload and the download
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+
+        start = time.monotonic()
+        delay = self.retry_delay
+        while True:
+            if job.cancel_event.is_set():
+                self._set_status(job, JOB_CANCELLED)
+                break
+
+            job.attempts += 1
+            self._set_status(job, JOB_RUNNING)
+            try:
+                # Start every attempt from an empty folder so partial extractions never mix
+                shutil.rmtree(job.download_folder, ignore_errors=True)
+                self.client.query(job.file_path, job.params, job.download_folder,
+                                  progress_callback=check_cancelled, use_cache=self.use_cache,
+                                  upload_progress=check_cancelled)
+                self._set_status(job, JOB_DONE)
+                break
+            except JobCancelled:
+                self._set_status(job, JOB_CANCELLED)
+                break
+            except InputRejected as e:
+                # The same input would be rejected again
+                self._set_status(job, JOB_FAILED, str(e))
+                break
+            except Exception as e:
+                if job.attempts > self.max_retries:
+                    self._set_status(job, JOB_FAILED, str(e))
+                    break
+                self._set_status(job, JOB_RETRYING, str(e))
+                if job.cancel_event.wait(delay):
+                    self._set_status(job, JOB_CANCELLED)
+                    break
+                delay *= 2
+
+        job.elapsed = time.monotonic() - start
+        return job
+
+    def cancel(self, job):
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._set_status(job, JOB_CANCELLED)
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            if job.status not in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+                self.cancel(job)
+
+    def retry(self, job):
+        """Resubmit a failed or cancelled job."""
+        if job.status not in (JOB_FAILED, JOB_CANCELLED):
+            return job
+        job.attempts = 0
+        job.cancel_event.clear()
+        self._set_status(job, JOB_PENDING)
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def wait(self):
+        for job in list(self.jobs):
+            try:
+                job.future.result()
+            except CancelledError:
+                pass
+        return self.jobs
+
+    def counts(self):
+        counts = defaultdict(int)
+        for job in self.jobs:
+            counts[job.status] += 1
+        return dict(counts)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def collect_fit_files(directory):
+    files = []
+    for root_dir, dirs, filenames in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS:
+                files.append(os.path.join(root_dir, filename))
+    return files
+
+
+#---------------------------#----------------------------------#---------------------------#-----------------------------#
+#  COMMAND LINE
+#---------------------------#----------------------------------#---------------------------#-----------------------------#
+
+def print_progress(received, total, rate, verb="Downloaded"):
+    line = f"\r{verb}: {format_bytes(received)}"
+    if total:
+        line += f" / {format_bytes(total)} ({100.0 * received / total:.0f}%)"
+    sys.stderr.write(line + f" at {format_bytes(rate)}/s   ")
+    sys.stderr.flush()
+
+
+def print_upload_progress(sent, total, rate):
+    print_progress(sent, total, rate, "Uploaded")
+
+
+def format_function_catalogue(functions):
+    # Same layout as the server's /list text: name, then the definition indented
+    return "".join(f"{name}\n  {definition}\n" if definition else f"{name}\n"
+                   for name, definition in functions.items())
+
+
+def resolve_function(function, url=None):
+    # Accept either a function definition or a name stored in functions.json, or
+    # in the cached /list catalogue of url (read from disk only, never fetched);
+    # local definitions win over the server's
+    if not function:
+        return ""
+    functions = {}
+    entry = FunctionCatalogue(FitClient(url).list_url).cached() if url else None
+    if entry is not None:
+        functions.update((name, definition) for name, definition in entry["functions"].items() if definition)
+    functions.update({"Monoexponential": MONOEXP, "Biexponential": BIEXP})
+    if os.path.exists(FUNCTIONS_JSON_PATH):
+        functions.update(load_functions_and_urls_from_json()[0])
+    return functions.get(function, function)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="pyofe", description="OneFit server client")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fit = sub.add_parser("fit", help="upload files to /fit and extract the results")
+    fit.add_argument("inputs", nargs="+", help="input files or directories")
+    fit.add_argument("--function", default="",
+                     help="function definition, or the name of one stored in functions.json")
+    fit.add_argument("--url", default=UNIVERSITY_URL, help="OneFit /fit endpoint")
+    for flag in ("logx", "logy", "autox", "autoy"):
+        fit.add_argument(f"--{flag}", choices=["yes", "no"], default="yes")
+    fit.add_argument("--symbsize", default="1.0")
+    fit.add_argument("--output", default=DOWNLOAD_FOLDER, help="result folder")
+    fit.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                     help="concurrent uploads when fitting several files")
+    fit.add_argument("--retries", type=int, default=BATCH_RETRIES,
+                     help="attempts per job after the HTTP-level retries are exhausted")
+    fit.add_argument("--timeout", type=float, default=READ_TIMEOUT,
+                     help="seconds to wait for the server to answer a fit")
+    fit.add_argument("--async", dest="use_async", action="store_true",
+                     help="submit from one asyncio event loop (needs aiohttp); --workers is the concurrency limit")
+    fit.add_argument("--spool", action="store_true",
+                     help="extract from a spooled temporary file instead of downloaded.zip")
+    fit.add_argument("--no-cache", action="store_true",
+                     help="ignore cached results and re-run the fit on the server")
+    fit.add_argument("--cache-dir", default=CACHE_FOLDER)
+    fit.add_argument("--cache-size", type=float, default=CACHE_MAX_BYTES / 1024 ** 2,
+                     help="cache size limit in MB")
+    fit.add_argument("--index", default=INDEX_PATH, help="SQLite index the runs are recorded in")
+    fit.add_argument("--no-index", action="store_true", help="do not record the runs in the index")
+    fit.add_argument("--upload", choices=UPLOAD_MODES, default="auto",
+                     help="send inputs in resumable, checksummed chunks: 'auto' does so for files of "
+                          f"{CHUNKED_UPLOAD_MIN_SIZE // 1024 ** 2} MB or more when the server supports it")
+    fit.add_argument("--chunk-size", type=float, default=UPLOAD_CHUNK_SIZE / 1024 ** 2,
+                     help="chunk size in MB for chunked uploads")
+    fit.add_argument("--compress", choices=COMPRESSION_MODES, default="auto",
+                     help="compress text inputs while uploading: 'auto' uses the best coding the server "
+                          "offers (zstd needs the zstandard package)")
+    pyofe_hdf5.add_subset_arguments(fit)     # HDF5 inputs: upload only the selected zones
+    fit.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+
+    cache = sub.add_parser("cache", help="show statistics of or clear the result cache")
+    cache.add_argument("action", choices=["stats", "clear"])
+    cache.add_argument("--cache-dir", default=CACHE_FOLDER)
+
+    history = sub.add_parser("history", help="query the index of past fit runs")
+    history.add_argument("--index", default=INDEX_PATH)
+    history.add_argument("--file", help="only runs of this input file (path or SHA-256)")
+    history.add_argument("--function", help="only runs with this function definition")
+    history.add_argument("--param", metavar="NAME",
+                         help="print one fit-results column across runs (run, finished, file, source, row, value)")
+    history.add_argument("--show", type=int, metavar="RUN", help="print the fit-results table of one run")
+    history.add_argument("--limit", type=int, default=50, help="newest runs listed (0 = all)")
+
+    lst = sub.add_parser("list", help="show the functions available on the server")
+    lst.add_argument("--url", default=UNIVERSITY_URL, help="OneFit /fit endpoint")
+    lst.add_argument("--refresh", action="store_true", help="ask the server even if the cached list is fresh")
+    lst.add_argument("--offline", action="store_true", help="only show the cached list")
+    lst.add_argument("--names", action="store_true", help="print the function names only")
+    return parser
+
+
+def cmd_fit(args):
+    try:
+        subset = pyofe_hdf5.subset_from_args(args) or None
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    # One pooled connection per concurrent upload
+    session = configure_session(pool_size=max(POOL_SIZE, args.workers))
+    cache = ResultCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 2))
+    index = None if args.no_index else FitIndex(args.index)
+    client = FitClient(args.url, spool=args.spool, session=session,
+                       timeout=(CONNECT_TIMEOUT, args.timeout), cache=cache, index=index,
+                       upload_mode=args.upload, chunk_size=max(1, int(args.chunk_size * 1024 ** 2)),
+                       compression=args.compress, subset=subset)
+    function = resolve_function(args.function, args.url)
+    flags = (args.logx, args.logy, args.autox, args.autoy)
+
+    files = []
+    for item in args.inputs:
+        files.extend(collect_fit_files(item) if os.path.isdir(item) else [item])
+
+    if args.use_async:
+        import pyofe_async
+        return pyofe_async.cmd_fit(args, files, function, cache, index, subset)
+
+    if len(files) == 1:
+        progress = None if args.quiet else print_progress
+        try:
+            client.fit(files[0], function, *flags, symb_size=args.symbsize,
+                       download_folder=args.output, progress_callback=progress,
+                       use_cache=not args.no_cache,
+                       upload_progress=None if args.quiet else print_upload_progress)
+        except Exception as e:
+            print(f"\nError: {e}", file=sys.stderr)
+            return 1
+        if not args.quiet:
+            sys.stderr.write(f"\nCache: {cache.hits} hits, {cache.misses} misses\n")
+        fit_results = read_fit_results(args.output)
+        if fit_results:
+            print(fit_results)
+        return 0
+
+    def report(job):
+        if not args.quiet and job.status in (JOB_DONE, JOB_FAILED, JOB_RETRYING, JOB_CANCELLED):
+            detail = f": {job.error.splitlines()[0]}" if job.error else ""
+            print(f"[{job.status:>9}] {job.file_path}{detail}", file=sys.stderr)
+
+    queue = FitQueue(client, base_folder=args.output, max_workers=max(1, args.workers),
+                     max_retries=args.retries, on_update=report, use_cache=not args.no_cache)
+    failed = 0
+    for file_path in files:
+        try:
+            params, _ = build_fit_params(file_path, function, *flags, args.symbsize)
+        except ValueError as e:
+            print(f"[  skipped] {file_path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        queue.submit(file_path, params)
+
+    try:
+        queue.wait()
+    except KeyboardInterrupt:
+        queue.cancel_all()
+        queue.wait()
+    finally:
+        queue.shutdown()
+
+    for job in queue.jobs:
+        print(f"{job.status}\t{job.elapsed:.1f}s\t{job.file_path}\t{job.download_folder}")
+    if not args.quiet:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+    failed += sum(1 for job in queue.jobs if job.status != JOB_DONE)
+    return 1 if failed else 0
+
+
+def cmd_cache(args):
+    cache = ResultCache(args.cache_dir)
+    if args.action == "clear":
+        cache.clear()
+        print(f"Cleared {args.cache_dir}")
+        return 0
+    stats = cache.stats()
+    totals = stats["totals"]
+    print(f"Folder:    {stats['folder']}")
+    print(f"Entries:   {stats['entries']}")
+    print(f"Size:      {format_bytes(stats['bytes'])} of {format_bytes(stats['max_bytes'])}")
+    # Totals over every run since the cache was created or last cleared
+    print(f"Hits:      {totals['hits']} ({100.0 * totals['hit_rate']:.1f}% of lookups)")
+    print(f"Misses:    {totals['misses']}")
+    print(f"Stores:    {totals['stores']}")
+    print(f"Evictions: {totals['evictions']}")
+    return 0
+
+
+def cmd_history(args):
+    if not os.path.exists(args.index):
+        print(f"Error: no index at {args.index}", file=sys.stderr)
+        return 1
+    index = FitIndex(args.index)
+    if args.show is not None:
+        print(index.table(args.show).text())
+        return 0
+    if args.param:
+        # Tab-separated, ready for gnuplot / numpy.loadtxt
+        for run_id, finished, file, source, row, value in index.parameter(args.param, args.file, args.function):
+            print(f"{run_id}\t{finished}\t{file}\t{source}\t{row}\t{'nan' if value is None else repr(value)}")
+        return 0
+    for run in index.runs(args.file, args.function, args.limit):
+        cached = " (cache)" if run["from_cache"] else ""
+        print(f"{run['id']}\t{run['finished']}\t{run['file']}\t{run['folder']}{cached}")
+    return 0
+
+
+def cmd_list(args):
+    try:
+        entry = FitClient(args.url).catalogue(args.refresh, args.offline)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if entry.get("stale"):
+        fetched = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["fetched"]))
+        print(f"Server unreachable ({entry['error']}), cached list from {fetched}", file=sys.stderr)
+    if args.names:
+        print("\n".join(entry["functions"]))
+    else:
+        print(format_function_catalogue(entry["functions"]), end="")
+    return 0
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "fit":
+        return cmd_fit(args)
+    if args.command == "cache":
+        return cmd_cache(args)
+    if args.command == "history":
+        return cmd_history(args)
+    return cmd_list(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
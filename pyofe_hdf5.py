@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+PyOFE HDF5 inputs
+=================
+HDF5 handling for the fit client, without Tk: recognising HDF5 inputs and
+summarising them (cached, so a batch does not reopen the same file for every
+question), and selecting the zones of a large STELAR (or nmr_processing zone)
+file before it is uploaded, so only the part that is going to be fitted
+crosses the network.
+
+A zone is any group that holds datasets directly. Zones are picked by their
+1-based position or an fnmatch pattern on their path, and/or by ranges of
+numeric attributes (read from the zone group and its parents, the closest
+one winning). The selected zones are copied into a new HDF5 file chunk by
+chunk, so memory stays at one chunk or block whatever the input size:
+
+    from pyofe_hdf5 import HDF5Subset, subset_hdf5
+    subset = HDF5Subset(zones="1-4,zone01*", ranges={"temperature": (20, 40)})
+    subset_hdf5("campaign.hdf5", "subset.hdf5", subset)
+
+    python pyofe_hdf5.py subset campaign.hdf5 -o subset.hdf5 --field 0.01:1 --datasets tau,magnetization
+    python pyofe_hdf5.py probe data/*.h5
+"""
+# Standard libraries
+import argparse
+import fnmatch
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+# Third-party libraries
+import numpy as np
+try:
+    import h5py
+except ImportError:  # optional: only needed for HDF5 inputs
+    h5py = None
+
+
+COPY_BLOCK_BYTES = 16 * 1024 * 1024     # contiguous datasets are copied in slices of about this size
+INDEX_PATTERN = re.compile(r"^(\d+)(?:-(\d+))?$")
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"  # superblock signature, at 0 or 512 * 2**n when there is a user block
+HDF5_SUFFIXES = (".hdf5", ".h5", ".5hdf")
+PROBE_CACHE_SIZE = 4096                 # probes kept in memory, least recently used dropped first
+
+# Attributes --field / --temperature look for, first match wins (in the units stored in the file)
+FIELD_ATTRIBUTES = ("field", "BR", "freq_khz", "frequency")
+TEMPERATURE_ATTRIBUTES = ("temperature", "TEMP", "temp")
+
+
+def _require_h5py():
+    if h5py is None:
+        raise RuntimeError("HDF5 subsetting requires h5py: pip install h5py")
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  ZONE SELECTION
+# ═══════════════════════════════════════════════════════════════════
+
+def parse_value_range(range_str):
+    """'lo:hi' -> (lo, hi) floats; either side may be empty for an open end."""
+    lo, sep, hi = range_str.partition(":")
+    if not sep:
+        raise ValueError(f"Invalid range: '{range_str}' (expected lo:hi)")
+    lo = float(lo) if lo.strip() else -np.inf
+    hi = float(hi) if hi.strip() else np.inf
+    if hi < lo:
+        raise ValueError(f"Invalid range: '{range_str}'")
+    return lo, hi
+
+
+class HDF5Subset:
+    """Which zones and datasets of an HDF5 file to keep.
+
+    zones: comma-separated 1-based positions ("3", "1-5") and fnmatch patterns
+    on zone paths ("zone00*"); a zone is kept if any item matches, and all
+    zones are candidates when it is empty. ranges: {attribute: (lo, hi)},
+    every one of which must hold; an attribute name may also be a tuple of
+    alternatives, the first one present being used. datasets: names of the
+    datasets to copy from each zone (all when empty).
+    """
+
+    def __init__(self, zones="", ranges=None, datasets=()):
+        self.zones = zones
+        self.ranges = dict(ranges or {})
+        self.datasets = tuple(datasets)
+        self._indices, self._patterns = [], []
+        for item in filter(None, (part.strip() for part in zones.split(","))):
+            match = INDEX_PATTERN.match(item)
+            if match:
+                start = int(match.group(1))
+                end = int(match.group(2) or start)
+                if start < 1 or end < start:
+                    raise ValueError(f"Invalid zone range: '{item}'")
+                self._indices.append((start, end))
+            else:
+                self._patterns.append(item)
+
+    def __bool__(self):
+        return bool(self.zones or self.ranges or self.datasets)
+
+    def describe(self):
+        """Stable text form, e.g. for cache keys."""
+        ranges = ";".join(f"{'|'.join(name) if isinstance(name, tuple) else name}={lo}:{hi}"
+                          for name, (lo, hi) in sorted(self.ranges.items(), key=lambda item: str(item[0])))
+        return f"zones={self.zones};{ranges};datasets={','.join(self.datasets)}"
+
+    def _matches_zone(self, position, path):
+        if not (self._indices or self._patterns):
+            return True
+        if any(start <= position <= end for start, end in self._indices):
+            return True
+        return any(fnmatch.fnmatchcase(path, pattern) for pattern in self._patterns)
+
+    def _matches_attrs(self, attrs):
+        for name, (lo, hi) in self.ranges.items():
+            names = name if isinstance(name, tuple) else (name,)
+            present = next((n for n in names if n in attrs), None)
+            if present is None:
+                return False
+            try:
+                value = float(np.asarray(attrs[present]).reshape(-1)[0])
+            except (TypeError, ValueError, IndexError):
+                return False
+            if not lo <= value <= hi:
+                return False
+        return True
+
+    def select(self, zones):
+        """The entries of list_zones() output that this subset keeps."""
+        return [zone for position, zone in enumerate(zones, 1)
+                if self._matches_zone(position, zone[0]) and self._matches_attrs(zone[1])]
+
+
+def list_zones(h5file):
+    """[(path, attrs), ...] of every group in an open h5py.File that holds
+    datasets directly, in sorted path order. attrs merges the attributes of
+    the root, the parent groups and the zone itself, the closest winning."""
+    paths = []
+
+    def visit(name, item):
+        if isinstance(item, h5py.Group) and any(isinstance(child, h5py.Dataset) for child in item.values()):
+            paths.append(name)
+
+    if any(isinstance(child, h5py.Dataset) for child in h5file.values()):
+        paths.append("")        # datasets at the root form a zone of their own
+    h5file.visititems(visit)
+
+    zones = []
+    for path in sorted(paths):
+        attrs = dict(h5file.attrs)
+        parts = path.split("/") if path else []
+        for depth in range(1, len(parts) + 1):
+            attrs.update(h5file["/".join(parts[:depth])].attrs)
+        zones.append((path, attrs))
+    return zones
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  PROBE
+# ═══════════════════════════════════════════════════════════════════
+
+_probe_memo = OrderedDict()     # (abspath, mtime_ns, size) -> HDF5Probe
+_probe_lock = threading.Lock()
+
+
+def signature_offset(file_path):
+    """Offset of the HDF5 signature in file_path, or None if it is not an HDF5 file.
+
+    Only reads the few bytes where the format allows the superblock to start,
+    so it is cheap enough to run on every input whatever its size or suffix.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        offset = 0
+        while offset + len(HDF5_SIGNATURE) <= size:
+            f.seek(offset)
+            if f.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE:
+                return offset
+            offset = offset * 2 if offset else 512
+    return None
+
+
+class HDF5Probe:
+    """What probe_hdf5() found out about one file.
+
+    is_hdf5 comes from the signature alone. Once summarised, attrs holds the
+    root attributes and zones [(path, attrs, {dataset: (shape, dtype)}), ...]
+    in list_zones() order, or error says why h5py could not read the file.
+    """
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+        self.attrs = None
+        self.zones = None
+        self.error = None
+
+    @property
+    def is_hdf5(self):
+        return self.offset is not None
+
+    @property
+    def summarised(self):
+        return self.zones is not None or self.error is not None
+
+    def summarise(self):
+        if h5py is None:
+            self.error = "h5py is not installed"
+            return
+        try:
+            with h5py.File(self.path, "r") as f:
+                zones = []
+                for path, attrs in list_zones(f):
+                    datasets = {name: (item.shape, str(item.dtype)) for name, item in f[path or "/"].items()
+                                if isinstance(item, h5py.Dataset)}
+                    zones.append((path, attrs, datasets))
+                self.attrs = dict(f.attrs)
+                self.zones = zones
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+
+    def describe(self):
+        """Multi-line text summary: one line for the file, one per zone."""
+        name = os.path.basename(self.path)
+        if not self.is_hdf5:
+            return f"{name}: not an HDF5 file"
+        if self.error:
+            return f"{name}: HDF5, unreadable ({self.error})"
+        if self.zones is None:
+            return f"{name}: HDF5"
+        lines = [f"{name}: HDF5, {len(self.zones)} zones" + _format_attrs(self.attrs)]
+        for position, (path, attrs, datasets) in enumerate(self.zones, 1):
+            shapes = ", ".join(f"{dataset}{list(shape) if shape is not None else '[]'} {dtype}"
+                               for dataset, (shape, dtype) in datasets.items())
+            own = {key: value for key, value in attrs.items() if key not in self.attrs}
+            lines.append(f"  {position}\t/{path}\t{shapes}" + _format_attrs(own))
+        return "\n".join(lines)
+
+
+def _format_attrs(attrs):
+    if not attrs:
+        return ""
+    return "\t" + ", ".join(f"{key}={np.asarray(value).tolist()!r}" for key, value in attrs.items())
+
+
+def probe_hdf5(file_path, summary=True):
+    """HDF5Probe of file_path, cached per (path, mtime, size).
+
+    The signature check never opens the file with h5py; with summary, the
+    file is opened once to list its zones, dataset shapes and attributes,
+    and later calls for the unchanged file reuse that. Raises OSError if
+    the file cannot be read.
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _probe_lock:
+        probe = _probe_memo.get(key)
+        if probe is not None:
+            _probe_memo.move_to_end(key)
+    if probe is None:
+        probe = HDF5Probe(file_path, signature_offset(file_path))
+    if summary and probe.is_hdf5 and not probe.summarised:
+        probe.summarise()
+    with _probe_lock:
+        _probe_memo[key] = probe
+        _probe_memo.move_to_end(key)
+        while len(_probe_memo) > PROBE_CACHE_SIZE:
+            _probe_memo.popitem(last=False)
+    return probe
+
+
+def is_hdf5_file(file_path):
+    """True if file_path carries the HDF5 signature, whatever its suffix (cached)."""
+    try:
+        return probe_hdf5(file_path, summary=False).is_hdf5
+    except OSError:
+        return False
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  CHUNKED COPY
+# ═══════════════════════════════════════════════════════════════════
+
+def _copy_dataset(source, group, name):
+    # Same shape, dtype, chunking, filters and attributes, copied a chunk / block at a time
+    options = {}
+    if source.chunks:
+        options.update(chunks=source.chunks, maxshape=source.maxshape, compression=source.compression,
+                       compression_opts=source.compression_opts, shuffle=source.shuffle,
+                       fletcher32=source.fletcher32, scaleoffset=source.scaleoffset)
+    target = group.create_dataset(name, shape=source.shape, dtype=source.dtype, **options)
+    target.attrs.update(source.attrs)
+
+    if source.shape is None or source.size == 0:
+        return 0
+    if not source.shape:
+        target[()] = source[()]
+        return source.nbytes
+    if source.chunks:
+        for selection in source.iter_chunks():
+            target[selection] = source[selection]
+    else:
+        row_bytes = max(1, source.nbytes // source.shape[0])
+        step = max(1, COPY_BLOCK_BYTES // row_bytes)
+        for start in range(0, source.shape[0], step):
+            target[start:start + step] = source[start:start + step]
+    return source.nbytes
+
+
+def subset_hdf5(source_path, target_path, subset):
+    """Write the zones and datasets of source_path that subset keeps to target_path.
+
+    Root and parent-group attributes are carried over so the result still
+    reads like the original. Returns (zones kept, zones in the file, bytes of
+    dataset data copied). Raises ValueError if no zone or dataset is left.
+    """
+    _require_h5py()
+    with h5py.File(source_path, "r") as source:
+        zones = list_zones(source)
+        kept = subset.select(zones)
+        if not kept:
+            raise ValueError(f"No zone of {os.path.basename(source_path)} matches the subset "
+                             f"({len(zones)} zones in the file)")
+
+        copied = 0
+        with h5py.File(target_path, "w") as target:
+            target.attrs.update(source.attrs)
+            for path, _ in kept:
+                group = target
+                for part in filter(None, path.split("/")):
+                    is_new = part not in group
+                    group = group.require_group(part)
+                    if is_new:
+                        group.attrs.update(source[group.name].attrs)
+                for name, item in source[path or "/"].items():
+                    if isinstance(item, h5py.Dataset) and (not subset.datasets or name in subset.datasets):
+                        copied += _copy_dataset(item, group, name)
+        if subset.datasets and not copied:
+            os.remove(target_path)
+            raise ValueError(f"None of the datasets {', '.join(subset.datasets)} found in the selected zones")
+    return len(kept), len(zones), copied
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  COMMAND LINE
+# ═══════════════════════════════════════════════════════════════════
+
+def add_subset_arguments(parser):
+    """--zones / --field / --temperature / --where / --datasets, shared with pyofe_client.py fit."""
+    parser.add_argument("--zones", default="",
+                        help="zones to keep: 1-based positions and ranges or fnmatch patterns on zone paths, "
+                             "comma-separated (e.g. 1-4,zone01*)")
+    parser.add_argument("--field", metavar="LO:HI", help=f"keep zones whose {'/'.join(FIELD_ATTRIBUTES)} "
+                                                         "attribute lies in this range")
+    parser.add_argument("--temperature", metavar="LO:HI",
+                        help=f"keep zones whose {'/'.join(TEMPERATURE_ATTRIBUTES)} attribute lies in this range")
+    parser.add_argument("--where", metavar="ATTR=LO:HI", action="append", default=[],
+                        help="keep zones whose attribute ATTR lies in this range (repeatable)")
+    parser.add_argument("--datasets", default="", help="comma-separated datasets to copy from each zone")
+
+
+def subset_from_args(args):
+    """HDF5Subset from add_subset_arguments() options. Raises ValueError for bad ranges."""
+    ranges = {}
+    if args.field:
+        ranges[FIELD_ATTRIBUTES] = parse_value_range(args.field)
+    if args.temperature:
+        ranges[TEMPERATURE_ATTRIBUTES] = parse_value_range(args.temperature)
+    for item in args.where:
+        name, sep, value_range = item.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid --where: '{item}' (expected ATTR=LO:HI)")
+        ranges[name.strip()] = parse_value_range(value_range)
+    datasets = [name.strip() for name in args.datasets.split(",") if name.strip()]
+    return HDF5Subset(args.zones, ranges, datasets)
+
+
+def cmd_zones(args):
+    _require_h5py()
+    with h5py.File(args.input, "r") as f:
+        for position, (path, attrs) in enumerate(list_zones(f), 1):
+            shown = ", ".join(f"{key}={np.asarray(value).tolist()!r}" for key, value in attrs.items())
+            print(f"{position}\t/{path}\t{shown}")
+    return 0
+
+
+def cmd_probe(args):
+    status = 0
+    for path in args.inputs:
+        try:
+            print(probe_hdf5(path, summary=not args.quick).describe())
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            status = 1
+    return status
+
+
+def cmd_subset(args):
+    try:
+        subset = subset_from_args(args)
+        kept, total, copied = subset_hdf5(args.input, args.output, subset)
+    except (ValueError, OSError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{kept} of {total} zones, {copied / 1024 ** 2:.1f} MB of data -> {args.output}")
+    return 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="pyofe_hdf5", description="Probe, list and subset the zones of HDF5 inputs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    zones = sub.add_parser("zones", help="list the zones of an HDF5 file with their attributes")
+    zones.add_argument("input")
+    zones.set_defaults(run=cmd_zones)
+
+    probe = sub.add_parser("probe", help="check and summarise files: zones, dataset shapes and attributes")
+    probe.add_argument("inputs", nargs="+")
+    probe.add_argument("--quick", action="store_true", help="only check the HDF5 signature")
+    probe.set_defaults(run=cmd_probe)
+
+    subset = sub.add_parser("subset", help="copy selected zones to a new HDF5 file")
+    subset.add_argument("input")
+    subset.add_argument("-o", "--output", required=True)
+    add_subset_arguments(subset)
+    subset.set_defaults(run=cmd_subset)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+PyOFE fit result tables
+=======================
+fit_results.dat handling for the PyOFE-API custom plot panel, without Tk.
+The table is loaded once into a NumPy array; every $N formula is compiled
+once and evaluated over whole columns, and rows are grouped on the first
+formula and averaged with np.unique / np.bincount.
+
+Formulas are parsed with the ast module and only arithmetic (+ - * / // %
+**, comparisons), numbers, $N columns and the functions / constants in
+FORMULA_FUNCTIONS / FORMULA_CONSTANTS are accepted; nothing is passed to
+eval(). Compiled formulas are cached, so recomputing while the user edits
+only compiles what changed.
+
+    from pyofe_results import create_custom_data
+    create_custom_data(["$2", "1/$3"], "fit_results.dat", "custom_plot_data.dat")
+"""
+# Standard libraries
+import ast
+import functools
+import os
+import re
+# Third-party libraries
+import numpy as np
+
+
+FIT_RESULTS_FILE = "fit_results.dat"
+CUSTOM_DATA_FILE = "custom_plot_data.dat"
+COLUMN_PATTERN = re.compile(r'\$(\d+)')
+FORMULA_CACHE_SIZE = 512                # compiled formulas kept between calls
+
+# Names a formula may use besides its $N columns
+FORMULA_FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'log10': np.log10,
+    'exp': np.exp,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+}
+FORMULA_CONSTANTS = {
+    'pi': np.pi,
+    'e': np.e,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: np.positive,
+    ast.USub: np.negative,
+}
+COMPARE_OPERATORS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+ALLOWED_SYNTAX = ("$N columns, numbers, + - * / // % **, comparisons, "
+                  + ", ".join(FORMULA_FUNCTIONS) + ", " + ", ".join(FORMULA_CONSTANTS))
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FIT RESULTS TABLE
+# ═══════════════════════════════════════════════════════════════════
+
+class ResultsTable:
+    """Comma-separated rows of fit_results.dat as a float array.
+
+    values[i, j] is column $j+1 of row i: 0.0 where the text is not a number,
+    NaN past the end of a short row. widths[i] is the number of columns row i
+    really has and lines[i] its line number in the file.
+    """
+
+    def __init__(self, values, widths, lines):
+        self.values = values
+        self.widths = widths
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.values)
+
+    def column(self, number):
+        if number > self.values.shape[1]:       # only for a table without rows
+            return np.full(len(self), np.nan)
+        return self.values[:, number - 1]
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0      # non-numeric cells count as 0
+
+
+def parse_results_table(text):
+    """ResultsTable from the text of fit_results.dat; blank and '#' lines are skipped."""
+    rows, lines = [], []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            rows.append(line)
+            lines.append(number)
+    lines = np.array(lines, dtype=int)
+    if not rows:
+        return ResultsTable(np.zeros((0, 0)), np.zeros(0, dtype=int), lines)
+
+    try:
+        # Fast path: a rectangular, all-numeric table
+        values = np.loadtxt(rows, delimiter=",", comments=None, ndmin=2)
+        return ResultsTable(values, np.full(len(values), values.shape[1]), lines)
+    except ValueError:
+        pass
+
+    cells = [[_to_float(col.strip()) for col in line.split(",")] for line in rows]
+    widths = np.array([len(row) for row in cells])
+    values = np.full((len(cells), widths.max()), np.nan)
+    for i, row in enumerate(cells):
+        values[i, :len(row)] = row
+    return ResultsTable(values, widths, lines)
+
+
+_table_cache = {}
+
+
+def load_results_table(path=FIT_RESULTS_FILE):
+    """ResultsTable of path, re-read only when its size or modification time changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    table = _table_cache.get(key)
+    if table is None:
+        with open(path, "r") as f:
+            table = parse_results_table(f.read())
+        _table_cache.clear()
+        _table_cache[key] = table
+    return table
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FORMULAS
+# ═══════════════════════════════════════════════════════════════════
+
+class FormulaError(ValueError):
+    """A formula that does not compile or evaluate; .formula is its text."""
+
+    def __init__(self, formula, message):
+        super().__init__(message)
+        self.formula = formula
+
+
+class _Compiler:
+    # Turns the AST of one formula into nested functions of {column: array}
+
+    def __init__(self, formula, source):
+        self.formula = formula
+        self.source = source
+        self.columns = set()
+
+    def fail(self, node, message):
+        raise FormulaError(self.formula,
+                           f"Error in '{self.formula}' at character {node.col_offset + 1}: {message}")
+
+    def compile(self, node):
+        method = getattr(self, "visit_" + type(node).__name__, None)
+        if method is None:
+            what = ast.get_source_segment(self.formula, node) or type(node).__name__
+            self.fail(node, f"'{what}' is not allowed (use {ALLOWED_SYNTAX})")
+        return method(node)
+
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, float):
+            self.fail(node, f"{node.value!r} is not a number")
+        value = float(node.value)
+        return lambda columns: value
+
+    def visit_Name(self, node):
+        name = node.id
+        if name in FORMULA_CONSTANTS:
+            value = FORMULA_CONSTANTS[name]
+            return lambda columns: value
+        match = re.fullmatch(r"v(\d+)", name)
+        if match:
+            number = int(match.group(1))
+            if number < 1:
+                self.fail(node, "columns are numbered from $1")
+            self.columns.add(number)
+            return lambda columns: columns[number]
+        if name in FORMULA_FUNCTIONS:
+            self.fail(node, f"{name} is a function, use {name}(...)")
+        self.fail(node, f"unknown name '{name}' (use {ALLOWED_SYNTAX})")
+
+    def visit_BinOp(self, node):
+        op = BINARY_OPERATORS.get(type(node.op))
+        if op is None:
+            self.fail(node, f"operator {type(node.op).__name__} is not allowed")
+        left, right = self.compile(node.left), self.compile(node.right)
+        return lambda columns: op(left(columns), right(columns))
+
+    def visit_UnaryOp(self, node):
+        op = UNARY_OPERATORS.get(type(node.op))
+        if op is None:
+            self.fail(node, f"operator {type(node.op).__name__} is not allowed")
+        operand = self.compile(node.operand)
+        return lambda columns: op(operand(columns))
+
+    def visit_Compare(self, node):
+        ops = []
+        for op in node.ops:
+            if type(op) not in COMPARE_OPERATORS:
+                self.fail(node, f"comparison {type(op).__name__} is not allowed")
+            ops.append(COMPARE_OPERATORS[type(op)])
+        operands = [self.compile(node.left)] + [self.compile(c) for c in node.comparators]
+
+        def compare(columns):
+            values = [operand(columns) for operand in operands]
+            result = True
+            for op, left, right in zip(ops, values, values[1:]):
+                result = np.logical_and(result, op(left, right))
+            return result
+        return compare
+
+    def visit_Call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name not in FORMULA_FUNCTIONS:
+            self.fail(node, f"only {', '.join(FORMULA_FUNCTIONS)} can be called")
+        if node.keywords or len(node.args) != 1:
+            self.fail(node, f"{name}() takes exactly one argument")
+        function, argument = FORMULA_FUNCTIONS[name], self.compile(node.args[0])
+        return lambda columns: function(argument(columns))
+
+
+class CompiledFormula:
+    """A formula compiled to NumPy operations over whole columns.
+
+    Calling it with a ResultsTable returns one value per row. A value that
+    cannot be computed from finite inputs (log of 0, division by zero,
+    overflow, ...) raises FormulaError naming the file line and the column
+    values involved.
+    """
+
+    def __init__(self, formula, evaluate, columns):
+        self.formula = formula
+        self.columns = columns
+        self._evaluate = evaluate
+
+    def __repr__(self):
+        return f"CompiledFormula({self.formula!r})"
+
+    def __call__(self, table):
+        for number in self.columns:
+            short = table.widths < number
+            if short.any():
+                row = int(np.argmax(short))
+                raise FormulaError(self.formula, f"Error in '{self.formula}': no column ${number} "
+                                                 f"on line {table.lines[row]} ({table.widths[row]} columns)")
+        columns = {number: table.column(number) for number in self.columns}
+        with np.errstate(all="ignore"):
+            value = self._evaluate(columns)
+        value = np.broadcast_to(np.asarray(value, dtype=float), (len(table),))
+
+        bad = ~np.isfinite(value)
+        for column in columns.values():
+            bad &= np.isfinite(column)      # non-finite inputs may give non-finite results
+        if bad.any():
+            self._raise_for_row(table, columns, int(np.argmax(bad)))
+        return value
+
+    def _raise_for_row(self, table, columns, row):
+        # Re-run the failing row alone to find out what went wrong
+        reason = "result is not a finite number"
+        try:
+            with np.errstate(divide="raise", invalid="raise", over="raise", under="ignore"):
+                self._evaluate({number: column[row:row + 1] for number, column in columns.items()})
+        except FloatingPointError as e:
+            reason = str(e)
+        inputs = ", ".join(f"${number} = {columns[number][row]:g}" for number in self.columns)
+        context = f"line {table.lines[row]}" + (f": {inputs}" if inputs else "")
+        raise FormulaError(self.formula, f"Error in '{self.formula}' on {context}: {reason}")
+
+
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile_formula(formula):
+    """CompiledFormula for one formula ($N refers to column N); cached by text."""
+    # $N -> vN keeps every character at the same offset for error messages
+    source = COLUMN_PATTERN.sub(r'v\1', formula)
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        where = f" at character {e.offset}" if e.offset else ""
+        raise FormulaError(formula, f"Error in '{formula}'{where}: {e.msg}") from None
+    compiler = _Compiler(formula, source)
+    evaluate = compiler.compile(tree.body)
+    return CompiledFormula(formula, evaluate, tuple(sorted(compiler.columns)))
+
+
+def evaluate_formulas(formulas, table):
+    """(rows, formulas) array of every formula evaluated over table."""
+    return np.column_stack([compile_formula(formula)(table) for formula in formulas])
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  CUSTOM PLOT DATA
+# ═══════════════════════════════════════════════════════════════════
+
+def average_by_first_column(values):
+    """Rows grouped on column 0 and averaged, groups in order of first appearance."""
+    if not len(values):
+        return values
+    keys = values[:, 0]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True, equal_nan=False)
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(first))
+    group = rank[inverse.ravel()]
+
+    counts = np.bincount(group, minlength=len(first))
+    sums = np.column_stack([np.bincount(group, weights=values[:, j], minlength=len(first))
+                            for j in range(values.shape[1])])
+    return sums / counts[:, None]
+
+
+def custom_data(formulas, results_path=FIT_RESULTS_FILE):
+    """The custom plot rows: formulas evaluated over results_path, rows that
+    share the first formula's value averaged.
+
+    Raises ValueError for missing input and FormulaError for a formula that
+    fails.
+    """
+    formulas = [formula.strip() for formula in formulas if formula.strip()]
+    if not formulas:
+        raise ValueError("No formulas provided.")
+    if not os.path.exists(results_path):
+        raise ValueError(f"{results_path} not found.")
+    table = load_results_table(results_path)
+    if not len(table):
+        raise ValueError(f"{results_path} is empty.")
+    return average_by_first_column(evaluate_formulas(formulas, table))
+
+
+def create_custom_data(formulas, results_path=FIT_RESULTS_FILE, output_path=CUSTOM_DATA_FILE):
+    """Write custom_data() to output_path, one space-separated row per group.
+    Returns the number of rows written."""
+    averaged = custom_data(formulas, results_path)
+    with open(output_path, 'w') as out:
+        out.write("\n".join(" ".join(map(str, row)) for row in averaged.tolist()))
+    return len(averaged)
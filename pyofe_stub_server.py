@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OneFit server
+====================================
+Answers /fit and /list with the same shapes as the real server so the fit
+clients can be exercised without network access or a running OneFit:
+
+    python pyofe_stub_server.py --port 8142
+    python pyofe_client.py fit data.sdf --function Monoexponential --url http://127.0.0.1:8142/fit
+
+/fit accepts the multipart upload sent by FitClient (field "file" plus form
+params) and returns a ZIP with <stem>/<stem>.json holding a 'fit-results'
+table and a placeholder All.pdf. --delay and --fail-every simulate slow fits
+and transient 503 errors. Standard library only.
+
+/upload implements the resumable upload protocol of
+pyofe_client.upload_resumable(): POST /upload with JSON {filename, size,
+sha256} opens (or reopens) an upload and returns {id, offset}; PUT
+/upload/<id> appends one chunk at Upload-Offset after checking its
+Upload-Checksum (409 on an offset mismatch, 460 on a bad checksum); GET
+/upload/<id> reports the offset; /fit then takes an "upload" field instead of
+a file. Uploads are kept on disk until the server stops, so the same file is
+never sent twice. --drop-every simulates connections lost mid-upload.
+
+Request bodies (fits and upload chunks) may be compressed with
+Content-Encoding gzip, or zstd when the zstandard package is installed; the
+/list response names the accepted codings in its Accept-Encoding header.
+It also carries an ETag and Last-Modified, and a conditional GET for an
+unchanged catalogue is answered 304.
+"""
+# Standard libraries
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from email.parser import BytesParser
+from email.policy import HTTP
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+try:
+    import zstandard
+except ImportError:  # optional: zstd request bodies are only accepted with it
+    zstandard = None
+
+
+FUNCTION_CATALOGUE = """Monoexponential
+  Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5])[-1.2<1.2]=Mi + (M0-Mi)*exp(-t/T11)
+Biexponential
+  Mz(t,Mi[0<1.5],M0[0<1.5],T11[0.0001<5],T12[0.0001<5],c[0.5<1])[-1.2<1.2]=Mi + c*(M0-Mi)*exp(-t/T11) +(1-c)*(M0-Mi)*exp(-t/T12)
+"""
+
+# Validators of the /list response, so clients can revalidate their cached copy with a 304
+CATALOGUE_ETAG = '"' + hashlib.sha256(FUNCTION_CATALOGUE.encode("utf-8")).hexdigest()[:16] + '"'
+CATALOGUE_MODIFIED = time.time()
+
+ACCEPTED_ENCODINGS = ("gzip", "zstd") if zstandard is not None else ("gzip",)
+
+
+def decode_body(body, encoding):
+    """Undo the Content-Encoding of a request body; ValueError for unknown or corrupt data."""
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return body
+    if encoding == "gzip":
+        try:
+            return gzip.decompress(body)
+        except (OSError, EOFError) as e:
+            raise ValueError(f"corrupt gzip body: {e}")
+    if encoding == "zstd" and zstandard is not None:
+        try:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"corrupt zstd body: {e}")
+    raise ValueError(f"unsupported Content-Encoding: {encoding}")
+
+
+def parse_multipart(content_type, body):
+    """Split a multipart/form-data body into (fields, files) dicts."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename is not None:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+def build_result_zip(filename, size, fields):
+    # One fake zone per 64 KB of input so bigger uploads give longer tables
+    stem = os.path.splitext(os.path.basename(filename))[0] or "input"
+    zones = max(1, size // 65536 + 1)
+    rows = ["Zone | Field | T11 | M0"]
+    for zone in range(1, zones + 1):
+        rows.append(f"{zone} | {zone * 1.0e6:.6g} | {0.1 * zone:.6g} | 1.0")
+
+    result = {
+        "function": fields.get("function", ""),
+        "input-bytes": size,
+        "fit-results": "\n".join(rows),
+    }
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"{stem}/{stem}.json", json.dumps(result, indent=4))
+        zip_file.writestr(f"{stem}/All.pdf", b"%PDF-1.4\n% stub\n")
+    return buffer.getvalue()
+
+
+def upload_id_for(filename, size, sha256):
+    # The same file always maps to the same upload, which is what lets clients resume
+    return hashlib.sha256(f"{filename}\0{size}\0{sha256}".encode("utf-8")).hexdigest()[:32]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Upload:
+    """One resumable upload: the bytes received so far live in path."""
+
+    def __init__(self, upload_id, filename, size, sha256, path):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def state(self):
+        return {"id": self.id, "filename": self.filename, "size": self.size, "offset": self.offset}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _read_decoded_body(self):
+        # The request body with its Content-Encoding undone, or None after answering 415
+        body = self._read_body()
+        try:
+            return decode_body(body, self.headers.get("Content-Encoding", ""))
+        except ValueError as e:
+            self._send(415, f"{e}\n".encode("utf-8"), headers={"Accept-Encoding": ", ".join(ACCEPTED_ENCODINGS)})
+            return None
+
+    def _send(self, status, body, content_type="text/plain", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_upload(self, status, upload):
+        self._send(status, json.dumps(upload.state()).encode("utf-8"), "application/json",
+                   {"Upload-Offset": str(upload.offset)})
+
+    def _upload(self):
+        # The Upload addressed by /upload/<id>, or None after answering 404
+        parts = self.path.rstrip("/").split("/")
+        upload = self.server.uploads.get(parts[-1]) if len(parts) > 1 and parts[-2] == "upload" else None
+        if upload is None:
+            self._send(404, b"Unknown upload\n")
+        return upload
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/list"):
+            headers = {"Accept-Encoding": ", ".join(ACCEPTED_ENCODINGS), "ETag": CATALOGUE_ETAG,
+                       "Last-Modified": formatdate(CATALOGUE_MODIFIED, usegmt=True)}
+            if self._catalogue_unchanged():
+                self._send(304, b"", headers=headers)
+            else:
+                self._send(200, FUNCTION_CATALOGUE.encode("utf-8"), headers=headers)
+        elif "/upload/" in self.path:
+            upload = self._upload()
+            if upload is not None:
+                self._send_upload(200, upload)
+        else:
+            self._send(404, b"Not found\n")
+
+    def _catalogue_unchanged(self):
+        # If-None-Match takes precedence over If-Modified-Since
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return CATALOGUE_ETAG in (tag.strip() for tag in if_none_match.split(","))
+        try:
+            since = parsedate_to_datetime(self.headers.get("If-Modified-Since", ""))
+        except (TypeError, ValueError):
+            return False
+        return since.timestamp() >= int(CATALOGUE_MODIFIED)
+
+    def do_PUT(self):
+        body = self._read_decoded_body()
+        if body is None:
+            return
+        upload = self._upload()
+        if upload is None:
+            return
+        server = self.server
+        try:
+            offset = int(self.headers.get("Upload-Offset", ""))
+        except ValueError:
+            self._send(400, b"Missing Upload-Offset header\n")
+            return
+        algorithm, _, checksum = self.headers.get("Upload-Checksum", "").partition(" ")
+
+        with upload.lock:
+            if offset != upload.offset:
+                self._send_upload(409, upload)
+                return
+            if algorithm != "sha256" or hashlib.sha256(body).hexdigest() != checksum:
+                self._send(460, b"Checksum mismatch\n", headers={"Upload-Offset": str(upload.offset)})
+                return
+            if offset + len(body) > upload.size:
+                self._send(400, b"Chunk runs past the declared size\n")
+                return
+            with open(upload.path, "r+b") as f:
+                f.seek(offset)
+                f.write(body)
+            upload.offset += len(body)
+
+        with server.lock:
+            server.chunks += 1
+            chunk_number = server.chunks
+        if server.drop_every and chunk_number % server.drop_every == 0:
+            # Stored, but the answer is lost, as when the VPN drops mid-request
+            self.close_connection = True
+            return
+        self._send_upload(200, upload)
+
+    def _create_upload(self, body):
+        try:
+            request = json.loads(body)
+            filename, size, sha256 = str(request["filename"]), int(request["size"]), str(request["sha256"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, f"Malformed upload request: {e}\n".encode("utf-8"))
+            return
+        server = self.server
+        upload_id = upload_id_for(filename, size, sha256)
+        with server.lock:
+            upload = server.uploads.get(upload_id)
+            created = upload is None
+            if created:
+                path = os.path.join(server.upload_dir, upload_id + ".part")
+                open(path, "wb").close()
+                upload = server.uploads[upload_id] = Upload(upload_id, filename, size, sha256, path)
+        self._send_upload(201 if created else 200, upload)
+
+    def do_POST(self):
+        body = self._read_decoded_body()
+        if body is None:
+            return
+        if self.path.rstrip("/").endswith("/upload"):
+            self._create_upload(body)
+            return
+        if not self.path.rstrip("/").endswith("/fit"):
+            self._send(404, b"Not found\n")
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            request_number = server.requests
+        if server.fail_every and request_number % server.fail_every == 0:
+            self._send(503, b"Stub server: simulated overload\n")
+            return
+
+        try:
+            fields, files = parse_multipart(self.headers.get("Content-Type", ""), body)
+        except Exception as e:
+            self._send(400, f"Malformed multipart body: {e}\n".encode("utf-8"))
+            return
+        if "file" in files:
+            filename, payload = files["file"]
+            size = len(payload)
+        elif "upload" in fields:
+            upload = server.uploads.get(fields["upload"])
+            if upload is None:
+                self._send(400, b"Unknown upload\n")
+                return
+            with upload.lock:
+                if upload.offset != upload.size:
+                    self._send(400, f"Upload incomplete: {upload.offset} of {upload.size} bytes\n".encode("utf-8"))
+                    return
+                if file_sha256(upload.path) != upload.sha256:
+                    self._send(400, b"Uploaded file does not match its SHA-256\n")
+                    return
+            filename, size = upload.filename, upload.size
+        else:
+            self._send(400, b"Missing 'file' field\n")
+            return
+
+        if server.delay:
+            time.sleep(server.delay)
+
+        self._send(200, build_result_zip(filename, size, fields), "application/zip")
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8142, delay=0.0, fail_every=0, quiet=False,
+                drop_every=0, upload_dir=None):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.chunks = 0
+    server.delay = delay
+    server.fail_every = fail_every
+    server.drop_every = drop_every
+    server.quiet = quiet
+    server.uploads = {}
+    server.upload_dir = upload_dir or tempfile.mkdtemp(prefix="pyofe-uploads-")
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the OneFit /fit and /list endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8142)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering a fit")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth fit with HTTP 503")
+    parser.add_argument("--drop-every", type=int, default=0,
+                        help="store every Nth upload chunk but drop the connection instead of answering")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.delay, args.fail_every, args.quiet, args.drop_every)
+    print(f"Stub OneFit server on http://{args.host}:{args.port}/fit")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        shutil.rmtree(server.upload_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
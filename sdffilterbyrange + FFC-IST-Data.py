@@ -10,9 +10,12 @@ UI completely redesigned: dark scientific-instrument theme.
 """
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
-import numpy as np
-import re, os, math, time, threading
+from tkinter import ttk, filedialog, messagebox
+import os, sys, time, queue, threading
+from contextlib import contextmanager
+
+import nmr_processing   # Tk-free SDF parsing, block averaging and formatting
+from line_view import LineView   # virtualised output pane
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -145,44 +148,186 @@ class StatusBar(tk.Frame):
         self._right.config(text=right)
 
 
-class DataText(tk.Frame):
-    """Monospaced scrollable text widget styled for data display."""
+def classify_line(line):
+    """Colour tag for an output line; applied only when the line is on screen."""
+    if line.startswith("# DATA"):
+        return "data_line"
+    if line.startswith("# TAG") or line.startswith("#  TAG"):
+        return "tag_line"
+    if line.startswith("#"):
+        return "comment"
+    if line.strip() == "":
+        return ""
+    return "value"
+
+
+class DataText(LineView):
+    """Monospaced data pane. Only the visible lines are rendered; the text
+    itself is kept in a LineStore (see line_view.py)."""
     def __init__(self, parent, **kw):
-        super().__init__(parent, bg=C["card"], **kw)
-        self._txt = scrolledtext.ScrolledText(
-            self, font=FONT_MONO,
+        super().__init__(
+            parent, classify=classify_line, frame_bg=C["card"],
+            scrollbar_kw=dict(bg=C["card"], troughcolor=C["bg"]),
+            font=FONT_MONO,
             bg=C["card"], fg=C["text"],
             insertbackground=C["accent"],
             selectbackground=C["sel_bg"],
             relief="flat", bd=0,
-            wrap=tk.NONE,
-            padx=10, pady=8
+            padx=10, pady=8,
+            **kw
         )
-        self._txt.pack(fill="both", expand=True)
-        # horizontal scroll
-        xscr = tk.Scrollbar(self, orient="horizontal",
-                            command=self._txt.xview,
-                            bg=C["card"], troughcolor=C["bg"])
-        xscr.pack(fill="x")
-        self._txt.configure(xscrollcommand=xscr.set)
 
         # colour tags
-        self._txt.tag_config("tag_line",  foreground=C["tag_fg"],
-                              font=("Consolas", 10, "bold"))
-        self._txt.tag_config("data_line", foreground=C["accent2"],
-                              font=("Consolas", 10, "bold"))
-        self._txt.tag_config("comment",   foreground=C["muted"])
-        self._txt.tag_config("value",     foreground=C["data_fg"])
-        self._txt.tag_config("warning",   foreground=C["warning"])
-        self._txt.tag_config("error",     foreground=C["error"])
-        self._txt.tag_config("row_hi",    background=C["card2"])
-
-    def widget(self):   return self._txt
-    def clear(self):    self._txt.delete("1.0", tk.END)
-    def insert(self, text, tag=""):
-        self._txt.insert(tk.END, text, tag)
-    def set_state(self, state):
-        self._txt.configure(state=state)
+        self.tag_config("tag_line",  foreground=C["tag_fg"],
+                        font=("Consolas", 10, "bold"))
+        self.tag_config("data_line", foreground=C["accent2"],
+                        font=("Consolas", 10, "bold"))
+        self.tag_config("comment",   foreground=C["muted"])
+        self.tag_config("value",     foreground=C["data_fg"])
+        self.tag_config("warning",   foreground=C["warning"])
+        self.tag_config("error",     foreground=C["error"])
+        self.tag_config("row_hi",    background=C["card2"])
+
+
+def progress_bar(parent):
+    """Determinate progress bar in the dark theme."""
+    style = ttk.Style()
+    style.theme_use("default")
+    style.configure("dark.Horizontal.TProgressbar",
+                    troughcolor=C["card"], background=C["accent"],
+                    bordercolor=C["border"], lightcolor=C["accent"],
+                    darkcolor=C["accent2"])
+    return ttk.Progressbar(parent, mode="determinate", maximum=100,
+                           length=200, style="dark.Horizontal.TProgressbar")
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  BACKGROUND TASKS  —  worker thread → queue → after() polling
+# ═══════════════════════════════════════════════════════════════════
+POLL_MS        = 50      # how often the UI drains the task queue
+POLL_BUDGET_S  = 0.03    # max time spent handling messages per poll
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task by check() once Cancel has been pressed."""
+
+
+class BackgroundTask:
+    """Runs fn(task, *args) on a worker thread without freezing the window.
+
+    The worker never touches Tk. It reports through task.progress(),
+    task.post() (run a callable on the Tk thread) and task.timed(stage);
+    the UI drains that queue every POLL_MS with after(). on_done(result),
+    on_error(exc) and on_cancel() are called on the Tk thread.
+    """
+
+    def __init__(self, widget, fn, *args, on_progress=None, on_done=None,
+                 on_error=None, on_cancel=None):
+        self._widget = widget
+        self._fn = fn
+        self._args = args
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_cancel = on_cancel
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self.timings = {}            # stage → seconds, in the order first seen
+        self.running = False
+        self.started = None
+
+    # ── Tk thread ──
+    def start(self):
+        self.running = True
+        self.started = time.perf_counter()
+        threading.Thread(target=self._run, daemon=True).start()
+        self._widget.after(POLL_MS, self._poll)
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def timing_text(self):
+        """'read 0.12s · parse 0.40s · total 0.55s' for the status bar."""
+        parts = [f"{name} {secs:.2f}s" for name, secs in self.timings.items()]
+        parts.append(f"total {self.elapsed():.2f}s")
+        return "  ·  ".join(parts)
+
+    def _poll(self):
+        deadline = time.perf_counter() + POLL_BUDGET_S
+        last_progress = None
+        while time.perf_counter() < deadline:
+            try:
+                msg = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if kind == "progress":
+                last_progress = msg[1:]       # only the latest one is shown
+            elif kind == "call":
+                with self.timed("render"):
+                    msg[1](*msg[2])
+            else:
+                self.running = False
+                handler = {"done": self._on_done, "error": self._on_error,
+                           "cancelled": self._on_cancel}[kind]
+                if handler:
+                    handler(*msg[1:])
+                return
+        if last_progress and self._on_progress:
+            self._on_progress(*last_progress)
+        self._widget.after(POLL_MS, self._poll)
+
+    # ── worker thread ──
+    def _run(self):
+        try:
+            result = self._fn(self, *self._args)
+        except TaskCancelled:
+            self._queue.put(("cancelled",))
+        except Exception as e:
+            self._queue.put(("error", e))
+        else:
+            self._queue.put(("done", result))
+
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def progress(self, fraction, message=""):
+        """fraction in 0..1 (None if unknown) plus a status message."""
+        self._queue.put(("progress", fraction, message))
+
+    def post(self, fn, *args):
+        self._queue.put(("call", fn, args))
+
+    @contextmanager
+    def timed(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - t0
+
+    def timed_iter(self, iterable, stage):
+        """Iterate, charging the time spent producing each item to stage."""
+        it = iter(iterable)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -193,8 +338,11 @@ class SDFProcessorTab(tk.Frame):
     def __init__(self, parent):
         super().__init__(parent, bg=C["panel"])
         self.processed_content = ""
+        self.result = None         # nmr_processing.SDFResult of the last run
+        self.output_result = None  # what is shown / saved: result, or result normalised
         self.row_range = None
         self._file_path = ""
+        self._task = None          # BackgroundTask while a file is processing
         self._build()
 
     # ── BUILD UI ────────────────────────────────────────────────────
@@ -252,6 +400,18 @@ class SDFProcessorTab(tk.Frame):
                             font=FONT_LABEL)
         db.pack(side="left", padx=8)
 
+        tk.Label(opt_card, text="Normalize:",
+                 bg=C["card"], fg=C["muted"],
+                 font=FONT_LABEL).pack(side="left", padx=(12, 4), pady=8)
+        self._norm_var = tk.StringVar(value=nmr_processing.NORMALIZE_SCHEMES["minmax"])
+        norm_menu = tk.OptionMenu(opt_card, self._norm_var,
+                                  *nmr_processing.NORMALIZE_SCHEMES.values())
+        norm_menu.config(bg=C["entry_bg"], fg=C["data_fg"],
+                         activebackground=C["card2"], activeforeground=C["text"],
+                         relief="flat", highlightthickness=0, font=FONT_LABEL)
+        norm_menu["menu"].config(bg=C["entry_bg"], fg=C["data_fg"], font=FONT_LABEL)
+        norm_menu.pack(side="left", padx=(0, 8))
+
         # action buttons
         section_label(top, "ACTIONS")
         act_card = card_frame(top)
@@ -266,6 +426,12 @@ class SDFProcessorTab(tk.Frame):
                       self.save_file).pack(side="left", padx=4, pady=8)
         styled_button(act_card, "✕  Clear",
                       self._clear).pack(side="left", padx=4, pady=8)
+        self._cancel_btn = styled_button(act_card, "■  Cancel", self._cancel_task)
+        self._cancel_btn.config(state="disabled")
+        self._cancel_btn.pack(side="left", padx=4, pady=8)
+
+        self._progress = progress_bar(top)
+        self._progress.pack(fill="x", padx=12, pady=(4, 0))
 
         # stats strip
         self._stats_frame = tk.Frame(top, bg=C["panel"])
@@ -318,6 +484,8 @@ class SDFProcessorTab(tk.Frame):
     def _clear(self):
         self._data_view.clear()
         self.processed_content = ""
+        self.output_result = None
+        self.result = None
         self._path_var.set("")
         self._file_path = ""
         self._status.set("Cleared.", "info")
@@ -329,346 +497,136 @@ class SDFProcessorTab(tk.Frame):
             return
         fp = filedialog.asksaveasfilename(
             defaultextension=".txt",
-            filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
+            filetypes=[("Text files", "*.txt"), ("HDF5 zone files", "*.hdf5"),
+                       ("NumPy zone files", "*.npz"), ("All files", "*.*")])
         if fp:
             try:
-                with open(fp, "w") as f:
-                    f.write(self.processed_content)
+                nmr_processing.write_sdf_output(fp, self.output_result,
+                                                source=os.path.basename(self._file_path))
                 self._status.set(f"Saved → {fp}", "ok")
                 messagebox.showinfo("Saved", f"Output saved to:\n{fp}")
             except Exception as e:
                 messagebox.showerror("Save Error", str(e))
 
-    # ── NORMALIZE  (original logic unchanged) ───────────────────────
+    # ── NORMALIZE  (vectorised on the result arrays) ────────────────
     def normalize_output(self):
-        if not self.processed_content:
+        if self.result is None:
             messagebox.showwarning("Nothing to Normalize", "Process a file first.")
             return
         try:
-            lines = self.processed_content.splitlines()
-            normalized_lines = []
-            current_zone = []
-            inside_zone = False
-
-            def normalize_zone(zone_lines):
-                data_lines = []
-                for line in zone_lines:
-                    if line.startswith("#") or "N/A" in line:
-                        continue
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        try:
-                            data_lines.append(float(parts[1]))
-                        except ValueError:
-                            continue
-                if not data_lines:
-                    return zone_lines
-                min_val  = min(data_lines)
-                max_val  = max(data_lines)
-                range_val = max_val - min_val if max_val != min_val else 1
-                norm_values = [(v - min_val) / range_val for v in data_lines]
-                norm_zone = []
-                norm_index = 0
-                for line in zone_lines:
-                    if line.startswith("#") or "N/A" in line:
-                        norm_zone.append(line)
-                    else:
-                        parts = line.split()
-                        if len(parts) >= 2:
-                            try:
-                                float(parts[1])
-                                parts[1] = f"{norm_values[norm_index]:<15.6f}"
-                                norm_index += 1
-                                norm_zone.append(" ".join(parts))
-                            except ValueError:
-                                norm_zone.append(line)
-                        else:
-                            norm_zone.append(line)
-                return norm_zone
-
-            for line in lines:
-                if line.startswith("# DATA"):
-                    if current_zone:
-                        normalized_lines.extend(normalize_zone(current_zone))
-                        normalized_lines.append("")
-                    current_zone = [line]
-                    inside_zone = True
-                elif inside_zone and line.strip() == "":
-                    current_zone.append(line)
-                    normalized_lines.extend(normalize_zone(current_zone))
-                    current_zone = []
-                    inside_zone = False
-                else:
-                    current_zone.append(line)
-
-            if current_zone:
-                normalized_lines.extend(normalize_zone(current_zone))
+            labels = {label: scheme for scheme, label
+                      in nmr_processing.NORMALIZE_SCHEMES.items()}
+            label = self._norm_var.get()
+            normalized = self.result.normalized(labels[label])
 
+            self.processed_content = normalized.text()
+            self.output_result = normalized
             self._data_view.clear()
-            for line in normalized_lines:
-                if line.startswith("# DATA"):
-                    self._data_view.insert(line + "\n", "data_line")
-                elif line.startswith("#  TAG") or line.startswith("# TAG"):
-                    self._data_view.insert(line + "\n", "tag_line")
-                elif line.startswith("#"):
-                    self._data_view.insert(line + "\n", "comment")
-                else:
-                    self._data_view.insert(line + "\n", "value")
-
-            self.processed_content = "\n".join(normalized_lines)
-            self._status.set("Normalization applied.", "ok")
+            self._data_view.insert(self.processed_content + "\n")
+            self._status.set(f"Normalization applied ({label}).", "ok")
 
         except Exception as e:
             self._data_view.insert(f"ERROR in normalization: {e}\n", "error")
             self._status.set(f"Normalization error: {e}", "error")
 
-    # ── PROCESS FILE  (original logic unchanged) ────────────────────
+    # ── PROCESS FILE  (runs on a BackgroundTask) ────────────────────
     def process_file(self, file_path):
+        if self._task and self._task.running:
+            self._status.set("Already processing — cancel it first.", "warn")
+            return
+
+        range_str = self._range_var.get().strip()
+        try:
+            self.row_range = nmr_processing.parse_row_range(range_str)
+        except Exception:
+            self._data_view.insert(
+                f"⚠  Invalid row range '{range_str}'. Ignored.\n", "warning")
+            self.row_range = None
+
+        self.processed_content = ""
+        self.output_result = None
+        self.result = None
+        self._progress.configure(value=0)
+        self._cancel_btn.config(state="normal")
         self._status.set("Loading file…", "busy")
-        self.update_idletasks()
-        t0 = time.time()
+        self._task = BackgroundTask(
+            self, self._process_sdf_job,
+            file_path, self.row_range,
+            on_progress=self._on_progress,
+            on_done=lambda result: self._on_done(file_path, result),
+            on_error=self._on_error,
+            on_cancel=self._on_cancel,
+        ).start()
+
+    def _process_sdf_job(self, task, file_path, row_range):
+        # worker thread: zones are streamed from disk, processed and handed to
+        # the viewer one at a time
+        reader = nmr_processing.SDFReader(file_path)
+        processed = nmr_processing.iter_processed_zones(reader, row_range)
+        zones = []
         try:
-            with open(file_path, "r") as fh:
-                lines = fh.readlines()
+            for zone in task.timed_iter(processed, "process"):
+                task.check()
+                # zones are separated by a blank line
+                task.post(self._data_view.insert, ("\n" if zones else "") + zone.text())
+                zones.append(zone)
+                task.progress(
+                    reader.fraction_read,
+                    f"Zone {zone.zone_idx + 1}  ·  {format_bytes(reader.bytes_read)}"
+                    f" of {format_bytes(reader.size)}")
+        finally:
+            processed.close()
+        # fails here, as before, when the file has no PARAMETER SUMMARY
+        return nmr_processing.SDFResult(zones, reader.nblk, reader.bs)
+
+    def _on_progress(self, fraction, message):
+        if fraction is not None:
+            self._progress.configure(value=100 * fraction)
+        self._status.set(message, "busy", right=f"{self._task.elapsed():.1f}s")
+
+    def _on_done(self, file_path, result):
+        self.result = result
+        self.processed_content = result.text()
+        self.output_result = result
+        n_zones, nblk, bs = len(result.zones), result.nblk, result.bs
+        self._update_stats(
+            zones=n_zones, nblk=nblk, bs=bs,
+            fname=os.path.basename(file_path)
+        )
+        self._progress.configure(value=100)
+        self._cancel_btn.config(state="disabled")
+        self._status.set(
+            f"Processed {n_zones} zones  ·  NBLK={nblk}  BS={bs}",
+            "ok",
+            right=self._task.timing_text()
+        )
 
-            range_str = self._range_var.get().strip()
-            if range_str:
-                try:
-                    start, end = map(int, range_str.split(":"))
-                    if start >= 0 and end >= start:
-                        self.row_range = (start, end)
-                    else:
-                        raise ValueError()
-                except Exception:
-                    self._data_view.insert(
-                        f"⚠  Invalid row range '{range_str}'. Ignored.\n", "warning")
-                    self.row_range = None
-            else:
-                self.row_range = None
-
-            zones               = []
-            current_zone        = None
-            data_lines          = []
-            zone_params         = {}
-            global_params       = {}
-            tau_formulas        = []
-            current_tau_index   = 0
-            in_parameter_summary= False
-            in_data_section     = False
-            current_zone_has_data = False
-
-            for raw in lines:
-                line = raw.strip()
-                if "PARAMETER SUMMARY" in line:
-                    if current_zone and current_zone_has_data:
-                        zones.append((current_zone, zone_params.copy(),
-                                      data_lines, current_tau_index))
-                    current_zone = None
-                    zone_params  = {}
-                    data_lines   = []
-                    current_zone_has_data = False
-                    in_parameter_summary  = True
-                    in_data_section       = False
-                    continue
-
-                elif line.startswith("ZONE"):
-                    if current_zone and current_zone_has_data and not in_parameter_summary:
-                        zones.append((current_zone, zone_params.copy(),
-                                      data_lines, current_tau_index))
-                    in_parameter_summary = False
-                    in_data_section      = False
-                    current_zone         = line
-                    zone_params          = {}
-                    data_lines           = []
-                    current_zone_has_data = False
-                    continue
-
-                if "=" in line:
-                    parts = [p.strip() for p in line.split("=", 1)]
-                    if len(parts) == 2:
-                        pname, pval = parts
-                        if in_parameter_summary:
-                            if pname in ("NBLK", "BS"):
-                                global_params[pname] = pval
-                            elif pname == "TAU":
-                                tau_formulas.append(line)
-                        elif current_zone:
-                            if pname == "T1MAX":
-                                try:
-                                    zone_params[pname] = str(float(pval) / 1000000)
-                                except ValueError:
-                                    zone_params[pname] = pval
-                            elif pname == "BR":
-                                zone_params["dum"] = pval
-                            else:
-                                zone_params[pname] = pval
-
-                if line == "DATA" and current_zone:
-                    in_data_section = True
-                    if tau_formulas and current_tau_index < len(tau_formulas):
-                        current_tau_index += 1
-                    continue
-
-                if in_data_section and current_zone:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        try:
-                            float(parts[2])
-                            data_lines.append(line)
-                            current_zone_has_data = True
-                        except ValueError:
-                            continue
-
-            if current_zone and current_zone_has_data:
-                zones.append((current_zone, zone_params.copy(),
-                              data_lines, current_tau_index))
-
-            if "NBLK" not in global_params or "BS" not in global_params:
-                raise ValueError("NBLK or BS not found in PARAMETER SUMMARY.")
-
-            nblk = int(global_params["NBLK"])
-            bs   = int(float(global_params["BS"]))
-
-            self._update_stats(
-                zones=len(zones), nblk=nblk, bs=bs,
-                fname=os.path.basename(file_path)
-            )
-
-            self.processed_content = ""
-
-            for zone_idx, (zone_name, params, data, tau_idx) in enumerate(zones):
-                block_means = self.calculate_means(data, nblk, bs)
-                tau_values  = []
-                t1max = float(params.get("T1MAX", 1.0))
-
-                if tau_idx > 0 and tau_idx <= len(tau_formulas):
-                    tau_formula = tau_formulas[tau_idx - 1]
-                    match = re.match(
-                        r"TAU\s*=\s*\[(log|lin):([\d\.]+)\*T1MAX:([\d\.]+)\*T1MAX:(\d+)\]",
-                        tau_formula)
-                    if match:
-                        scale_type = match.group(1)
-                        mult1      = float(match.group(2))
-                        mult2      = float(match.group(3))
-                        n_points   = int(match.group(4))
-                        tau_values_micro = self.generate_tau_values(
-                            scale_type, mult1 * t1max * 1e6,
-                            mult2 * t1max * 1e6, n_points)
-                        tau_values = (tau_values_micro / 1e6).tolist()
-
-                zone_content = []
-                if "dum" in params:
-                    try:
-                        dum_value = round(float(params["dum"]) * 1e6)
-                        zone_content.append(f"# DATA dum = {dum_value} \n")
-                    except ValueError:
-                        zone_content.append(f"# DATA dum = {params['dum']} \n")
-                else:
-                    zone_content.append("# DATA\n")
-
-                zone_content.append(f"#  TAG = Zone{zone_idx + 1}\n")
-                zone_content.append(f"# T1MAX = {t1max}\n")
-                if tau_idx > 0 and tau_idx <= len(tau_formulas):
-                    zone_content.append(f"# {tau_formulas[tau_idx - 1]}\n")
-
-                for i in range(len(block_means)):
-                    row = [
-                        f"{tau_values[i]:<15.6f}" if (tau_values and i < len(tau_values))
-                        else "N/A".ljust(15),
-                        f"{block_means[i]:<15.6f}",
-                        "1"
-                    ]
-                    zone_content.append(" ".join(row) + "\n")
-
-                if zone_idx < len(zones) - 1:
-                    zone_content.append("\n")
-
-                # render with tags
-                self._data_view.insert(zone_content[0], "data_line")
-                self._data_view.insert(zone_content[1], "tag_line")
-                for ln in zone_content[2:]:
-                    if ln.startswith("#"):
-                        self._data_view.insert(ln, "comment")
-                    elif ln.strip() == "":
-                        self._data_view.insert(ln)
-                    else:
-                        self._data_view.insert(ln, "value")
-
-                self.processed_content += "".join(zone_content)
-
-            elapsed = time.time() - t0
-            self._status.set(
-                f"Processed {len(zones)} zones  ·  NBLK={nblk}  BS={bs}",
-                "ok",
-                right=f"{elapsed:.2f}s"
-            )
+    def _on_error(self, e):
+        self._data_view.insert(f"ERROR: {e}\n", "error")
+        self.processed_content = ""
+        self.output_result = None
+        self.result = None
+        self._cancel_btn.config(state="disabled")
+        self._status.set(f"Error: {e}", "error", right=self._task.timing_text())
 
-        except Exception as e:
-            self._data_view.insert(f"ERROR: {e}\n", "error")
-            self.processed_content = ""
-            self._status.set(f"Error: {e}", "error")
-
-    # ── ORIGINAL LOGIC  (unchanged) ─────────────────────────────────
-    def generate_tau_values(self, scale_type, start, stop, num_points):
-        if scale_type == "log":
-            return np.logspace(np.log10(start), np.log10(stop), num=num_points)
-        elif scale_type == "lin":
-            return np.linspace(start, stop, num=num_points)
-        else:
-            raise ValueError(f"Unknown scale type: {scale_type}")
-
-    def calculate_means(self, data_lines, nblk, bs):
-        block_means = []
-        for i in range(nblk):
-            start_idx = i * bs
-            end_idx   = min((i + 1) * bs, len(data_lines))
-
-            if self.row_range:
-                rs, re = self.row_range
-                block_start = start_idx + rs
-                block_end   = min(start_idx + re + 1, end_idx)
-                if block_start >= end_idx:
-                    block_data = []
-                else:
-                    block_lines = data_lines[block_start:block_end]
-                    block_data  = [float(l.split()[2])
-                                   for l in block_lines if len(l.split()) >= 3]
-            else:
-                block_lines = data_lines[start_idx:end_idx]
-                block_data  = [float(l.split()[2])
-                               for l in block_lines if len(l.split()) >= 3]
+    def _on_cancel(self):
+        self.processed_content = ""
+        self.output_result = None
+        self.result = None
+        self._cancel_btn.config(state="disabled")
+        self._status.set("Cancelled — output is incomplete.", "warn",
+                         right=self._task.timing_text())
 
-            block_means.append(np.mean(block_data) if block_data else 0.0)
-        return block_means
+    def _cancel_task(self):
+        if self._task and self._task.running:
+            self._task.cancel()
+            self._status.set("Cancelling…", "busy")
 
 
 # ═══════════════════════════════════════════════════════════════════
 #  TAB 2  —  FFC-IST DATA PROCESSOR
 # ═══════════════════════════════════════════════════════════════════
 
-def format_data_dum_sci_hz(freq_khz: float) -> str:
-    hz = freq_khz * 1000.0
-    if hz <= 0:
-        return "0e3"
-    exp  = int(math.floor(math.log10(hz)))
-    mant = hz / (10 ** exp)
-    while exp > 6:
-        mant *= 10.0;  exp -= 1
-    while exp < 3:
-        mant /= 10.0;  exp += 1
-    return f"{mant:.4g}e{exp}"
-
-
-def format_tag_label(freq_khz: float) -> str:
-    if freq_khz >= 1000.0:
-        return f"{freq_khz / 1000:.4g}MHz"
-    return f"{freq_khz:.4g}KHz"
-
-
-def _fmt_g(x: float) -> str:
-    return f"{x:.6g}"
-
-
 class NMRDataProcessorTab(tk.Frame):
 
     def __init__(self, parent):
@@ -676,6 +634,7 @@ class NMRDataProcessorTab(tk.Frame):
         self.extracted_sample_name = "Unknown"
         self.extracted_temperature = "Unknown"
         self._output_path = ""
+        self._task = None          # BackgroundTask while a file is processing
         self._build()
 
     # ── BUILD UI ────────────────────────────────────────────────────
@@ -746,16 +705,12 @@ class NMRDataProcessorTab(tk.Frame):
                       self.download_file).pack(side="left", padx=4, pady=8)
         styled_button(act_card, "✕  Clear",
                       self._clear).pack(side="left", padx=4, pady=8)
+        self._cancel_btn = styled_button(act_card, "■  Cancel", self._cancel_task)
+        self._cancel_btn.config(state="disabled")
+        self._cancel_btn.pack(side="left", padx=4, pady=8)
 
         # progress bar
-        self._progress = ttk.Progressbar(self, mode="indeterminate", length=200)
-        style = ttk.Style()
-        style.theme_use("default")
-        style.configure("dark.Horizontal.TProgressbar",
-                        troughcolor=C["card"], background=C["accent"],
-                        bordercolor=C["border"], lightcolor=C["accent"],
-                        darkcolor=C["accent2"])
-        self._progress.configure(style="dark.Horizontal.TProgressbar")
+        self._progress = progress_bar(self)
         self._progress.pack(fill="x", padx=12, pady=(2, 0))
 
         separator(self)
@@ -789,11 +744,12 @@ class NMRDataProcessorTab(tk.Frame):
         fn = filedialog.asksaveasfilename(
             title="Save Processed Data As",
             defaultextension=".txt",
-            filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
+            filetypes=[("Text files", "*.txt"), ("HDF5 zone files", "*.hdf5"),
+                       ("NumPy zone files", "*.npz"), ("All files", "*.*")])
         if fn:
             self._out_var.set(fn)
 
-    # ── PROCESS DATA  (original logic unchanged) ────────────────────
+    # ── PROCESS DATA  (runs on a BackgroundTask) ────────────────────
     def process_data(self):
         if not self._in_var.get():
             messagebox.showerror("Error", "Select an input file.")
@@ -801,155 +757,106 @@ class NMRDataProcessorTab(tk.Frame):
         if not self._out_var.get():
             messagebox.showerror("Error", "Specify an output file.")
             return
+        if self._task and self._task.running:
+            self._status.set("Already processing — cancel it first.", "warn")
+            return
 
-        self._progress.start(12)
+        in_path, out_path = self._in_var.get(), self._out_var.get()
+        self._progress.configure(value=0)
+        self._cancel_btn.config(state="normal")
         self._status.set("Processing…", "busy")
         self._data_view.clear()
-        self.update_idletasks()
-        t0 = time.time()
-
-        try:
-            with open(self._in_var.get(), "r", encoding="utf-8") as f:
-                lines = f.read().splitlines()
-
-            param_start  = None
-            endtau_index = None
-            for i, line in enumerate(lines):
-                s = line.strip()
-                if endtau_index is None and s.lower().startswith("endtau"):
-                    endtau_index = i
-                if param_start is None and s.startswith("Parameters"):
-                    param_start = i
-                if endtau_index is not None and param_start is not None:
-                    break
-
-            if endtau_index is not None:
-                data_lines = lines[:endtau_index]
-            elif param_start is not None:
-                data_lines = lines[:param_start]
+        self._task = BackgroundTask(
+            self, self._process_data_job, in_path, out_path,
+            on_progress=self._on_progress,
+            on_done=lambda data: self._on_done(data, out_path),
+            on_error=self._on_error,
+            on_cancel=self._on_cancel,
+        ).start()
+
+    def _process_data_job(self, task, in_path, out_path):
+        # worker thread; reading is 60 % of the bar, the rest is one step per stage
+        def read_progress(done, total):
+            task.check()
+            task.progress(0.6 * done / max(total, 1),
+                          f"Reading {format_bytes(done)} of {format_bytes(total)}…")
+
+        with task.timed("read"):
+            text = nmr_processing.read_text(in_path, progress=read_progress)
+        task.check()
+        task.progress(0.6, "Grouping by frequency…")
+        file_stem = os.path.splitext(os.path.basename(in_path))[0]
+        with task.timed("parse"):
+            data = nmr_processing.parse_ffc_text(text, file_stem)
+        task.check()
+        task.progress(0.8, f"Formatting {len(data.blocks)} frequencies…")
+        with task.timed("format"):
+            full_text = nmr_processing.format_ffc(data)
+        task.check()
+
+        # render coloured output (only the visible lines are drawn)
+        task.post(self._data_view.insert, full_text)
+        task.progress(0.9, "Writing output…")
+        with task.timed("write"):
+            if nmr_processing.is_binary_output(out_path):
+                nmr_processing.write_ffc_output(out_path, [data], source=os.path.basename(in_path))
             else:
-                data_lines = lines
-
-            params = {}
-            if param_start is not None:
-                for i in range(param_start, len(lines)):
-                    ln = lines[i].strip()
-                    if "=" in ln and not ln.startswith("#"):
-                        k, v = ln.split("=", 1)
-                        params[k.strip()] = v.strip().strip('"')
-
-            file_stem = os.path.splitext(
-                os.path.basename(self._in_var.get()))[0]
-            self.extracted_sample_name = params.get(
-                "sampleName", file_stem if file_stem else "Unknown")
-
-            first_temp = None
-            for s in data_lines:
-                s = s.strip()
-                if not s or s.lower().startswith("endtau"):
-                    continue
-                parts = [p.strip() for p in s.split(",")]
-                if parts:
-                    try:
-                        first_temp = float(parts[0])
-                        break
-                    except ValueError:
-                        continue
-            self.extracted_temperature = (
-                "Unknown" if first_temp is None
-                else (str(int(first_temp))
-                      if float(first_temp).is_integer()
-                      else str(first_temp)))
-
-            freq_map = {}
-            for s in data_lines:
-                s = s.strip()
-                if not s:
-                    continue
-                parts = [p.strip() for p in s.split(",")]
-                if len(parts) >= 6:
-                    try:
-                        freq_khz = float(parts[1])
-                        freq_map.setdefault(freq_khz, []).append(parts)
-                    except ValueError:
-                        continue
-
-            # update metadata strip
-            self._meta_sample.config(
-                text=f"Sample: {self.extracted_sample_name}",
-                fg=C["accent"])
-            self._meta_temp.config(
-                text=f"Temperature: {self.extracted_temperature} °C",
-                fg=C["accent"])
-            self._meta_freq.config(
-                text=f"Frequencies: {len(freq_map)}",
-                fg=C["accent"])
-
-            out_lines = []
-            for freq_khz in sorted(freq_map.keys()):
-                dum       = format_data_dum_sci_hz(freq_khz)
-                tag_label = format_tag_label(freq_khz)
-
-                out_lines.append(f"# DATA dum={dum}")
-                out_lines.append(
-                    f"# TAG = {self.extracted_sample_name}"
-                    f"_Temp = {self.extracted_temperature}C_{tag_label}_1")
-
-                for parts in freq_map[freq_khz]:
-                    try:
-                        time_us = float(parts[2])
-                    except Exception:
-                        continue
-                    time_sec = time_us * 1e-6
-                    try:
-                        val     = float(parts[3])
-                        val_str = _fmt_g(val)
-                    except Exception:
-                        val_str = parts[3]
-                    out_lines.append(
-                        f"{_fmt_g(time_sec):>12}  {val_str:>12}  {1:>12}")
-
-                out_lines.append("")
-
-            full_text = "\n".join(out_lines) + "\n"
-
-            # render coloured output
-            for ln in full_text.splitlines():
-                if ln.startswith("# DATA"):
-                    self._data_view.insert(ln + "\n", "data_line")
-                elif ln.startswith("# TAG") or ln.startswith("#  TAG"):
-                    self._data_view.insert(ln + "\n", "tag_line")
-                elif ln.startswith("#"):
-                    self._data_view.insert(ln + "\n", "comment")
-                elif ln.strip() == "":
-                    self._data_view.insert("\n")
-                else:
-                    self._data_view.insert(ln + "\n", "value")
-
-            with open(self._out_var.get(), "w", encoding="utf-8") as f:
-                f.write(full_text)
-
-            self._output_path = self._out_var.get()
-            elapsed = time.time() - t0
-            self._status.set(
-                f"Processed {len(freq_map)} frequencies  ·  "
-                f"Sample: {self.extracted_sample_name}",
-                "ok",
-                right=f"{elapsed:.2f}s"
-            )
-            messagebox.showinfo(
-                "Success",
-                f"Processed {len(freq_map)} frequencies.\n"
-                f"Sample : {self.extracted_sample_name}\n"
-                f"Temp   : {self.extracted_temperature} °C\n"
-                f"Saved  : {self._out_var.get()}"
-            )
+                with open(out_path, "w", encoding="utf-8") as f:
+                    f.write(full_text)
+        return data
+
+    def _on_progress(self, fraction, message):
+        if fraction is not None:
+            self._progress.configure(value=100 * fraction)
+        self._status.set(message, "busy", right=f"{self._task.elapsed():.1f}s")
+
+    def _on_done(self, data, out_path):
+        self.extracted_sample_name = data.sample_name
+        self.extracted_temperature = data.temperature
+
+        # update metadata strip
+        self._meta_sample.config(
+            text=f"Sample: {self.extracted_sample_name}",
+            fg=C["accent"])
+        self._meta_temp.config(
+            text=f"Temperature: {self.extracted_temperature} °C",
+            fg=C["accent"])
+        self._meta_freq.config(
+            text=f"Frequencies: {len(data.blocks)}",
+            fg=C["accent"])
+
+        self._output_path = out_path
+        self._progress.configure(value=100)
+        self._cancel_btn.config(state="disabled")
+        self._status.set(
+            f"Processed {len(data.blocks)} frequencies  ·  "
+            f"Sample: {self.extracted_sample_name}",
+            "ok",
+            right=self._task.timing_text()
+        )
+        messagebox.showinfo(
+            "Success",
+            f"Processed {len(data.blocks)} frequencies.\n"
+            f"Sample : {self.extracted_sample_name}\n"
+            f"Temp   : {self.extracted_temperature} °C\n"
+            f"Saved  : {out_path}"
+        )
 
-        except Exception as e:
-            self._status.set(f"Error: {e}", "error")
-            messagebox.showerror("Processing Error", str(e))
-        finally:
-            self._progress.stop()
+    def _on_error(self, e):
+        self._cancel_btn.config(state="disabled")
+        self._status.set(f"Error: {e}", "error", right=self._task.timing_text())
+        messagebox.showerror("Processing Error", str(e))
+
+    def _on_cancel(self):
+        self._cancel_btn.config(state="disabled")
+        self._progress.configure(value=0)
+        self._status.set("Cancelled — no output written.", "warn",
+                         right=self._task.timing_text())
+
+    def _cancel_task(self):
+        if self._task and self._task.running:
+            self._task.cancel()
+            self._status.set("Cancelling…", "busy")
 
     # ── OPEN FOLDER  (original logic) ───────────────────────────────
     def download_file(self):
@@ -1062,6 +969,10 @@ class StyledNotebook(tk.Frame):
 #  MAIN ENTRY POINT
 # ═══════════════════════════════════════════════════════════════════
 def main():
+    # any arguments run headless batch conversion: … convert campaign/ --range 0:349 -o out/
+    if len(sys.argv) > 1:
+        sys.exit(nmr_processing.main(sys.argv[1:]))
+
     root = tk.Tk()
     root.title("NMR Lab Filter — Professional")
     root.geometry("1160x780")
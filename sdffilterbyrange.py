@@ -1,8 +1,17 @@
 # Import necessary modules
+import sys  # For command-line arguments
 import tkinter as tk  # For GUI
 from tkinter import filedialog, messagebox  # For file dialog boxes and pop-up messages
-import numpy as np  # For numeric operations like mean, logspace, linspace
-import re  # For regular expressions (pattern matching)
+import nmr_processing  # Tk-free SDF parsing, block averaging and formatting
+from line_view import LineView  # Output pane that only renders the visible lines
+
+# Colour tag for an output line, worked out only when the line is on screen
+def classify_line(line):
+    if line.startswith("# DATA"):
+        return "data"
+    if line.startswith("#  TAG"):
+        return "tag"
+    return ""
 
 # Define the main GUI application class
 class SDFProcessorGUI:
@@ -27,6 +36,11 @@ class SDFProcessorGUI:
         self.normalize_button = tk.Button(button_frame, text="Normalize", command=self.normalize_output, state=tk.DISABLED)
         self.normalize_button.pack(side=tk.LEFT, padx=5)
 
+        # Normalisation scheme used by the Normalize button
+        self.normalize_var = tk.StringVar(value=nmr_processing.NORMALIZE_SCHEMES["minmax"])
+        tk.OptionMenu(button_frame, self.normalize_var,
+                      *nmr_processing.NORMALIZE_SCHEMES.values()).pack(side=tk.LEFT, padx=5)
+
         # Row range input field
         tk.Label(button_frame, text="Set Row Range (e.g. 0:349):").pack(side=tk.LEFT, padx=5)
         self.range_entry = tk.Entry(button_frame, width=10)
@@ -38,7 +52,7 @@ class SDFProcessorGUI:
         self.debug_check.pack()
 
         # Text box to show the output
-        self.output_text = tk.Text(root, wrap=tk.WORD, width=120, height=30)
+        self.output_text = LineView(root, classify=classify_line, width=120, height=30)
         self.output_text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
 
         # Configure text colors and styles for tags
@@ -47,15 +61,17 @@ class SDFProcessorGUI:
         self.output_text.tag_config("warning", foreground="orange")
         self.output_text.tag_config("error", foreground="red")
 
-        # To hold processed file content
+        # To hold processed file content: the arrays and the text shown / saved
+        self.result = None
         self.processed_content = ""
+        self.output_result = None
         self.row_range = None  # User-defined range like 0:349
 
     # Function to load a file
     def load_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("SDF files", "*.sdf"), ("All files", "*.*")])
         if file_path:
-            self.output_text.delete(1.0, tk.END)
+            self.output_text.clear()
             self.process_file(file_path)
             self.save_button.config(state=tk.NORMAL)
             self.normalize_button.config(state=tk.NORMAL)
@@ -65,294 +81,73 @@ class SDFProcessorGUI:
         if not self.processed_content:
             messagebox.showwarning("Warning", "No content to save")
             return
-        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[
+            ("Text files", "*.txt"), ("HDF5 zone files", "*.hdf5"), ("NumPy zone files", "*.npz")])
         if file_path:
             try:
-                with open(file_path, 'w') as file:
-                    file.write(self.processed_content)
+                # .hdf5 / .npz keep the zones as arrays (tau, magnetization, weight)
+                nmr_processing.write_sdf_output(file_path, self.output_result)
                 messagebox.showinfo("Success", "File saved successfully")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save file: {str(e)}")
 
-    # Function to normalize the data
+    # Function to normalize the data (on the processed arrays, not the text)
     def normalize_output(self):
+        if self.result is None:
+            return
         try:
-            lines = self.processed_content.splitlines()
-            normalized_lines = []
-            current_zone = []
-            inside_zone = False
-
-            # Helper function to normalize each zone
-            def normalize_zone(zone_lines):
-                data_lines = []
-                for line in zone_lines:
-                    if line.startswith("#") or "N/A" in line:
-                        continue
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        try:
-                            data_lines.append(float(parts[1]))  # Y-values for normalization
-                        except ValueError:
-                            continue
-
-                if not data_lines:
-                    return zone_lines  # No data to normalize
-
-                min_val = min(data_lines)
-                max_val = max(data_lines)
-                range_val = max_val - min_val if max_val != min_val else 1
-                norm_values = [(val - min_val) / range_val for val in data_lines]
-
-                norm_zone = []
-                norm_index = 0
-                for line in zone_lines:
-                    if line.startswith("#") or "N/A" in line:
-                        norm_zone.append(line)
-                    else:
-                        parts = line.split()
-                        if len(parts) >= 2:
-                            try:
-                                float(parts[1])
-                                parts[1] = f"{norm_values[norm_index]:<15.6f}"  # Replace Y-value
-                                norm_index += 1
-                                norm_zone.append(" ".join(parts))
-                            except ValueError:
-                                norm_zone.append(line)
-                        else:
-                            norm_zone.append(line)
-
-                return norm_zone
-
-            # Main normalization loop
-            for line in lines:
-                if line.startswith("# DATA"):
-                    if current_zone:
-                        normalized_lines.extend(normalize_zone(current_zone))
-                        normalized_lines.append("")
-                    current_zone = [line]
-                    inside_zone = True
-                elif inside_zone and line.strip() == "":
-                    current_zone.append(line)
-                    normalized_lines.extend(normalize_zone(current_zone))
-                    current_zone = []
-                    inside_zone = False
-                else:
-                    current_zone.append(line)
-
-            if current_zone:
-                normalized_lines.extend(normalize_zone(current_zone))
+            labels = {label: scheme for scheme, label in nmr_processing.NORMALIZE_SCHEMES.items()}
+            normalized = self.result.normalized(labels[self.normalize_var.get()])
 
             # Display and store normalized content
-            self.output_text.delete(1.0, tk.END)
-            for line in normalized_lines:
-                if line.startswith("# DATA"):
-                    self.output_text.insert(tk.END, line + "\n", "data")
-                elif line.startswith("#  TAG"):
-                    self.output_text.insert(tk.END, line + "\n", "tag")
-                else:
-                    self.output_text.insert(tk.END, line + "\n")
-
-            self.processed_content = "\n".join(normalized_lines)
+            self.processed_content = normalized.text()
+            self.output_result = normalized
+            self.output_text.clear()
+            self.output_text.insert(self.processed_content + "\n")
 
         except Exception as e:
-            self.output_text.insert(tk.END, f"ERROR in normalization: {str(e)}\n", "error")
+            self.output_text.insert(f"ERROR in normalization: {str(e)}\n", "error")
 
     # Process the SDF file
     def process_file(self, file_path):
         try:
-            with open(file_path, "r") as file:
-                lines = file.readlines()
+            # Zones are streamed from disk and formatted one at a time
+            reader = nmr_processing.SDFReader(file_path)
 
             # Handle row range input
             range_str = self.range_entry.get().strip()
-            if range_str:
-                try:
-                    start, end = map(int, range_str.split(":"))
-                    if start >= 0 and end >= start:
-                        self.row_range = (start, end)
-                    else:
-                        raise ValueError()
-                except Exception:
-                    self.output_text.insert(tk.END, f"Invalid row range format: '{range_str}'. Ignoring range.\n", "warning")
-                    self.row_range = None
-            else:
+            try:
+                self.row_range = nmr_processing.parse_row_range(range_str)
+            except Exception:
+                self.output_text.insert(f"Invalid row range format: '{range_str}'. Ignoring range.\n", "warning")
                 self.row_range = None
 
-            # Variables to store data while parsing
-            zones = []
-            current_zone = None
-            data_lines = []
-            zone_params = {}
-            global_params = {}
-            tau_formulas = []
-            current_tau_index = 0
-            in_parameter_summary = False
-            in_data_section = False
-            current_zone_has_data = False
-
-            for line in lines:
-                line = line.strip()
-                if "PARAMETER SUMMARY" in line:
-                    if current_zone and current_zone_has_data:
-                        zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
-                    current_zone = None
-                    zone_params = {}
-                    data_lines = []
-                    current_zone_has_data = False
-                    in_parameter_summary = True
-                    in_data_section = False
-                    continue
-                elif line.startswith("ZONE"):
-                    if current_zone and current_zone_has_data and not in_parameter_summary:
-                        zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
-                    in_parameter_summary = False
-                    in_data_section = False
-                    current_zone = line
-                    zone_params = {}
-                    data_lines = []
-                    current_zone_has_data = False
-                    continue
-
-                # Extract parameters
-                if "=" in line:
-                    parts = [p.strip() for p in line.split("=", 1)]
-                    if len(parts) == 2:
-                        param_name, param_value = parts
-                        if in_parameter_summary:
-                            if param_name in ["NBLK", "BS"]:
-                                global_params[param_name] = param_value
-                            elif param_name == "TAU":
-                                tau_formulas.append(line)
-                        elif current_zone:
-                            if param_name == "T1MAX":
-                                try:
-                                    zone_params[param_name] = str(float(param_value) / 1000000)
-                                except ValueError:
-                                    zone_params[param_name] = param_value
-                            elif param_name == "BR":
-                                zone_params["dum"] = param_value
-                            else:
-                                zone_params[param_name] = param_value
-
-                if line == "DATA" and current_zone:
-                    in_data_section = True
-                    if tau_formulas and current_tau_index < len(tau_formulas):
-                        current_tau_index += 1
-                    continue
-
-                if in_data_section and current_zone:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        try:
-                            float(parts[2])
-                            data_lines.append(line)
-                            current_zone_has_data = True
-                        except ValueError:
-                            continue
-
-            if current_zone and current_zone_has_data:
-                zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
-
-            if "NBLK" not in global_params or "BS" not in global_params:
-                raise ValueError("NBLK or BS parameters not found in any PARAMETER SUMMARY")
-
-            nblk = int(global_params["NBLK"])
-            bs = int(float(global_params["BS"]))
-
+            self.result = None
             self.processed_content = ""
+            self.output_result = None
+            zones = []
 
             # Build final content zone by zone
-            for zone_idx, (zone_name, params, data, tau_idx) in enumerate(zones):
-                block_means = self.calculate_means(data, nblk, bs)
-                tau_values = []
-                t1max = float(params.get("T1MAX", 1.0))
-
-                if tau_idx > 0 and tau_idx <= len(tau_formulas):
-                    tau_formula = tau_formulas[tau_idx - 1]
-                    match = re.match(r"TAU\s*=\s*\[(log|lin):([\d\.]+)\*T1MAX:([\d\.]+)\*T1MAX:(\d+)\]", tau_formula)
-                    if match:
-                        scale_type = match.group(1)
-                        mult1 = float(match.group(2))
-                        mult2 = float(match.group(3))
-                        n_points = int(match.group(4))
-                        tau_values_micro = self.generate_tau_values(scale_type, mult1 * t1max * 1e6, mult2 * t1max * 1e6, n_points)
-                        tau_values = (tau_values_micro / 1e6).tolist()
-
-                zone_content = []
-
-                if "dum" in params:
-                    try:
-                        dum_value = round(float(params['dum']) * 1e6)
-                        zone_content.append(f"# DATA dum = {dum_value} \n")
-                    except ValueError:
-                        zone_content.append(f"# DATA dum = {params['dum']} \n")
-                else:
-                    zone_content.append("# DATA\n")
-
-                zone_content.append(f"#  TAG = Zone{zone_idx + 1}\n")
-                zone_content.append(f"# T1MAX = {t1max}\n")
-                if tau_idx > 0 and tau_idx <= len(tau_formulas):
-                    zone_content.append(f"# {tau_formulas[tau_idx - 1]}\n")
-
-                for i in range(len(block_means)):
-                    row = [
-                        f"{tau_values[i]:<15.6f}" if tau_values and i < len(tau_values) else "N/A".ljust(15),
-                        f"{block_means[i]:<15.6f}",
-                        "1"
-                    ]
-                    zone_content.append(" ".join(row) + "\n")
+            for zone in nmr_processing.iter_processed_zones(reader, self.row_range):
+                # Insert zone into GUI (zones are separated by a blank line) and keep its arrays
+                self.output_text.insert(("\n" if zones else "") + zone.text())
+                zones.append(zone)
 
-                if zone_idx < len(zones) - 1:
-                    zone_content.append("\n")
-
-                # Insert zone into GUI and store in memory
-                self.output_text.insert(tk.END, zone_content[0], "data")
-                self.output_text.insert(tk.END, zone_content[1], "tag")
-                for line in zone_content[2:]:
-                    self.output_text.insert(tk.END, line)
-
-                self.processed_content += "".join(zone_content)
+            self.result = nmr_processing.SDFResult(zones, reader.nblk, reader.bs)
+            self.processed_content = self.result.text()
+            self.output_result = self.result
 
         except Exception as e:
-            self.output_text.insert(tk.END, f"ERROR: {str(e)}\n", "error")
+            self.output_text.insert(f"ERROR: {str(e)}\n", "error")
+            self.result = None
             self.processed_content = ""
-
-    # Generate tau values based on scale type
-    def generate_tau_values(self, scale_type, start, stop, num_points):
-        if scale_type == "log":
-            return np.logspace(np.log10(start), np.log10(stop), num=num_points)
-        elif scale_type == "lin":
-            return np.linspace(start, stop, num=num_points)
-        else:
-            raise ValueError(f"Unknown scale type: {scale_type}")
-
-    # Calculate average for each block of data
-    def calculate_means(self, data_lines, nblk, bs):
-        block_means = []
-
-        for i in range(nblk):
-            start_idx = i * bs
-            end_idx = min((i + 1) * bs, len(data_lines))
-
-            if self.row_range:
-                range_start, range_end = self.row_range
-                block_start = start_idx + range_start
-                block_end = min(start_idx + range_end + 1, end_idx)
-                if block_start >= end_idx:
-                    block_data = []
-                else:
-                    block_lines = data_lines[block_start:block_end]
-                    block_data = [float(line.split()[2]) for line in block_lines if len(line.split()) >= 3]
-            else:
-                block_lines = data_lines[start_idx:end_idx]
-                block_data = [float(line.split()[2]) for line in block_lines if len(line.split()) >= 3]
-
-            block_means.append(np.mean(block_data) if block_data else 0.0)
-
-        return block_means
+            self.output_result = None
 
 # Run the GUI app
 if __name__ == "__main__":
+    # Any arguments run headless batch conversion: sdffilterbyrange.py convert campaign/ --range 0:349
+    if len(sys.argv) > 1:
+        sys.exit(nmr_processing.main(sys.argv[1:]))
     root = tk.Tk()
     app = SDFProcessorGUI(root)
     root.mainloop()
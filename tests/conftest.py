@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The client's default cache, index and catalogue folders live under ~/.pyofe
+os.environ["HOME"] = tempfile.mkdtemp(prefix="pyofe-tests-home-")
+
+import pyofe_stub_server  # noqa: E402
+
+
+@pytest.fixture
+def stub_server(tmp_path):
+    """An in-process pyofe_stub_server on a free port; .url is its /fit URL."""
+    server = pyofe_stub_server.make_server(port=0, quiet=True, upload_dir=str(tmp_path / "uploads"))
+    os.makedirs(server.upload_dir, exist_ok=True)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    server.url = f"http://{host}:{port}/fit"
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
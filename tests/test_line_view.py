@@ -0,0 +1,37 @@
+import pytest
+
+line_view = pytest.importorskip("line_view")        # needs tkinter, but not a display
+LineStore = line_view.LineStore
+
+
+def test_appends_split_into_lines_with_tags():
+    store = LineStore()
+    store.append("# DATA\n", "data")
+    store.append("0.1  0.5")
+    assert len(store) == 2
+    store.append("  1\n0.2  0.6  1\n")
+    store.append("Bad range\n", "warning")
+    assert store.lines(0, 10) == [("# DATA", "data"), ("0.1  0.5  1", ""), ("0.2  0.6  1", ""),
+                                  ("Bad range", "warning")]
+    assert store.lines(1, 3) == [("0.1  0.5  1", ""), ("0.2  0.6  1", "")]
+    assert store.lines(3, 1) == []
+
+
+def test_text_is_everything_appended():
+    pieces = ["α β\n", "partial", " line\n", "", "x\n" * 1000, "no newline"]
+    store = LineStore()
+    for piece in pieces:
+        store.append(piece)
+    assert store.text() == "".join(pieces)
+    assert store.lines(len(store) - 1, len(store)) == [("no newline", "")]
+
+
+def test_large_output_spills_to_disk():
+    line = "0.000123       0.456789       1\n"
+    count = line_view.SPOOL_SIZE // len(line) + 1000
+    store = LineStore()
+    store.append(line * count)
+    assert len(store) == count
+    assert store.lines(count - 1, count) == [(line[:-1], "")]
+    assert store.text() == line * count
+    store.close()
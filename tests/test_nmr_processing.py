@@ -0,0 +1,657 @@
+import re
+
+import numpy as np
+import pytest
+
+import nmr_processing
+from nmr_processing import block_means, parse_row_range, parse_sdf, parse_sdf_lines, process_sdf
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  SDF SAMPLES AND THE ORIGINAL ROW-BY-ROW ALGORITHM
+# ═══════════════════════════════════════════════════════════════════
+
+def make_sdf(zone_rows, nblk=4, bs=5, seed=0, summary_first=True):
+    """SDF text with one zone per entry of zone_rows (number of DATA rows)."""
+    rng = np.random.default_rng(seed)
+    summary = [
+        "PARAMETER SUMMARY",
+        f"NBLK = {nblk}",
+        f"BS = {bs}",
+        "TAU = [log:0.01*T1MAX:4*T1MAX:4]",
+        "TAU = [lin:0.05*T1MAX:2*T1MAX:4]",
+        "",
+    ]
+    lines = list(summary) if summary_first else []
+    for n, rows in enumerate(zone_rows, 1):
+        lines += [f"ZONE {n}", f"BR = {0.01 * n:g}", f"T1MAX = {150000 + 1000 * n}", "DATA"]
+        for i in range(rows):
+            lines.append(f"{i} {rng.normal():.4f} {rng.normal(100, 10):.6f} {rng.normal():.4f}")
+        lines.append("")
+    if not summary_first:
+        lines += summary
+    return "\n".join(lines) + "\n"
+
+
+def legacy_process(lines, row_range=None):
+    """The zone state machine and calculate_means of the original sdffilterbyrange.py GUI."""
+    zones, current_zone, data_lines, zone_params = [], None, [], {}
+    global_params, tau_formulas = {}, []
+    current_tau_index = 0
+    in_parameter_summary = in_data_section = current_zone_has_data = False
+
+    for line in lines:
+        line = line.strip()
+        if "PARAMETER SUMMARY" in line:
+            if current_zone and current_zone_has_data:
+                zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
+            current_zone, zone_params, data_lines = None, {}, []
+            current_zone_has_data, in_parameter_summary, in_data_section = False, True, False
+            continue
+        elif line.startswith("ZONE"):
+            if current_zone and current_zone_has_data and not in_parameter_summary:
+                zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
+            in_parameter_summary = in_data_section = False
+            current_zone, zone_params, data_lines, current_zone_has_data = line, {}, [], False
+            continue
+        if "=" in line:
+            param_name, param_value = [p.strip() for p in line.split("=", 1)]
+            if in_parameter_summary:
+                if param_name in ["NBLK", "BS"]:
+                    global_params[param_name] = param_value
+                elif param_name == "TAU":
+                    tau_formulas.append(line)
+            elif current_zone:
+                if param_name == "T1MAX":
+                    zone_params[param_name] = str(float(param_value) / 1000000)
+                elif param_name == "BR":
+                    zone_params["dum"] = param_value
+                else:
+                    zone_params[param_name] = param_value
+        if line == "DATA" and current_zone:
+            in_data_section = True
+            if tau_formulas and current_tau_index < len(tau_formulas):
+                current_tau_index += 1
+            continue
+        if in_data_section and current_zone:
+            parts = line.split()
+            if len(parts) >= 3:
+                try:
+                    float(parts[2])
+                    data_lines.append(line)
+                    current_zone_has_data = True
+                except ValueError:
+                    continue
+    if current_zone and current_zone_has_data:
+        zones.append((current_zone, zone_params.copy(), data_lines, current_tau_index))
+
+    nblk, bs = int(global_params["NBLK"]), int(float(global_params["BS"]))
+    content = ""
+    for zone_idx, (zone_name, params, data, tau_idx) in enumerate(zones):
+        means = []
+        for i in range(nblk):
+            start_idx, end_idx = i * bs, min((i + 1) * bs, len(data))
+            if row_range:
+                block_start = start_idx + row_range[0]
+                block_end = min(start_idx + row_range[1] + 1, end_idx)
+                block_lines = [] if block_start >= end_idx else data[block_start:block_end]
+            else:
+                block_lines = data[start_idx:end_idx]
+            block_data = [float(line.split()[2]) for line in block_lines if len(line.split()) >= 3]
+            means.append(np.mean(block_data) if block_data else 0.0)
+
+        t1max = float(params.get("T1MAX", 1.0))
+        tau_values = []
+        if 0 < tau_idx <= len(tau_formulas):
+            match = re.match(r"TAU\s*=\s*\[(log|lin):([\d\.]+)\*T1MAX:([\d\.]+)\*T1MAX:(\d+)\]",
+                             tau_formulas[tau_idx - 1])
+            if match:
+                start, stop = float(match.group(2)) * t1max * 1e6, float(match.group(3)) * t1max * 1e6
+                if match.group(1) == "log":
+                    micro = np.logspace(np.log10(start), np.log10(stop), num=int(match.group(4)))
+                else:
+                    micro = np.linspace(start, stop, num=int(match.group(4)))
+                tau_values = (micro / 1e6).tolist()
+
+        zone_content = []
+        if "dum" in params:
+            zone_content.append(f"# DATA dum = {round(float(params['dum']) * 1e6)} \n")
+        else:
+            zone_content.append("# DATA\n")
+        zone_content.append(f"#  TAG = Zone{zone_idx + 1}\n")
+        zone_content.append(f"# T1MAX = {t1max}\n")
+        if 0 < tau_idx <= len(tau_formulas):
+            zone_content.append(f"# {tau_formulas[tau_idx - 1]}\n")
+        for i in range(len(means)):
+            tau = f"{tau_values[i]:<15.6f}" if tau_values and i < len(tau_values) else "N/A".ljust(15)
+            zone_content.append(" ".join([tau, f"{means[i]:<15.6f}", "1"]) + "\n")
+        if zone_idx < len(zones) - 1:
+            zone_content.append("\n")
+        content += "".join(zone_content)
+    return content
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  PARSING AND BLOCK MEANS
+# ═══════════════════════════════════════════════════════════════════
+
+@pytest.mark.parametrize("row_range", [None, (0, 0), (1, 3), (2, 99)])
+@pytest.mark.parametrize("zone_rows", [[20, 20, 20], [20, 13, 7], [25, 3]])
+def test_process_sdf_matches_original_output(zone_rows, row_range):
+    text = make_sdf(zone_rows)
+    result = process_sdf(parse_sdf_lines(text.splitlines()), row_range)
+    assert result.text() == legacy_process(text.splitlines(), row_range)
+
+
+def test_zones_read_before_the_summary_get_no_tau():
+    text = make_sdf([20, 20], summary_first=False)
+    result = process_sdf(parse_sdf_lines(text.splitlines()))
+    assert result.text() == legacy_process(text.splitlines())
+    assert "N/A" in result.text()
+
+
+def test_non_numeric_and_short_rows_are_dropped():
+    text = make_sdf([20]).replace("\n3 ", "\n3 x\n3 ", 1).replace("\n5 ", "\n5 a b c\n5 ", 1)
+    sdf = parse_sdf_lines(text.splitlines())
+    assert len(sdf.zones[0].values) == 20
+    assert process_sdf(sdf).text() == legacy_process(text.splitlines())
+
+
+def test_parse_keeps_zone_parameters():
+    sdf = parse_sdf_lines(make_sdf([20, 20]).splitlines())
+    assert (sdf.nblk, sdf.bs) == (4, 5)
+    assert [zone.name for zone in sdf.zones] == ["ZONE 1", "ZONE 2"]
+    assert sdf.zones[0].params == {"dum": "0.01", "T1MAX": "0.151"}
+    assert [zone.tau_index for zone in sdf.zones] == [1, 2]
+
+
+def test_missing_summary_is_an_error():
+    sdf = parse_sdf_lines(["ZONE 1", "DATA", "0 0 1.0"])
+    with pytest.raises(ValueError, match="NBLK or BS"):
+        process_sdf(sdf)
+
+
+def test_block_means_of_short_and_empty_blocks():
+    zone = nmr_processing.SDFZone("ZONE 1", {}, np.arange(1.0, 8.0), 0)
+    assert block_means(zone, 3, 3).tolist() == [2.0, 5.0, 7.0]
+    assert block_means(zone, 3, 3, (1, 2)).tolist() == [2.5, 5.5, 0.0]
+    assert block_means(zone, 3, 3, (5, 9)).tolist() == [0.0, 0.0, 0.0]
+
+
+@pytest.mark.parametrize("text, expected", [("", None), (" 0:349 ", (0, 349)), ("2:2", (2, 2))])
+def test_parse_row_range(text, expected):
+    assert parse_row_range(text) == expected
+
+
+@pytest.mark.parametrize("text", ["3:1", "-1:4", "1", "a:b"])
+def test_parse_row_range_rejects(text):
+    with pytest.raises(ValueError):
+        parse_row_range(text)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  STREAMING READER
+# ═══════════════════════════════════════════════════════════════════
+
+def test_streamed_file_matches_parsed_lines(tmp_path):
+    text = make_sdf([20, 13, 7, 20])
+    path = tmp_path / "sample.sdf"
+    path.write_text(text)
+
+    expected = process_sdf(parse_sdf_lines(text.splitlines())).text()
+    assert process_sdf(parse_sdf(str(path))).text() == expected
+    assert nmr_processing.process_sdf_file(str(path))["content"] == expected
+
+    output = tmp_path / "sample.txt"
+    summary = nmr_processing.process_sdf_file(str(path), output_path=str(output))
+    assert (summary["zones"], summary["nblk"], summary["bs"]) == (4, 4, 5)
+    assert output.read_text() == expected
+
+
+def test_reader_yields_each_zone_as_it_closes():
+    consumed = []
+
+    def lines():
+        for line in make_sdf([20, 20, 20]).splitlines():
+            consumed.append(line)
+            yield line
+
+    reader = nmr_processing.SDFReader(lines())
+    zones = iter(reader)
+    first = next(zones)
+    assert first.name == "ZONE 1"
+    assert "ZONE 3" not in consumed
+    assert [zone.name for zone in zones] == ["ZONE 2", "ZONE 3"]
+
+
+def test_reader_reports_progress_through_the_file(tmp_path):
+    path = tmp_path / "sample.sdf"
+    path.write_text(make_sdf([20] * 5))
+    reader = nmr_processing.SDFReader(str(path))
+    fractions = [reader.fraction_read for _ in reader]
+    assert fractions == sorted(fractions)
+    assert reader.fraction_read == 1.0
+    assert nmr_processing.SDFReader(["ZONE 1"]).fraction_read is None
+
+
+def test_zones_before_the_summary_are_held_back():
+    text = make_sdf([20, 20], summary_first=False)
+    zones = list(nmr_processing.iter_processed_zones(nmr_processing.SDFReader(text.splitlines())))
+    assert "".join(("\n" if i else "") + zone.text() for i, zone in enumerate(zones)) == \
+        legacy_process(text.splitlines())
+
+
+def test_failed_output_is_removed(tmp_path):
+    path = tmp_path / "broken.sdf"
+    path.write_text("ZONE 1\nDATA\n0 0 1.0\n")
+    output = tmp_path / "broken.txt"
+    with pytest.raises(ValueError):
+        nmr_processing.process_sdf_file(str(path), output_path=str(output))
+    assert not output.exists()
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  PROCESS POOL
+# ═══════════════════════════════════════════════════════════════════
+
+def test_streamed_zones_match_parsed_file():
+    text = make_sdf([20, 13, 7, 20, 3, 18], seed=3)
+    reader = nmr_processing.SDFReader(text.splitlines())
+    zones = list(nmr_processing.iter_processed_zones(reader, (1, 3)))
+    assert [zone.zone_idx for zone in zones] == list(range(6))
+    assert "\n".join(zone.text() for zone in zones) == \
+        process_sdf(parse_sdf_lines(text.splitlines()), (1, 3)).text()
+
+
+def test_batch_keeps_file_order_and_reports_failures(tmp_path):
+    paths = []
+    for n in range(4):
+        path = tmp_path / f"sample{n}.sdf"
+        path.write_text(make_sdf([20, 10 + n], seed=n))
+        paths.append(str(path))
+    broken = tmp_path / "broken.sdf"
+    broken.write_text("ZONE 1\nDATA\n0 0 1.0\n")
+    paths.insert(2, str(broken))
+
+    serial = list(nmr_processing.process_sdf_files(paths, workers=1))
+    parallel = list(nmr_processing.process_sdf_files(paths, workers=2))
+    assert [r["file"] for r in parallel] == paths
+    assert "NBLK or BS" in parallel[2]["error"]
+    assert [r.get("content") for r in parallel] == [r.get("content") for r in serial]
+    assert parallel[0]["content"] == legacy_process(open(paths[0]).read().splitlines())
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  NORMALISATION
+# ═══════════════════════════════════════════════════════════════════
+
+TAU = np.array([0.5, np.nan, 0.1, 2.0, 1.0])
+MEANS = np.array([4.0, 100.0, 2.0, 10.0, 6.0])
+
+
+@pytest.mark.parametrize("scheme, expected", [
+    ("minmax", [0.25, 100.0, 0.0, 1.0, 0.5]),
+    ("first", [1.0, 100.0, 0.5, 2.5, 1.5]),
+    ("m0", [0.6, 100.0, 0.3, 1.5, 0.9]),         # M0 = mean(10, 6, 4), the three longest taus
+])
+def test_normalize_schemes(scheme, expected):
+    np.testing.assert_allclose(nmr_processing.normalize_means(TAU, MEANS, scheme), expected)
+
+
+def test_first_point_is_the_first_with_a_tau():
+    tau = np.array([np.nan, 0.2, 0.4])
+    np.testing.assert_allclose(nmr_processing.normalize_means(tau, [7.0, 2.0, 3.0], "first"),
+                               [7.0, 1.0, 1.5])
+
+
+@pytest.mark.parametrize("scheme", ["minmax", "first", "m0"])
+def test_zero_scale_leaves_values_unscaled(scheme):
+    tau = np.array([0.1, 0.2, 0.3])
+    zeros = nmr_processing.normalize_means(tau, np.zeros(3), scheme)
+    np.testing.assert_array_equal(zeros, np.zeros(3))
+    untouched = nmr_processing.normalize_means(np.full(3, np.nan), [1.0, 2.0, 3.0], scheme)
+    np.testing.assert_array_equal(untouched, [1.0, 2.0, 3.0])
+
+
+def test_normalize_rows_independently():
+    tau = np.vstack([TAU, [1.0, 2.0, 3.0, 4.0, 5.0]])
+    means = np.vstack([MEANS, [5.0, 4.0, 3.0, 2.0, 1.0]])
+    result = nmr_processing.normalize_means(tau, means, "minmax")
+    np.testing.assert_allclose(result[0], nmr_processing.normalize_means(TAU, MEANS, "minmax"))
+    np.testing.assert_allclose(result[1], [1.0, 0.75, 0.5, 0.25, 0.0])
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError, match="Unknown normalisation scheme"):
+        nmr_processing.normalize_means(TAU, MEANS, "max")
+
+
+@pytest.mark.parametrize("scheme", sorted(nmr_processing.NORMALIZE_SCHEMES))
+def test_normalized_result_matches_each_zone(tmp_path, scheme):
+    text = make_sdf([20, 13, 7], summary_first=False)     # zones without tau keep 'N/A' rows
+    result = process_sdf(parse_sdf_lines(text.splitlines()))
+    normalized = result.normalized(scheme)
+    for zone, original in zip(normalized.zones, result.zones):
+        np.testing.assert_allclose(zone.means, original.normalized(scheme).means)
+        np.testing.assert_array_equal(zone.tau, original.tau)
+
+    path = tmp_path / "sample.sdf"
+    path.write_text(text)
+    assert nmr_processing.process_sdf_file(str(path), normalize=scheme)["content"] == normalized.text()
+
+
+def test_minmax_matches_original_normalize_output():
+    # The original GUI re-read column 2 of the text output zone by zone and
+    # rescaled the rows that have a tau value
+    text = make_sdf([20, 13, 7])
+    original = [[float(line.split()[1]) for line in zone.splitlines() if not line.startswith("#")]
+                for zone in legacy_process(text.splitlines()).split("\n\n")]
+    result = process_sdf(parse_sdf_lines(text.splitlines())).normalized("minmax")
+    for values, zone in zip(original, result.zones):
+        lo, hi = min(values), max(values)
+        np.testing.assert_allclose(zone.means, [(v - lo) / (hi - lo) for v in values], atol=1e-5)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FFC-IST EXPORTS
+# ═══════════════════════════════════════════════════════════════════
+
+def make_ffc(freqs=(10.0, 0.5, 2500.0), rows=4, temperature=25, sample="water", seed=0,
+             endtau=True):
+    """FFC-IST export text with rows interleaved across frequencies, as the instrument writes them."""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for i in range(rows):
+        for freq in freqs:
+            lines.append(f"{temperature},{freq:g},{(i + 1) * 150.5:g},{rng.uniform(0, 1):.5f},"
+                         f"{rng.uniform(0, 0.1):.4f},0")
+    if endtau:
+        lines.append("endtau")
+    lines.append("Parameters")
+    if sample is not None:
+        lines.append(f'sampleName = "{sample}"')
+    lines.append("# comment = ignored")
+    lines.append("T1MAX = 2.5")
+    return "\n".join(lines) + "\n"
+
+
+def legacy_ffc(text, file_stem):
+    """NMRDataProcessorTab.process_data of the original GUI, text in and text out."""
+    lines = text.splitlines()
+    param_start = endtau_index = None
+    for i, line in enumerate(lines):
+        s = line.strip()
+        if endtau_index is None and s.lower().startswith("endtau"):
+            endtau_index = i
+        if param_start is None and s.startswith("Parameters"):
+            param_start = i
+    if endtau_index is not None:
+        data_lines = lines[:endtau_index]
+    elif param_start is not None:
+        data_lines = lines[:param_start]
+    else:
+        data_lines = lines
+
+    params = {}
+    if param_start is not None:
+        for ln in lines[param_start:]:
+            ln = ln.strip()
+            if "=" in ln and not ln.startswith("#"):
+                k, v = ln.split("=", 1)
+                params[k.strip()] = v.strip().strip('"')
+    sample_name = params.get("sampleName", file_stem if file_stem else "Unknown")
+
+    first_temp = None
+    for s in data_lines:
+        s = s.strip()
+        if not s or s.lower().startswith("endtau"):
+            continue
+        try:
+            first_temp = float(s.split(",")[0].strip())
+            break
+        except ValueError:
+            continue
+    temperature = ("Unknown" if first_temp is None
+                   else str(int(first_temp)) if float(first_temp).is_integer() else str(first_temp))
+
+    freq_map = {}
+    for s in data_lines:
+        s = s.strip()
+        if not s:
+            continue
+        parts = [p.strip() for p in s.split(",")]
+        if len(parts) >= 6:
+            try:
+                freq_map.setdefault(float(parts[1]), []).append(parts)
+            except ValueError:
+                continue
+
+    out_lines = []
+    for freq_khz in sorted(freq_map):
+        out_lines.append(f"# DATA dum={nmr_processing.format_data_dum_sci_hz(freq_khz)}")
+        out_lines.append(f"# TAG = {sample_name}_Temp = {temperature}C_"
+                         f"{nmr_processing.format_tag_label(freq_khz)}_1")
+        for parts in freq_map[freq_khz]:
+            try:
+                time_sec = float(parts[2]) * 1e-6
+            except ValueError:
+                continue
+            try:
+                val_str = nmr_processing._fmt_g(float(parts[3]))
+            except ValueError:
+                val_str = parts[3]
+            out_lines.append(f"{nmr_processing._fmt_g(time_sec):>12}  {val_str:>12}  {1:>12}")
+        out_lines.append("")
+    return "\n".join(out_lines) + "\n"
+
+
+FFC_SAMPLES = {
+    "plain": make_ffc(),
+    "no endtau": make_ffc(endtau=False),
+    "no sample name": make_ffc(sample=None),
+    "fractional temperature": make_ffc(temperature=36.6),
+    # The row-by-row fallback: headers, short and non-numeric rows
+    "header": "Temp,Freq,Time,Value,Err,Flag\n" + make_ffc(),
+    "short rows": make_ffc().replace("endtau", "25,10,1\n\n25,x,5,1,1,0\nendtau"),
+    "text values": make_ffc().replace(",0.", ",nan?", 1).replace(",301,", ",t,", 1),
+    "no data": "endtau\nParameters\nsampleName = empty\n",
+}
+
+
+@pytest.mark.parametrize("name", sorted(FFC_SAMPLES))
+def test_ffc_matches_original_output(name):
+    text = FFC_SAMPLES[name]
+    data_lines = text[:text.find("endtau") if "endtau" in text else text.find("Parameters")].splitlines()
+    fast = nmr_processing._ffc_columns(data_lines) is not None
+    assert fast == (name in ("plain", "no endtau", "no sample name", "fractional temperature", "no data"))
+    data = nmr_processing.parse_ffc_text(text, "export")
+    assert nmr_processing.format_ffc(data) == legacy_ffc(text, "export")
+
+
+def test_ffc_groups_by_frequency_in_file_order():
+    data = nmr_processing.parse_ffc_text(make_ffc(rows=5), "export")
+    assert [block.freq_khz for block in data.blocks] == [0.5, 10.0, 2500.0]
+    for block in data.blocks:
+        np.testing.assert_allclose(block.time_s, np.arange(1, 6) * 150.5e-6)
+        assert block.value_text is None
+    assert (data.sample_name, data.temperature) == ("water", "25")
+    assert data.params == {"sampleName": "water", "T1MAX": "2.5"}
+
+
+def test_ffc_keeps_text_values():
+    data = nmr_processing.parse_ffc_text(FFC_SAMPLES["text values"], "export")
+    block = data.blocks[1]
+    assert block.value_text[0].startswith("nan?")
+    assert np.isnan(block.values[0])
+    assert block.value_text[1:] == [None] * (len(block) - 1)
+
+
+def test_load_ffc_uses_the_file_stem(tmp_path):
+    path = tmp_path / "run 7.csv"
+    path.write_text(make_ffc(sample=None))
+    seen = []
+    data = nmr_processing.load_ffc(str(path), progress=lambda done, total: seen.append((done, total)))
+    assert data.sample_name == "run 7"
+    assert seen[-1] == (path.stat().st_size, path.stat().st_size)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  MERGED FFC-IST BATCHES
+# ═══════════════════════════════════════════════════════════════════
+
+def test_merge_groups_by_sample_temperature_and_frequency():
+    exports = [
+        make_ffc(freqs=(10.0, 2.0), temperature=25, sample="water", seed=1),
+        make_ffc(freqs=(10.0,), temperature=5, sample="water", seed=2),
+        make_ffc(freqs=(10.0, 40.0), temperature=25, sample="water", seed=3),
+        make_ffc(freqs=(1.0,), temperature=25, sample="oil", seed=4),
+        "endtau\nParameters\nsampleName = water\n",
+    ]
+    datas = [nmr_processing.parse_ffc_text(text, "export") for text in exports]
+    merged = nmr_processing.merge_ffc(datas)
+
+    assert [(data.sample_name, data.temperature) for data in merged] == \
+        [("oil", "25"), ("water", "5"), ("water", "25")]
+    water = merged[2]
+    assert [block.freq_khz for block in water.blocks] == [2.0, 10.0, 40.0]
+    ten = water.blocks[1]
+    np.testing.assert_array_equal(ten.values, np.concatenate([datas[0].blocks[1].values,
+                                                              datas[2].blocks[0].values]))
+    np.testing.assert_array_equal(ten.time_s, np.concatenate([datas[0].blocks[1].time_s,
+                                                              datas[2].blocks[0].time_s]))
+
+
+def test_merge_orders_unknown_temperatures_last():
+    datas = [nmr_processing.FFCData("s", t, [nmr_processing.FFCBlock(1.0, np.ones(1), np.ones(1))])
+             for t in ("Unknown", "100", "-5", "7.5")]
+    assert [data.temperature for data in nmr_processing.merge_ffc(datas)] == \
+        ["-5", "7.5", "100", "Unknown"]
+
+
+def test_merge_keeps_text_values_in_place():
+    texts = [FFC_SAMPLES["text values"], make_ffc(seed=5)]
+    datas = [nmr_processing.parse_ffc_text(text, "export") for text in texts]
+    merged = nmr_processing.merge_ffc(datas)
+    assert len(merged) == 1
+    block = merged[0].blocks[1]
+    assert block.value_text[0].startswith("nan?")
+    assert block.value_text[1:] == [None] * (len(block) - 1)
+    assert block.value_text[0] in nmr_processing.format_ffc(merged[0])
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_ffc_command_writes_merged_and_per_file_output(tmp_path, workers):
+    inputs = tmp_path / "exports"
+    (inputs / "day2").mkdir(parents=True)
+    texts = {"a.txt": make_ffc(temperature=25, seed=1),
+             "b.txt": make_ffc(temperature=35, seed=2),
+             "day2/c.txt": make_ffc(temperature=25, seed=3)}
+    for name, text in texts.items():
+        (inputs / name).write_text(text)
+    output = tmp_path / "out"
+
+    assert nmr_processing.main(["ffc", str(inputs), "-o", str(output), "--workers", workers, "-q"]) == 0
+    for name, text in texts.items():
+        assert (output / name).read_text() == legacy_ffc(text, "")
+
+    assert nmr_processing.main(["ffc", str(inputs), "-o", str(output), "--merge",
+                                "--workers", workers, "-q"]) == 0
+    datas = [nmr_processing.parse_ffc_text(texts[name], "") for name in sorted(texts)]
+    expected = "".join(nmr_processing.format_ffc(data) for data in nmr_processing.merge_ffc(datas))
+    assert (output / "merged.txt").read_text() == expected
+
+
+def test_ffc_command_refuses_exports_that_share_an_output(tmp_path, capsys):
+    for n, folder in enumerate(("day1", "day2")):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "export.txt").write_text(make_ffc(temperature=25 + n, seed=n))
+    output = tmp_path / "out"
+    argv = ["ffc", str(tmp_path / "day1"), str(tmp_path / "day2"), "-o", str(output), "--workers", "2", "-q"]
+    assert nmr_processing.main(argv) == 2
+    assert "would both be written to" in capsys.readouterr().err
+    assert not output.exists()
+
+    # Merged output has no per-file names to collide
+    assert nmr_processing.main(argv + ["--merge"]) == 0
+    merged = (output / "merged.txt").read_text()
+    assert "Temp = 25C" in merged and "Temp = 26C" in merged
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  BINARY ZONE FILES
+# ═══════════════════════════════════════════════════════════════════
+
+ZONE_FILE_SUFFIXES = [pytest.param(".hdf5", marks=pytest.mark.skipif(nmr_processing.h5py is None,
+                                                                    reason="h5py is not installed")),
+                      ".npz"]
+
+
+@pytest.mark.parametrize("suffix", ZONE_FILE_SUFFIXES)
+def test_sdf_zone_file_round_trip(tmp_path, suffix):
+    path = tmp_path / "sample.sdf"
+    path.write_text(make_sdf([20, 13, 7], seed=5))
+    text = nmr_processing.process_sdf_file(str(path), (1, 3))["content"]
+    output = str(tmp_path / f"sample{suffix}")
+    summary = nmr_processing.process_sdf_file(str(path), (1, 3), output_path=output)
+    assert (summary["output"], summary["zones"]) == (output, 3)
+
+    assert nmr_processing.is_zone_file(output)
+    assert nmr_processing.zone_file_text(output) == text
+    file_attrs, zones = nmr_processing.read_zone_file(output)
+    assert (file_attrs["kind"], file_attrs["nblk"], file_attrs["bs"]) == ("sdf", 4, 5)
+    assert [name for name, _, _ in zones] == ["zone0001", "zone0002", "zone0003"]
+    sdf = process_sdf(parse_sdf_lines(make_sdf([20, 13, 7], seed=5).splitlines()), (1, 3))
+    for (_, attrs, datasets), zone in zip(zones, sdf.zones):
+        assert attrs["TAG"] == f"Zone{zone.zone_idx + 1}"
+        np.testing.assert_array_equal(datasets["tau"], zone.tau)
+        np.testing.assert_array_equal(datasets["magnetization"], zone.means)
+        np.testing.assert_array_equal(datasets["weight"], np.ones_like(zone.tau))
+        if suffix == ".hdf5":
+            assert isinstance(datasets["tau"], np.memmap)
+
+
+@pytest.mark.parametrize("suffix", ZONE_FILE_SUFFIXES)
+def test_ffc_zone_file_round_trip(tmp_path, suffix):
+    path = tmp_path / "export.txt"
+    path.write_text(make_ffc())
+    text_output = tmp_path / "export.out.txt"
+    nmr_processing.process_ffc_file(str(path), str(text_output))
+    output = str(tmp_path / f"export{suffix}")
+    nmr_processing.process_ffc_file(str(path), output)
+
+    assert nmr_processing.is_zone_file(output)
+    assert nmr_processing.zone_file_text(output) == text_output.read_text()
+    _, zones = nmr_processing.read_zone_file(output, mmap=False)
+    assert [attrs["freq_khz"] for _, attrs, _ in zones] == [0.5, 10.0, 2500.0]
+
+
+def test_other_files_are_not_zone_files(tmp_path):
+    path = tmp_path / "arrays.npz"
+    np.savez(path, tau=np.arange(3.0))
+    assert not nmr_processing.is_zone_file(str(path))
+    assert not nmr_processing.is_zone_file(str(tmp_path / "sample.sdf"))
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  COMMAND LINE
+# ═══════════════════════════════════════════════════════════════════
+
+
+def test_convert_refuses_to_overwrite_its_input(tmp_path, capsys):
+    path = tmp_path / "sample.txt"
+    text = make_sdf([20])
+    path.write_text(text)
+    assert nmr_processing.main(["convert", str(path), "-o", str(tmp_path), "-q"]) == 2
+    assert "would overwrite its input" in capsys.readouterr().err
+    assert path.read_text() == text
+
+
+def test_convert_refuses_inputs_that_share_an_output(tmp_path, capsys):
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "run.sdf").write_text(make_sdf([20], seed=len(folder)))
+    output = tmp_path / "out"
+    argv = ["convert", str(tmp_path / "a"), str(tmp_path / "b"), "-o", str(output), "--workers", "2", "-q"]
+    assert nmr_processing.main(argv) == 2
+    assert "would both be written to" in capsys.readouterr().err
+    assert not output.exists()
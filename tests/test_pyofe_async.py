@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+
+import pytest
+import requests
+
+import nmr_processing
+import pyofe_async
+import pyofe_client
+import pyofe_hdf5
+from pyofe_client import FitJob, JOB_DONE, JOB_FAILED
+
+pytestmark = pytest.mark.skipif(pyofe_async.aiohttp is None, reason="aiohttp is not installed")
+
+
+def run_jobs(stub_server, jobs, **kwargs):
+    async def run_all():
+        async with pyofe_async.AsyncFitClient(stub_server.url, retry_delay=0, **kwargs) as client:
+            return [job async for job in client.as_completed(jobs)]
+    return asyncio.run(run_all())
+
+
+def test_retry_starts_from_an_empty_folder(tmp_path, stub_server):
+    path = tmp_path / "sample.sdf"
+    path.write_text("ZONE 1\n" * 50)
+    folder = tmp_path / "out"
+    folder.mkdir()
+    (folder / "stale.json").write_text("{}")
+
+    requests.post(stub_server.url, files={"file": ("x.sdf", b"x")})      # request 1
+    stub_server.fail_every = 2          # so the job's first attempt gets 503, its retry succeeds
+    params, _ = pyofe_client.build_fit_params(str(path), "Mono", "yes", "yes", "yes", "yes", "1.0")
+    [job] = run_jobs(stub_server, [FitJob(str(path), params, str(folder))], upload_mode="single")
+
+    assert (job.status, job.attempts) == (JOB_DONE, 2)
+    assert os.listdir(folder) == ["sample"]
+    with open(folder / "sample" / "sample.json") as f:
+        assert json.load(f)["input-bytes"] == path.stat().st_size
+
+
+def test_jobs_fail_after_their_retries(tmp_path, stub_server):
+    stub_server.fail_every = 1
+    jobs = []
+    for n in range(3):
+        path = tmp_path / f"s{n}.sdf"
+        path.write_text("ZONE 1\n")
+        params, _ = pyofe_client.build_fit_params(str(path), "Mono", "yes", "yes", "yes", "yes", "1.0")
+        jobs.append(FitJob(str(path), params, str(tmp_path / "out" / f"s{n}")))
+    finished = run_jobs(stub_server, jobs, max_retries=1, upload_mode="single")
+    assert sorted(job.file_path for job in finished) == sorted(job.file_path for job in jobs)
+    assert all(job.status == JOB_FAILED and job.attempts == 2 for job in finished)
+    assert "503" in finished[0].error
+    assert stub_server.requests == 6
+
+
+def test_subset_that_matches_nothing_fails_at_once(tmp_path, stub_server):
+    pytest.importorskip("h5py")
+    path = str(tmp_path / "zones.hdf5")
+    nmr_processing.write_zone_file(path, "sdf", [({"TAU": "1"}, [1.0, 2.0], [0.5, 0.25])])
+    params, _ = pyofe_client.build_fit_params(path, "Mono", "yes", "yes", "yes", "yes", "1.0")
+    [job] = run_jobs(stub_server, [FitJob(path, params, str(tmp_path / "out"))], max_retries=3,
+                     upload_mode="single", subset=pyofe_hdf5.HDF5Subset(zones="5"))
+    assert (job.status, job.attempts) == (JOB_FAILED, 1)
+    assert "No zone of zones.hdf5" in job.error
+    assert stub_server.requests == 0
+
+
+def test_chunked_upload_then_fit(tmp_path, stub_server):
+    path = tmp_path / "big.sdf"
+    path.write_bytes(os.urandom(50_000))
+    params, _ = pyofe_client.build_fit_params(str(path), "Mono", "yes", "yes", "yes", "yes", "1.0")
+    [job] = run_jobs(stub_server, [FitJob(str(path), params, str(tmp_path / "out"))],
+                     upload_mode="chunked", chunk_size=10_000, compression="none")
+    assert job.status == JOB_DONE
+    assert stub_server.chunks == 5
+    with open(tmp_path / "out" / "big" / "big.json") as f:
+        assert json.load(f)["input-bytes"] == 50_000
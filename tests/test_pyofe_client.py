@@ -0,0 +1,714 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pytest
+import requests
+
+import nmr_processing
+import pyofe_client
+import pyofe_hdf5
+import pyofe_stub_server
+from pyofe_client import FitClient, ResultCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_catalogues():
+    # Catalogues and negotiated encodings are remembered per server URL
+    shutil.rmtree(pyofe_client.CATALOGUE_FOLDER, ignore_errors=True)
+    pyofe_client._encodings_memo.clear()
+
+
+def zip_bytes(size, name="result.json"):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr(name, os.urandom(size))
+    return buffer.getvalue()
+
+
+def write(path, data):
+    path.write_bytes(data if isinstance(data, bytes) else data.encode("utf-8"))
+    return str(path)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  RESULT CACHE
+# ═══════════════════════════════════════════════════════════════════
+
+def test_cache_key_follows_content_params_and_url(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    first = write(tmp_path / "a.sdf", "ZONE 1\n")
+    moved = write(tmp_path / "elsewhere.sdf", "ZONE 1\n")
+    other = write(tmp_path / "b.sdf", "ZONE 22\n")
+    params = {"function": "Mono", "logx": "yes"}
+    url = "http://host/fit"
+
+    key = cache.key(first, params, url)
+    assert key == cache.key(moved, params, url)
+    assert key == cache.key(first, {"logx": "yes", "function": "Mono"}, url)
+    assert len({key, cache.key(other, params, url), cache.key(first, {**params, "logx": "no"}, url),
+                cache.key(first, params, "http://other/fit")}) == 4
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.get("ab" * 32) is None
+    data = zip_bytes(100)
+    cache.put("ab" * 32, io.BytesIO(data), {"file": "a.sdf"})
+    with cache.get("ab" * 32) as archive:
+        assert archive.read() == data
+    with open(os.path.join(cache.folder, "ab", "ab" * 32 + ".json")) as f:
+        assert json.load(f) == {"file": "a.sdf"}
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+    keys = [f"{n:02d}" * 32 for n in range(3)]
+    for n, key in enumerate(keys[:2]):
+        cache.put(key, io.BytesIO(zip_bytes(1000)), {})
+        os.utime(cache._entry_path(key), (1000 + n, 1000 + n))     # the first is the oldest
+    cache.get(keys[0]).close()          # a hit makes it the most recently used
+    cache.put(keys[2], io.BytesIO(zip_bytes(1000)), {})
+
+    assert cache.evictions == 1
+    assert cache.get(keys[1]) is None
+    assert not os.path.exists(cache._entry_path(keys[1])[:-len(".zip")] + ".json")
+    for key in (keys[0], keys[2]):
+        cache.get(key).close()
+    assert cache.stats()["entries"] == 2
+
+
+def test_oversized_result_is_not_stored(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+    cache.put("aa" * 32, io.BytesIO(zip_bytes(1000)), {})
+    assert cache.put("bb" * 32, io.BytesIO(zip_bytes(3000)), {}) is False
+    assert cache.get("bb" * 32) is None
+    assert cache.stats()["entries"] == 1
+    assert (cache.stores, cache.evictions) == (1, 0)
+
+
+def test_newest_entry_survives_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+    cache.put("aa" * 32, io.BytesIO(zip_bytes(1000)), {})
+    future = time.time() + 60
+    os.utime(cache._entry_path("aa" * 32), (future, future))    # looks newer than the next store
+    cache.put("bb" * 32, io.BytesIO(zip_bytes(2000)), {})
+    assert cache.evictions == 1
+    assert cache.get("aa" * 32) is None
+    cache.get("bb" * 32).close()
+
+
+def test_counts_are_saved_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(pyofe_client, "CACHE_STATS_BATCH", 3)
+    cache = ResultCache(str(tmp_path / "cache"))
+    stats_path = os.path.join(cache.folder, pyofe_client.CACHE_STATS_FILE)
+    cache.get("ab" * 32)
+    cache.get("ab" * 32)
+    assert not os.path.exists(stats_path)
+    assert cache.totals()["misses"] == 2
+    cache.get("ab" * 32)
+    with open(stats_path) as f:
+        assert json.load(f)["misses"] == 3
+    cache.get("ab" * 32)
+    cache.flush()
+    assert ResultCache(cache.folder).totals()["misses"] == 4
+
+
+def test_totals_persist_across_runs_until_cleared(tmp_path, capsys):
+    folder = str(tmp_path / "cache")
+    first = ResultCache(folder)
+    first.get("ab" * 32)
+    first.put("ab" * 32, io.BytesIO(zip_bytes(10)))
+    first.get("ab" * 32).close()
+    first.flush()
+
+    second = ResultCache(folder)
+    second.get("ab" * 32).close()
+    assert (second.hits, second.misses) == (1, 0)
+    assert second.totals() == {"hits": 2, "misses": 1, "stores": 1, "evictions": 0}
+    assert second.stats()["totals"]["hit_rate"] == pytest.approx(2 / 3)
+    second.flush()
+
+    assert pyofe_client.main(["cache", "stats", "--cache-dir", folder]) == 0
+    out = capsys.readouterr().out
+    assert "Entries:   1" in out
+    assert "Hits:      2 (66.7% of lookups)" in out
+    assert "Misses:    1" in out
+    assert "Stores:    1" in out
+
+    assert pyofe_client.main(["cache", "clear", "--cache-dir", folder]) == 0
+    assert ResultCache(folder).totals() == dict.fromkeys(pyofe_client.CACHE_COUNTERS, 0)
+
+
+def test_repeated_fit_is_served_from_the_cache(tmp_path, stub_server):
+    cache = ResultCache(str(tmp_path / "cache"))
+    client = FitClient(stub_server.url, cache=cache, upload_mode="single", compression="none")
+    path = write(tmp_path / "sample.sdf", "ZONE 1\n" * 100)
+
+    first = client.fit(path, "Mono", download_folder=str(tmp_path / "first"))
+    second = client.fit(path, "Mono", download_folder=str(tmp_path / "second"))
+    assert stub_server.requests == 1
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+    with open(os.path.join(first, "sample", "sample.json")) as a, \
+            open(os.path.join(second, "sample", "sample.json")) as b:
+        assert json.load(a) == json.load(b)
+
+    client.fit(path, "Bi", download_folder=str(tmp_path / "third"))
+    assert stub_server.requests == 2
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FIT RESULTS AND THE RUN INDEX
+# ═══════════════════════════════════════════════════════════════════
+
+def write_result_json(folder, relative, fit_results, **fields):
+    path = os.path.join(folder, *relative.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"fit-results": fit_results, **fields} if fit_results is not None else fields, f)
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_result_jsons_are_merged_in_folder_order(tmp_path, workers):
+    folder = str(tmp_path / "out")
+    for zone in range(12, 0, -1):       # written in reverse, merged in sorted order
+        write_result_json(folder, f"zone{zone:02d}/zone{zone:02d}.json", f"Zone | T11\n{zone} | {zone / 10}")
+    write_result_json(folder, "zone05/extra.json", "Zone | M0 | T11\n5b | 0.9 | bad")
+    write_result_json(folder, "notes.json", None, comment="no table")
+    with open(os.path.join(folder, "broken.json"), "w") as f:
+        f.write("{")
+
+    results = pyofe_client.load_fit_results(folder, workers=workers)
+    assert results.header == ["Zone", "T11", "M0"]
+    assert len(results) == 13
+    assert results.sources[4:6] == ["zone05/extra.json", "zone05/zone05.json"]
+    assert results.columns["Zone"][4:6] == ["5b", "5"]
+    assert results.columns["M0"][4:6] == ["0.9", ""]
+    np.testing.assert_array_equal(results.values("T11")[3:6], [0.4, np.nan, 0.5])
+    assert [source for source, _ in results.skipped] == ["broken.json", "notes.json"]
+    assert "not found" in dict(results.skipped)["notes.json"]
+
+    lines = results.text().split("\n")
+    assert lines[0] == "Zone\tT11\tM0\tSource"
+    assert lines[5] == "5b\tbad\t0.9\tzone05/extra.json"
+    assert lines[6] == "5\t0.5\t\tzone05/zone05.json"
+    assert pyofe_client.read_fit_results(folder) == results.text()
+
+
+def test_single_result_json_is_written_as_before(tmp_path):
+    folder = str(tmp_path / "out")
+    write_result_json(folder, "sample/sample.json", "Zone | T11\n1 | 0.5\n2 | 0.6")
+    assert pyofe_client.read_fit_results(folder) == "Zone\tT11\n1\t0.5\n2\t0.6"
+    assert pyofe_client.read_fit_results(str(tmp_path / "empty")) is None
+
+
+def test_index_records_runs_and_queries_parameters(tmp_path):
+    index = pyofe_client.FitIndex(str(tmp_path / "index.sqlite"))
+    sample = write(tmp_path / "sample.sdf", "ZONE 1\n")
+    other = write(tmp_path / "other.sdf", "ZONE 2\n")
+    first = str(tmp_path / "first")
+    write_result_json(first, "zone1/zone1.json", "Zone | T11 | M0\n1 | 0.5 | 1.0\n2 | n/a | 0.9")
+    write_result_json(first, "zone2/zone2.json", "Zone | T11\n3 | 0.7")
+    second = str(tmp_path / "second")
+    write_result_json(second, "other/other.json", "Zone | T11\n1 | 0.25")
+
+    params = {"function": "Mono", "logx": "yes"}
+    run1 = index.record(sample, params, "http://fit", first)
+    run2 = index.record(other, {**params, "function": "Bi"}, "http://fit", second, from_cache=True)
+
+    runs = index.runs()
+    assert [run["id"] for run in runs] == [run2, run1]
+    assert (runs[0]["from_cache"], runs[1]["from_cache"]) == (1, 0)
+    assert json.loads(runs[1]["sources"]) == ["zone1/zone1.json", "zone2/zone2.json"]
+    assert json.loads(runs[1]["params"]) == params
+    assert [run["id"] for run in index.runs(file=sample)] == [run1]
+    assert [run["id"] for run in index.runs(file=pyofe_client.file_digest(other))] == [run2]
+    assert [run["id"] for run in index.runs(function="Bi")] == [run2]
+    assert len(index.runs(limit=1)) == 1
+
+    assert [(run, source, row, value) for run, _, _, source, row, value in index.parameter("T11")] == [
+        (run1, "zone1/zone1.json", 1, 0.5),
+        (run1, "zone1/zone1.json", 2, None),
+        (run1, "zone2/zone2.json", 3, 0.7),
+        (run2, "other/other.json", 1, 0.25),
+    ]
+    assert [row[-1] for row in index.parameter("T11", function="Mono", file=sample)] == [0.5, None, 0.7]
+    assert index.parameter("M0", function="Bi") == []
+
+    assert index.table(run1).text() == pyofe_client.load_fit_results(first).text()
+
+
+def test_history_command_prints_runs_and_parameters(tmp_path, capsys):
+    index_path = str(tmp_path / "index.sqlite")
+    assert pyofe_client.main(["history", "--index", index_path]) == 1
+    sample = write(tmp_path / "sample.sdf", "ZONE 1\n")
+    folder = str(tmp_path / "out")
+    write_result_json(folder, "sample/sample.json", "Zone | T11\n1 | 0.5")
+    run_id = pyofe_client.FitIndex(index_path).record(sample, {"function": "Mono"}, "http://fit", folder)
+    capsys.readouterr()
+
+    assert pyofe_client.main(["history", "--index", index_path, "--param", "T11"]) == 0
+    assert capsys.readouterr().out.split("\t")[-2:] == ["1", "0.5\n"]
+    assert pyofe_client.main(["history", "--index", index_path, "--show", str(run_id)]) == 0
+    assert capsys.readouterr().out == "Zone\tT11\n1\t0.5\n"
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  HEADLESS IMPORT
+# ═══════════════════════════════════════════════════════════════════
+
+def test_client_imports_and_runs_without_tk(stub_server):
+    # A None entry in sys.modules makes every import of tkinter fail
+    script = (
+        "import sys\n"
+        "sys.modules['tkinter'] = None\n"
+        "import pyofe_client, pyofe_async, pyofe_results, pyofe_hdf5, nmr_processing\n"
+        f"sys.exit(pyofe_client.main(['list', '--url', {stub_server.url!r}]))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True,
+                            text=True, timeout=60, env={**os.environ, "DISPLAY": ""})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip()
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  STREAMED DOWNLOAD
+# ═══════════════════════════════════════════════════════════════════
+
+def test_download_is_streamed_in_chunks_with_progress(stub_server, monkeypatch):
+    monkeypatch.setattr(pyofe_client, "PROGRESS_INTERVAL", 0)
+    reports = []
+    destination = io.BytesIO()
+    with requests.post(stub_server.url, files={"file": ("x.sdf", os.urandom(200_000))},
+                       stream=True) as response:
+        total = int(response.headers["Content-Length"])
+        received = pyofe_client.download_stream(response, destination, chunk_size=100,
+                                                progress_callback=lambda *r: reports.append(r))
+
+    assert received == total == len(destination.getvalue())
+    assert zipfile.is_zipfile(destination)
+    assert len(reports) > total // 100
+    assert [r[0] for r in reports] == sorted(r[0] for r in reports)
+    assert all(r[1] == total for r in reports)
+    assert reports[-1][0] == total
+
+
+@pytest.mark.parametrize("spool", [False, True])
+def test_fit_reports_download_progress_and_extracts(tmp_path, stub_server, spool):
+    reports = []
+    client = FitClient(stub_server.url, spool=spool, upload_mode="single", compression="none")
+    path = write(tmp_path / "sample.sdf", "ZONE 1\n" * 100)
+    folder = client.fit(path, "Mono", download_folder=str(tmp_path / "out"),
+                        progress_callback=lambda *r: reports.append(r))
+
+    received, total, rate = reports[-1]
+    assert received == total > 0 and rate > 0
+    assert sorted(os.listdir(os.path.join(folder, "sample"))) == ["All.pdf", "sample.json"]
+    assert not os.path.exists(os.path.join(folder, "downloaded.zip"))
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  SESSION RETRIES
+# ═══════════════════════════════════════════════════════════════════
+
+def test_post_is_only_resent_when_the_fit_did_not_run():
+    retry = pyofe_client.create_session(retries=3).get_adapter("http://").max_retries
+    assert not retry.is_retry("POST", 500)
+    assert retry.is_retry("POST", 503)
+    assert retry.is_retry("GET", 500)
+    assert retry.is_retry("PUT", 502)
+
+
+def test_overloaded_fit_is_resent(stub_server):
+    stub_server.fail_every = 1          # every POST gets 503
+    session = pyofe_client.create_session(retries=2, backoff=0)
+    response = session.post(stub_server.url, files={"file": ("a.sdf", b"ZONE 1\n")})
+    assert response.status_code == 503
+    assert stub_server.requests == 3
+
+
+def test_slow_fit_is_not_resent_after_a_read_timeout(stub_server):
+    stub_server.delay = 0.5
+    session = pyofe_client.create_session(retries=2, backoff=0)
+    with pytest.raises(requests.ReadTimeout):
+        session.post(stub_server.url, files={"file": ("a.sdf", b"ZONE 1\n")}, timeout=(5, 0.1))
+    time.sleep(stub_server.delay)       # a resent POST would have arrived by now
+    assert stub_server.requests == 1
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  RESUMABLE UPLOADS
+# ═══════════════════════════════════════════════════════════════════
+
+UPLOAD = os.urandom(10_000)
+CHUNK = 3000
+
+
+class OtherClientSession(requests.Session):
+    """Before the first chunk goes out, another client sends it, so the server
+    is ahead of this client's offset and answers its PUT with 409."""
+
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def put(self, url, data=None, **kwargs):
+        if not self.statuses:
+            other = requests.put(url, data=data, headers=kwargs["headers"])
+            assert other.status_code == 200
+        response = super().put(url, data=data, **kwargs)
+        self.statuses.append(response.status_code)
+        return response
+
+
+def upload_url(stub_server):
+    return pyofe_client.endpoint_url(stub_server.url, "upload")
+
+
+def uploaded_bytes(stub_server, upload_id):
+    with open(os.path.join(stub_server.upload_dir, upload_id + ".part"), "rb") as f:
+        return f.read()
+
+
+def test_upload_resumes_from_the_server_offset_after_409(stub_server):
+    session = OtherClientSession()
+    log = []
+    upload_id = pyofe_client.upload_resumable(session, upload_url(stub_server), "a.sdf", io.BytesIO(UPLOAD),
+                                              chunk_size=CHUNK, log=log.append, retry_delay=0)
+    assert session.statuses == [409, 200, 200, 200]
+    assert any("offset mismatch" in line for line in log)
+    assert uploaded_bytes(stub_server, upload_id) == UPLOAD
+    assert stub_server.uploads[upload_id].offset == len(UPLOAD)
+
+
+def test_dropped_chunks_are_resumed_from_the_server_offset(stub_server):
+    stub_server.drop_every = 2          # stored, but the answer never arrives
+    progress = []
+    upload_id = pyofe_client.upload_resumable(
+        requests.Session(), upload_url(stub_server), "a.sdf", io.BytesIO(UPLOAD), chunk_size=CHUNK,
+        retry_delay=0, progress_callback=lambda sent, total, rate: progress.append((sent, total)))
+    assert uploaded_bytes(stub_server, upload_id) == UPLOAD
+    assert progress[-1] == (len(UPLOAD), len(UPLOAD))
+
+
+def test_interrupted_upload_continues_in_the_next_run(stub_server):
+    stub_server.drop_every = 2
+    with pytest.raises(Exception, match="Run the fit again to resume"):
+        pyofe_client.upload_resumable(requests.Session(), upload_url(stub_server), "a.sdf", io.BytesIO(UPLOAD),
+                                      chunk_size=CHUNK, retries=0, retry_delay=0)
+    stub_server.drop_every = 0
+    log = []
+    upload_id = pyofe_client.upload_resumable(requests.Session(), upload_url(stub_server), "a.sdf",
+                                              io.BytesIO(UPLOAD), chunk_size=CHUNK, log=log.append)
+    assert log[0].startswith(f"Resuming upload {upload_id} at ")
+    assert stub_server.chunks == 4      # two before the drop, two to finish
+    assert uploaded_bytes(stub_server, upload_id) == UPLOAD
+
+
+def test_chunked_fit_names_the_finished_upload(tmp_path, stub_server):
+    path = write(tmp_path / "big.sdf", UPLOAD)
+    client = FitClient(stub_server.url, session=requests.Session(), upload_mode="chunked",
+                       chunk_size=CHUNK, compression="none")
+    folder = client.fit(path, "Mono", download_folder=str(tmp_path / "out"))
+    with open(os.path.join(folder, "big", "big.json")) as f:
+        assert json.load(f)["input-bytes"] == len(UPLOAD)
+    assert stub_server.chunks == 4
+
+
+@pytest.mark.parametrize("url, upload", [
+    ("http://host:8142/fit", "http://host:8142/upload"),
+    ("http://host/api/v2/fit/", "http://host/api/v2/fit/upload"),
+    ("http://host/onefit/fit?key=1#top", "http://host/onefit/upload"),
+    ("http://host/fit/fitter", "http://host/fit/upload"),
+])
+def test_endpoints_replace_only_the_last_path_segment(url, upload):
+    assert FitClient(url).upload_url == upload
+    assert FitClient(url).list_url == upload[:-len("upload")] + "list"
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  COMPRESSION
+# ═══════════════════════════════════════════════════════════════════
+
+class CountingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.gets = []
+
+    def get(self, url, **kwargs):
+        self.gets.append(url)
+        return super().get(url, **kwargs)
+
+
+SDF_TEXT = "".join(f"{i} 0.1 {100 + i % 7}.25 0\n" for i in range(5000))
+
+
+@pytest.mark.parametrize("encoding", pyofe_client.client_encodings())
+def test_compressed_body_round_trips(encoding):
+    head, tail = b"head-", b"-tail"
+    body = pyofe_client.CompressedBody([head, io.BytesIO(SDF_TEXT.encode()), tail], encoding, block_size=4096)
+    first = b"".join(body)
+    body.seek(0)                        # as urllib3 does before a retry
+    assert b"".join(body) == first
+    assert pyofe_stub_server.decode_body(first, encoding) == head + SDF_TEXT.encode() + tail
+    assert len(first) < len(SDF_TEXT) // 4
+    compressed = pyofe_client.compress_bytes(SDF_TEXT.encode(), encoding)
+    assert pyofe_stub_server.decode_body(compressed, encoding) == SDF_TEXT.encode()
+
+
+def test_auto_compression_uses_what_the_server_accepts(tmp_path, stub_server):
+    session = CountingSession()
+    client = FitClient(stub_server.url, session=session, upload_mode="single")
+    assert set(client.list_functions()) == {"Monoexponential", "Biexponential"}
+
+    accepted = set(pyofe_stub_server.ACCEPTED_ENCODINGS)
+    assert client.accepted_encodings() == accepted
+    assert client.upload_encoding("a.sdf") == pyofe_client.client_encodings()[0]
+    assert client.upload_encoding("a.hdf5") is None
+    assert FitClient(stub_server.url, compression="none").upload_encoding("a.sdf") is None
+    assert session.gets == [client.list_url]        # read from the catalogue, never asked again
+
+    path = write(tmp_path / "sample.sdf", SDF_TEXT)
+    log = []
+    folder = client.fit(path, "Mono", download_folder=str(tmp_path / "out"), log=log.append)
+    assert f"Content-Encoding: {client.upload_encoding('a.sdf')}\n" in log
+    with open(os.path.join(folder, "sample", "sample.json")) as f:
+        assert json.load(f)["input-bytes"] == len(SDF_TEXT)      # the server got the original bytes
+    assert session.gets == [client.list_url]
+
+
+def test_catalogue_without_the_header_is_refreshed_once(tmp_path, stub_server):
+    session = CountingSession()
+    client = FitClient(stub_server.url, session=session)
+    entry = client.catalogue()
+    del entry["accept_encoding"]        # cached by a version that did not record it
+    pyofe_client.FunctionCatalogue(client.list_url)._store(entry)
+
+    assert client.accepted_encodings() == set(pyofe_stub_server.ACCEPTED_ENCODINGS)
+    assert client.accepted_encodings() == set(pyofe_stub_server.ACCEPTED_ENCODINGS)
+    assert len(session.gets) == 2
+    assert "accept_encoding" in client.catalogue(offline=True)
+
+
+def test_compressed_chunks_rebuild_the_original_file(tmp_path, stub_server):
+    path = write(tmp_path / "big.sdf", SDF_TEXT)
+    client = FitClient(stub_server.url, session=requests.Session(), upload_mode="chunked",
+                       chunk_size=20_000, compression="gzip")
+    folder = client.fit(path, "Mono", download_folder=str(tmp_path / "out"))
+    upload_id = pyofe_stub_server.upload_id_for("big.sdf", len(SDF_TEXT), pyofe_client.file_digest(path))
+    assert uploaded_bytes(stub_server, upload_id) == SDF_TEXT.encode()
+    with open(os.path.join(folder, "big", "big.json")) as f:
+        assert json.load(f)["input-bytes"] == len(SDF_TEXT)
+
+
+def test_unsupported_encoding_is_refused(stub_server):
+    response = requests.post(stub_server.url, data=b"x", headers={"Content-Encoding": "br"})
+    assert response.status_code == 415
+    assert response.headers["Accept-Encoding"] == ", ".join(pyofe_stub_server.ACCEPTED_ENCODINGS)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FUNCTION CATALOGUE
+# ═══════════════════════════════════════════════════════════════════
+
+class RecordingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.exchanges = []             # (conditional request headers, status)
+
+    def get(self, url, headers=None, **kwargs):
+        response = super().get(url, headers=headers, **kwargs)
+        self.exchanges.append((dict(headers or {}), response.status_code))
+        return response
+
+
+def catalogue(stub_server, tmp_path, session, ttl=3600):
+    return pyofe_client.FunctionCatalogue(pyofe_client.endpoint_url(stub_server.url, "list"), session,
+                                          folder=str(tmp_path / "functions"), ttl=ttl)
+
+
+def test_catalogue_is_revalidated_with_a_304(tmp_path, stub_server):
+    session = RecordingSession()
+    first = catalogue(stub_server, tmp_path, session).load()
+    assert first["text"] == pyofe_stub_server.FUNCTION_CATALOGUE
+    assert first["etag"] == pyofe_stub_server.CATALOGUE_ETAG
+    assert session.exchanges == [({}, 200)]
+
+    catalogue(stub_server, tmp_path, session).load()            # fresh: no request
+    assert len(session.exchanges) == 1
+
+    again = catalogue(stub_server, tmp_path, session).load(refresh=True)
+    headers, status = session.exchanges[-1]
+    assert status == 304
+    assert headers == {"If-None-Match": first["etag"], "If-Modified-Since": first["last_modified"]}
+    assert again["functions"] == first["functions"]
+    assert again["fetched"] >= first["fetched"]
+    assert catalogue(stub_server, tmp_path, session).cached()["fetched"] == again["fetched"]
+
+
+def test_expired_catalogue_is_revalidated_by_date(tmp_path, stub_server):
+    session = RecordingSession()
+    cat = catalogue(stub_server, tmp_path, session, ttl=0)
+    entry = cat.load()
+    entry["etag"] = None                # a server that only sends Last-Modified
+    cat._store(entry)
+    cat.load()
+    assert session.exchanges[-1] == ({"If-Modified-Since": entry["last_modified"]}, 304)
+
+
+def test_changed_catalogue_is_downloaded_again(tmp_path, stub_server):
+    session = RecordingSession()
+    cat = catalogue(stub_server, tmp_path, session)
+    entry = cat.load()
+    cat._store({**entry, "etag": '"old"', "functions": {"Gone": ""}})
+    assert cat.load(refresh=True)["functions"] == entry["functions"]
+    assert session.exchanges[-1][1] == 200
+
+
+def test_unreachable_server_falls_back_to_the_cached_copy(tmp_path, stub_server):
+    session = requests.Session()
+    entry = catalogue(stub_server, tmp_path, session).load()
+    down = pyofe_client.FunctionCatalogue("http://127.0.0.1:1/list", session, folder=str(tmp_path / "functions"))
+    down._store({**entry, "url": down.list_url})
+
+    stale = down.load(refresh=True)
+    assert stale["stale"] and stale["error"]
+    assert stale["functions"] == entry["functions"]
+    assert "stale" not in down.cached()
+    assert down.load(offline=True)["functions"] == entry["functions"]
+
+    with pytest.raises(Exception, match="No cached function catalogue"):
+        pyofe_client.FunctionCatalogue("http://127.0.0.1:1/other/list", session,
+                                       folder=str(tmp_path / "functions")).load(offline=True)
+    with pytest.raises(Exception, match="Failed to fetch functions"):
+        pyofe_client.FunctionCatalogue("http://127.0.0.1:1/other/list", session,
+                                       folder=str(tmp_path / "functions")).load()
+
+
+@pytest.mark.parametrize("text", [
+    "Mono\n  a*exp(-t/T)\nBi\n  b*exp(-t/T1)\n  + c\nBare\n",
+    "Mono: a*exp(-t/T)\nBi: b*exp(-t/T1) + c\nBare\n",
+    json.dumps({"functions": {"Mono": "a*exp(-t/T)", "Bi": "b*exp(-t/T1) + c", "Bare": ""}}),
+])
+def test_catalogue_formats(text):
+    functions = pyofe_client.parse_function_catalogue(text)
+    assert functions == {"Mono": "a*exp(-t/T)", "Bi": "b*exp(-t/T1) + c", "Bare": ""}
+    assert pyofe_client.parse_function_catalogue(pyofe_client.format_function_catalogue(functions)) == functions
+
+
+def test_list_command_and_name_resolution(stub_server, capsys):
+    assert pyofe_client.main(["list", "--url", stub_server.url, "--names"]) == 0
+    assert capsys.readouterr().out.split() == ["Monoexponential", "Biexponential"]
+    assert pyofe_client.main(["list", "--url", stub_server.url, "--offline"]) == 0
+    assert capsys.readouterr().out == pyofe_stub_server.FUNCTION_CATALOGUE
+
+    functions = pyofe_client.parse_function_catalogue(pyofe_stub_server.FUNCTION_CATALOGUE)
+    pyofe_client.FunctionCatalogue(pyofe_client.endpoint_url(stub_server.url, "list"))._store(
+        {"fetched": 0, "functions": {**functions, "Stretched": "Mz(t,M0,T,b)=M0*exp(-(t/T)**b)"}})
+    assert pyofe_client.resolve_function("Stretched", stub_server.url) == "Mz(t,M0,T,b)=M0*exp(-(t/T)**b)"
+    assert pyofe_client.resolve_function("Monoexponential", stub_server.url) == pyofe_client.MONOEXP
+    assert pyofe_client.resolve_function("Stretched") == "Stretched"
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FIT QUEUE
+# ═══════════════════════════════════════════════════════════════════
+
+def queue_job(tmp_path, stub_server, data, **client_options):
+    path = write(tmp_path / "sample.sdf", data)
+    client = FitClient(stub_server.url, session=pyofe_client.create_session(retries=0),
+                       compression="none", **client_options)
+    queue = pyofe_client.FitQueue(client, base_folder=str(tmp_path / "out"), max_workers=1,
+                                  max_retries=3, retry_delay=30)
+    params, _ = pyofe_client.build_fit_params(path, "Mono", "yes", "yes", "yes", "yes", "1.0")
+    return queue, queue.submit(path, params)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_subset_that_matches_nothing_fails_at_once(tmp_path, stub_server):
+    pytest.importorskip("h5py")
+    path = str(tmp_path / "zones.hdf5")
+    nmr_processing.write_zone_file(path, "sdf", [({"TAU": "1"}, [1.0, 2.0], [0.5, 0.25])])
+    client = FitClient(stub_server.url, upload_mode="single",
+                       subset=pyofe_hdf5.HDF5Subset(zones="5"))
+    queue = pyofe_client.FitQueue(client, base_folder=str(tmp_path / "out"), max_workers=1,
+                                  max_retries=3, retry_delay=30)
+    params, _ = pyofe_client.build_fit_params(path, "Mono", "yes", "yes", "yes", "yes", "1.0")
+    job = queue.submit(path, params)
+    queue.wait()
+    queue.shutdown()
+    assert (job.status, job.attempts) == (pyofe_client.JOB_FAILED, 1)
+    assert "No zone of zones.hdf5" in job.error
+    assert stub_server.requests == 0
+
+
+def test_cancel_interrupts_the_backoff_wait(tmp_path, stub_server):
+    stub_server.fail_every = 1
+    queue, job = queue_job(tmp_path, stub_server, "ZONE 1\n", upload_mode="single")
+    wait_for(lambda: job.status == pyofe_client.JOB_RETRYING)
+    started = time.monotonic()
+    queue.cancel(job)
+    queue.wait()
+    assert job.status == pyofe_client.JOB_CANCELLED
+    assert time.monotonic() - started < 5        # not the 30 s backoff
+    assert (job.attempts, stub_server.requests) == (1, 1)
+
+
+def test_cancel_stops_a_chunked_upload(tmp_path, stub_server):
+    size, chunk = 8 * 1024 ** 2, 4096
+    queue, job = queue_job(tmp_path, stub_server, os.urandom(size), upload_mode="chunked", chunk_size=chunk)
+    wait_for(lambda: stub_server.chunks > 0)
+    queue.cancel(job)
+    queue.wait()
+    assert job.status == pyofe_client.JOB_CANCELLED
+    assert stub_server.chunks < size // chunk
+    assert stub_server.requests == 0             # /fit never sent
+
+
+class RefusingUploadSession(requests.Session):
+    """Answers every request to open an upload with status, as a proxy in front of the server might."""
+
+    def __init__(self, status, body=b"Forbidden"):
+        super().__init__()
+        self.status = status
+        self.body = body
+
+    def post(self, url, **kwargs):
+        if url.endswith("/upload"):
+            response = requests.Response()
+            response.status_code, response._content, response.url = self.status, self.body, url
+            return response
+        return super().post(url, **kwargs)
+
+
+@pytest.mark.parametrize("status, body", [(400, b"Bad request"), (403, b"Forbidden"), (500, b"Oops"),
+                                          (200, b"<html>proxy login</html>")])
+def test_auto_upload_falls_back_to_one_request(tmp_path, stub_server, monkeypatch, status, body):
+    path = write(tmp_path / "big.sdf", UPLOAD)
+    client = FitClient(stub_server.url, session=RefusingUploadSession(status, body), chunk_size=CHUNK,
+                       compression="none")
+    client.upload_mode = "chunked"
+    with open(path, "rb") as file, pytest.raises(Exception, match="does not accept chunked uploads"):
+        client.upload(path, "big.sdf", file)
+
+    client.upload_mode = "auto"
+    monkeypatch.setattr(pyofe_client, "CHUNKED_UPLOAD_MIN_SIZE", 0)
+    folder = client.fit(path, "Mono", download_folder=str(tmp_path / "out"))
+    with open(os.path.join(folder, "big", "big.json")) as f:
+        assert json.load(f)["input-bytes"] == len(UPLOAD)
+    assert stub_server.chunks == 0
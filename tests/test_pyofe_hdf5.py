@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+import pyofe_hdf5
+from pyofe_hdf5 import HDF5_SIGNATURE, probe_hdf5, signature_offset
+
+
+@pytest.fixture(autouse=True)
+def fresh_probes():
+    pyofe_hdf5._probe_memo.clear()
+
+
+def write_signed(path, offset, tail=b"\0" * 64):
+    # Just the signature where a user block of `offset` bytes would put it
+    path.write_bytes(b"U" * offset + HDF5_SIGNATURE + tail)
+    return str(path)
+
+
+def write_hdf5(path, userblock_size=0, zones=2):
+    h5py = pytest.importorskip("h5py")
+    with h5py.File(path, "w", userblock_size=userblock_size) as f:
+        f.attrs["sample"] = "water"
+        for zone in range(1, zones + 1):
+            group = f.create_group(f"zone{zone:04d}")
+            group.attrs["freq_khz"] = 10.0 * zone
+            group.create_dataset("tau", data=[1.0, 2.0, 3.0])
+    return str(path)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  SIGNATURE
+# ═══════════════════════════════════════════════════════════════════
+
+@pytest.mark.parametrize("offset", [0, 512, 1024, 4096])
+def test_signature_is_found_after_a_user_block(tmp_path, offset):
+    assert signature_offset(write_signed(tmp_path / "data.bin", offset)) == offset
+
+
+@pytest.mark.parametrize("offset", [8, 700, 1536])
+def test_signature_elsewhere_is_not_hdf5(tmp_path, offset):
+    assert signature_offset(write_signed(tmp_path / "data.bin", offset)) is None
+
+
+def test_short_and_foreign_files_are_not_hdf5(tmp_path):
+    assert signature_offset(write_signed(tmp_path / "cut.bin", 512, tail=b"")) == 512
+    (tmp_path / "short.bin").write_bytes(HDF5_SIGNATURE[:-1])
+    assert signature_offset(str(tmp_path / "short.bin")) is None
+    (tmp_path / "empty.bin").write_bytes(b"")
+    assert signature_offset(str(tmp_path / "empty.bin")) is None
+    (tmp_path / "sample.sdf").write_text("ZONE 1\n" * 200)
+    assert not pyofe_hdf5.is_hdf5_file(str(tmp_path / "sample.sdf"))
+    assert not pyofe_hdf5.is_hdf5_file(str(tmp_path / "missing.h5"))
+
+
+@pytest.mark.parametrize("userblock_size", [512, 2048])
+def test_file_with_a_user_block_is_probed(tmp_path, userblock_size):
+    path = write_hdf5(tmp_path / "data.dat", userblock_size=userblock_size)
+    probe = probe_hdf5(path)
+    assert probe.offset == userblock_size
+    assert probe.error is None
+    assert [zone for zone, _, _ in probe.zones] == ["zone0001", "zone0002"]
+    assert probe.zones[1][1] == {"sample": "water", "freq_khz": 20.0}
+    assert probe.zones[0][2] == {"tau": ((3,), "float64")}
+    assert "2 zones" in probe.describe()
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  PROBE CACHE
+# ═══════════════════════════════════════════════════════════════════
+
+def test_probe_is_reused_while_the_file_is_unchanged(tmp_path, monkeypatch):
+    path = write_signed(tmp_path / "data.bin", 512)
+    calls = []
+    monkeypatch.setattr(pyofe_hdf5, "signature_offset",
+                        lambda file_path: calls.append(file_path) or signature_offset(file_path))
+    first = probe_hdf5(path, summary=False)
+    assert probe_hdf5(path, summary=False) is first
+    assert pyofe_hdf5.is_hdf5_file(path)
+    assert len(calls) == 1
+
+
+def test_changed_mtime_invalidates_the_probe(tmp_path):
+    path = write_signed(tmp_path / "data.bin", 512)
+    first = probe_hdf5(path, summary=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    second = probe_hdf5(path, summary=False)
+    assert second is not first
+    assert second.offset == 512
+
+
+def test_changed_size_invalidates_the_probe(tmp_path):
+    path = write_signed(tmp_path / "data.bin", 512)
+    stat = os.stat(path)
+    assert probe_hdf5(path, summary=False).is_hdf5
+    (tmp_path / "data.bin").write_bytes(b"U" * 2048)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))     # same mtime, other size
+    assert not probe_hdf5(path, summary=False).is_hdf5
+
+
+def test_rewritten_file_is_summarised_again(tmp_path):
+    path = write_hdf5(tmp_path / "data.h5", zones=2)
+    first = probe_hdf5(path, summary=False)
+    assert not first.summarised
+    assert probe_hdf5(path) is first and len(first.zones) == 2
+
+    stat = os.stat(path)
+    write_hdf5(tmp_path / "data.h5", zones=3)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert len(probe_hdf5(path).zones) == 3
+
+
+def test_cache_keeps_the_most_recent_probes(tmp_path, monkeypatch):
+    monkeypatch.setattr(pyofe_hdf5, "PROBE_CACHE_SIZE", 2)
+    paths = [write_signed(tmp_path / f"data{n}.bin", 0) for n in range(3)]
+    probes = [probe_hdf5(path, summary=False) for path in paths]
+    assert probe_hdf5(paths[2], summary=False) is probes[2]
+    assert probe_hdf5(paths[0], summary=False) is not probes[0]
+    assert len(pyofe_hdf5._probe_memo) == 2
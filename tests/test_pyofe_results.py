@@ -0,0 +1,170 @@
+import math
+import re
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+import pyofe_results
+from pyofe_results import FormulaError, compile_formula, create_custom_data, parse_results_table
+
+RESULTS = """# file, T, R1, error
+a.sdf, 25, 1.5, 0.1
+b.sdf, 25, 2.5, 0.3
+
+c.sdf, 35, 4.0, 0.2
+d.sdf, 15, 0.5, 0.4
+"""
+
+
+def legacy_custom_rows(formulas, text):
+    """create_custom_data_file of the original GUI: eval() per row, dict grouping."""
+    formulas = [re.sub(r'\$(\d+)', r'v\1', formula) for formula in formulas]
+    rows = []
+    for line in text.strip().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        names = {'sqrt': math.sqrt, 'log': math.log, 'log10': math.log10, 'exp': math.exp,
+                 'sin': math.sin, 'cos': math.cos, 'tan': math.tan, 'pi': math.pi, 'e': math.e}
+        for i, col in enumerate(line.split(","), start=1):
+            try:
+                names[f'v{i}'] = float(col.strip())
+            except ValueError:
+                names[f'v{i}'] = 0.0
+        rows.append([eval(formula, {"__builtins__": None}, names) for formula in formulas])
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row[0]].append(row)
+    return [[sum(row[i] for row in group) / len(group) for i in range(len(group[0]))]
+            for group in grouped.values()]
+
+
+def table(text=RESULTS):
+    return parse_results_table(text)
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  RESULTS TABLE
+# ═══════════════════════════════════════════════════════════════════
+
+def test_table_skips_comments_and_blank_lines():
+    parsed = table()
+    assert len(parsed) == 4
+    assert parsed.lines.tolist() == [2, 3, 5, 6]
+    np.testing.assert_array_equal(parsed.column(1), np.zeros(4))      # text counts as 0
+    np.testing.assert_array_equal(parsed.column(3), [1.5, 2.5, 4.0, 0.5])
+
+
+def test_ragged_table():
+    parsed = table("1, 2, 3\n4, 5\n")
+    assert parsed.widths.tolist() == [3, 2]
+    assert math.isnan(parsed.values[1, 2])
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  FORMULAS
+# ═══════════════════════════════════════════════════════════════════
+
+@pytest.mark.parametrize("formula", [
+    "$2", "1/$3", "$3 * $4 + 2", "-$3 ** 2", "$2 // 7 % 3", "($3 > 1) * $4",
+    "1 < $3 <= 2.5", "sqrt($3) + log($4) - exp(-$4)", "log10($2) * pi / e",
+    "sin($3) + cos($3) + tan($4)",
+])
+def test_formula_matches_eval(formula):
+    parsed = table()
+    names = {'sqrt': math.sqrt, 'log': math.log, 'log10': math.log10, 'exp': math.exp,
+             'sin': math.sin, 'cos': math.cos, 'tan': math.tan, 'pi': math.pi, 'e': math.e}
+    expected = []
+    for row in parsed.values:
+        names.update({f"v{i}": value for i, value in enumerate(row.tolist(), 1)})
+        expected.append(eval(re.sub(r'\$(\d+)', r'v\1', formula), {"__builtins__": None}, names))
+    np.testing.assert_allclose(compile_formula(formula)(parsed), expected, rtol=1e-15)
+
+
+def test_formulas_are_cached_by_text():
+    assert compile_formula("$2 + $3") is compile_formula("$2 + $3")
+    assert compile_formula("$2 + $3").columns == (2, 3)
+
+
+@pytest.mark.parametrize("formula, message", [
+    ("__import__('os').system('true')", "only sqrt, log"),
+    ("().__class__.__bases__", "is not allowed"),
+    ("$2.real", "'$2.real' is not allowed"),
+    ("(lambda: 1)()", "only sqrt, log"),
+    ("lambda: 1", "'lambda: 1' is not allowed"),
+    ("[x for x in (1, 2)]", "is not allowed"),
+    ("$2 if $3 else $4", "is not allowed"),
+    ("$2[0]", "is not allowed"),
+    ("open", "unknown name 'open'"),
+    ("x + 1", "unknown name 'x'"),
+    ("sqrt", "sqrt is a function, use sqrt(...)"),
+    ("sqrt($2, $3)", "sqrt() takes exactly one argument"),
+    ("sqrt(x=$2)", "sqrt() takes exactly one argument"),
+    ("'abc'", "'abc' is not a number"),
+    ("True", "True is not a number"),
+    ("$2 @ $3", "operator MatMult is not allowed"),
+    ("$2 << 1", "operator LShift is not allowed"),
+    ("not $2", "operator Not is not allowed"),
+    ("$2 in $3", "comparison In is not allowed"),
+    ("$2 is $3", "comparison Is is not allowed"),
+    ("$0 + 1", "columns are numbered from $1"),
+    ("$2 +", "Error in '$2 +': invalid syntax"),
+])
+def test_unsafe_or_invalid_formulas_are_rejected(formula, message):
+    with pytest.raises(FormulaError) as raised:
+        compile_formula(formula)
+    assert message in str(raised.value)
+    assert raised.value.formula == formula
+
+
+def test_errors_point_at_the_offending_character():
+    with pytest.raises(FormulaError, match=r"at character 6: unknown name 'bad'"):
+        compile_formula("$2 + bad")
+
+
+def test_evaluation_errors_name_the_line_and_columns():
+    parsed = table("1, 2\n3, 0\n")
+    with pytest.raises(FormulaError, match=r"on line 2: \$1 = 3, \$2 = 0: divide by zero"):
+        compile_formula("$1 / $2")(parsed)
+    with pytest.raises(FormulaError, match=r"on line 1: \$1 = 1, \$2 = 2: invalid value"):
+        compile_formula("log($1 - $2)")(parsed)
+    with pytest.raises(FormulaError, match=r"no column \$3 on line 1 \(2 columns\)"):
+        compile_formula("$3")(parsed)
+
+
+def test_nan_inputs_pass_through():
+    parsed = table("1, 2\n3, nan\n")
+    np.testing.assert_array_equal(compile_formula("$2 * 2")(parsed), [4.0, np.nan])
+
+
+# ═══════════════════════════════════════════════════════════════════
+#  CUSTOM PLOT DATA
+# ═══════════════════════════════════════════════════════════════════
+
+def test_average_by_first_column_keeps_first_appearance_order():
+    values = np.array([[3.0, 1.0], [1.0, 2.0], [3.0, 5.0], [2.0, 4.0], [1.0, 4.0]])
+    np.testing.assert_array_equal(pyofe_results.average_by_first_column(values),
+                                  [[3.0, 3.0], [1.0, 3.0], [2.0, 4.0]])
+
+
+@pytest.mark.parametrize("formulas", [["$2", "$3"], ["$2", "$3 * 2 + $4", "1/$3"], ["$4 > 0.2", "$3"]])
+def test_create_custom_data_matches_original_output(tmp_path, formulas):
+    results = tmp_path / "fit_results.dat"
+    results.write_text(RESULTS)
+    output = tmp_path / "custom_plot_data.dat"
+    rows = legacy_custom_rows(formulas, RESULTS)
+    assert create_custom_data(formulas, str(results), str(output)) == len(rows)
+    expected = "\n".join(" ".join(map(str, map(float, row))) for row in rows)
+    assert output.read_text() == expected
+
+
+def test_custom_data_input_errors(tmp_path):
+    with pytest.raises(ValueError, match="No formulas provided"):
+        pyofe_results.custom_data([" ", ""], str(tmp_path / "missing.dat"))
+    with pytest.raises(ValueError, match="not found"):
+        pyofe_results.custom_data(["$1"], str(tmp_path / "missing.dat"))
+    empty = tmp_path / "empty.dat"
+    empty.write_text("# only a comment\n")
+    with pytest.raises(ValueError, match="is empty"):
+        pyofe_results.custom_data(["$1"], str(empty))